@@ -90,4 +90,10 @@ class LockManagerInterface(object):
       
       timeout : -1 for infinite, positive value for number of seconds. 
                 Could be None, fall back to a default.      
-      """
\ No newline at end of file
+      """
+
+   def getLockCount(self):
+      """
+      optional - returns the number of locks held, reported by the metrics 
+      of the admin pages (see adminserver.py).
+      """
@@ -0,0 +1,453 @@
+"""
+Running PyFileServer with ext_asyncore_server
+=============================================
+
+ext_asyncore_server.py is an alternative to the bundled ext_wsgiutils_server.py
+for servers holding many mostly idle persistent connections (e.g. Windows
+WebDAV clients, which keep their connections open between operations).
+
+Usage::
+
+      usage: python ext_asyncore_server.py [options] [config-file]
+
+      config-file:
+        The configuration file for PyFileServer. if omitted, the application
+        will look for a file named 'PyFileServer.conf' in the current directory
+
+      options:
+        --port=PORT  Port to serve on (default: 8080)
+        --host=HOST  Host to serve from (default: localhost, which is only
+                     accessible from the local computer; use 0.0.0.0 to make your
+                     application public)
+        --idle-timeout=SECONDS
+                     Seconds before an idle persistent connection is closed
+                     (default: 15)
+        --max-requests=NUMBER
+                     Requests served on a connection before it is closed, 1
+                     disables persistent connections (default: 100)
+        --workers=NUMBER
+                     Worker threads running the application (default: 16)
+        --max-connections=NUMBER
+                     Open connections, further connections are refused with
+                     503 (default: 1000)
+        --request-timeout=SECONDS
+                     Deadline for serving a request (default: none)
+        -h, --help   show this help message and exit
+
+or from Python::
+
+      import ext_asyncore_server
+      ext_asyncore_server.serve({'port': 8080}, PyFileApp('PyFileServer.conf'))
+
+
+About ext_asyncore_server
+-------------------------
+
+A single thread runs an asyncore event loop that accepts connections and
+waits on all idle connections, reading request headers as they arrive. Only
+when the complete header of a request has been received is the connection
+handed to one of a fixed number of worker threads, which reads the request
+body, runs the (blocking) WSGI application and writes the response, using the
+request handling of ext_wsgiutils_server (``ExtHandler``). Pipelined requests
+already received are served by the same worker, after which the connection
+is handed back to the event loop. An idle connection thus costs a socket and
+a small buffer, but no thread.
+
+Responses are written by the worker threads, so a slow client never blocks the
+event loop. Python 2 provides no ``sendfile``, so file content is copied
+through the worker thread as with ext_wsgiutils_server.
+
+When the event loop supports ``poll`` (not on Windows) the number of
+connections is not limited by ``select``.
+
+"""
+
+
+from optparse import Option, OptionParser
+
+import sys, logging, socket, select, time, threading, Queue, asyncore
+import traceback, StringIO
+
+from ext_wsgiutils_server import ExtHandler, IDLE_TIMEOUT, MAX_REQUESTS, MAX_DRAIN_SIZE, WORKERS, SERVER_BUSY, QUEUE_RETRY_AFTER, installReloadHandler
+
+MAX_CONNECTIONS = 1000
+
+# a request header must arrive within this many bytes
+MAX_HEADER_SIZE = 65536
+
+RECV_SIZE = 65536
+
+
+def _socketpair():
+   if hasattr(socket, 'socketpair'):
+      return socket.socketpair()
+   # Windows: a loopback connection
+   listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   listener.bind(('127.0.0.1', 0))
+   listener.listen(1)
+   client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   client.connect(listener.getsockname())
+   (server, address) = listener.accept()
+   listener.close()
+   return (server, client)
+
+
+class _ConnectionInput(object):
+   """
+   Input stream of a connection. The event loop feed()s it the data received
+   while the connection waits for a request; the worker thread then reads
+   the request from it, and from the (blocking) socket once the buffered data
+   is used up. Data of following requests stays buffered for the next
+   request.
+   """
+   def __init__(self, sock):
+      self._sock = sock
+      self._buffer = ''
+
+   def feed(self, data):
+      self._buffer += data
+
+   def getBufferedSize(self):
+      return len(self._buffer)
+
+   def hasRequestHeader(self):
+      # empty lines before a request line are ignored (rfc 2616 4.1)
+      buffered = self._buffer.lstrip('\r\n')
+      return '\r\n\r\n' in buffered or '\n\n' in buffered
+
+   def _fill(self):
+      data = self._sock.recv(RECV_SIZE)
+      self._buffer += data
+      return len(data) > 0
+
+   def read(self, size=-1):
+      if size is None or size < 0:
+         while self._fill():
+            pass
+         size = len(self._buffer)
+      while len(self._buffer) < size and self._fill():
+         pass
+      data = self._buffer[:size]
+      self._buffer = self._buffer[size:]
+      return data
+
+   def readline(self, size=-1):
+      while True:
+         newline = self._buffer.find('\n')
+         if newline >= 0:
+            end = newline + 1
+            break
+         if size >= 0 and len(self._buffer) >= size:
+            end = size
+            break
+         if not self._fill():
+            end = len(self._buffer)
+            break
+      if size >= 0:
+         end = min(end, size)
+      data = self._buffer[:end]
+      self._buffer = self._buffer[end:]
+      return data
+
+   def close(self):
+      pass
+
+
+class AsyncExtHandler (ExtHandler):
+   """
+   ExtHandler serving one request at a time on behalf of the event loop,
+   instead of serving the whole connection from its constructor.
+   """
+   def __init__ (self, connection, client_address, server):
+      self.request = connection
+      self.connection = connection
+      self.client_address = client_address
+      self.server = server
+      self.timeout = server.idleTimeout
+      self.rfile = _ConnectionInput(connection)
+      self.wfile = connection.makefile('wb', 0)
+      self.requestCount = 0
+      self.close_connection = 0
+      self.setNoDelay()
+
+
+class _AsyncConnection (asyncore.dispatcher):
+   def __init__ (self, server, sock, client_address):
+      asyncore.dispatcher.__init__ (self, sock, map=server.socketMap)
+      self.server = server
+      self.handler = AsyncExtHandler(sock, client_address, server)
+      self.lastActivity = time.time()
+      self._closed = False
+
+   def writable (self):
+      # responses are written by the worker threads
+      return False
+
+   def handle_read (self):
+      data = self.recv(RECV_SIZE)
+      if not data:
+         return
+      self.lastActivity = time.time()
+      self.handler.rfile.feed(data)
+      if self.handler.rfile.hasRequestHeader():
+         self.server.dispatchConnection(self)
+      elif self.handler.rfile.getBufferedSize() > MAX_HEADER_SIZE:
+         logging.warning ("Request header from %s too long" % self.addr[0])
+         self.close()
+
+   def handle_close (self):
+      self.close()
+
+   def handle_error (self):
+      errorMsg = StringIO.StringIO()
+      traceback.print_exc(file=errorMsg)
+      logging.error (errorMsg.getvalue())
+      self.close()
+
+   def close (self):
+      if not self._closed:
+         self._closed = True
+         self.server.connectionClosed()
+         # the file object of the handler shares the socket, so closing the
+         # socket alone does not end the connection
+         try:
+            self.handler.wfile.close()
+            self.socket.shutdown(socket.SHUT_RDWR)
+         except socket.error:
+            pass
+      asyncore.dispatcher.close(self)
+
+
+class _Waker (asyncore.dispatcher):
+   """
+   Wakes the event loop to take back connections from the worker threads.
+   """
+   def __init__ (self, server):
+      (readsock, self._writesock) = _socketpair()
+      self._writesock.setblocking(0)
+      asyncore.dispatcher.__init__ (self, readsock, map=server.socketMap)
+      self.server = server
+
+   def wake (self):
+      try:
+         self._writesock.send('x')
+      except socket.error:
+         pass # the buffer is full, the loop wakes up anyway
+
+   def writable (self):
+      return False
+
+   def handle_read (self):
+      try:
+         self.recv(4096)
+      except socket.error:
+         pass
+      self.server.takeBackConnections()
+
+   def close (self):
+      self._writesock.close()
+      asyncore.dispatcher.close(self)
+
+
+class AsyncExtServer (asyncore.dispatcher):
+   def __init__ (self, serverAddress, wsgiApplications, idleTimeout=IDLE_TIMEOUT, maxRequests=MAX_REQUESTS, requestTimeout=None, workers=WORKERS, maxConnections=MAX_CONNECTIONS):
+      self.socketMap = {}
+      asyncore.dispatcher.__init__ (self, map=self.socketMap)
+      self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+      self.set_reuse_addr()
+      self.bind(serverAddress)
+      self.listen(128)
+      self.server_address = self.socket.getsockname()
+
+      self.idleTimeout = idleTimeout
+      self.maxRequests = maxRequests
+      self.requestTimeout = requestTimeout
+      self.maxDrainSize = MAX_DRAIN_SIZE
+      self.maxConnections = maxConnections
+      appList = []
+      for urlPath, wsgiApp in wsgiApplications.items():
+         appList.append ((urlPath, wsgiApp))
+      self.wsgiApplications = appList
+      self.serverShuttingDown = 0
+      self.multiprocess = 0
+
+      self._connectionCount = 0
+      self._requestQueue = Queue.Queue()
+      self._handbackQueue = Queue.Queue()
+      self._workerState = threading.local()
+      self._waker = _Waker(self)
+      self._workers = []
+      for i in range(workers):
+         worker = threading.Thread(target=self._workerLoop, name='ext_asyncore-worker-%d' % (i + 1))
+         worker.setDaemon(True)
+         worker.start()
+         self._workers.append(worker)
+
+   def writable (self):
+      return False
+
+   def handle_accept (self):
+      try:
+         accepted = self.accept()
+      except socket.error:
+         return
+      if accepted is None:
+         return
+      (sock, client_address) = accepted
+      if self._connectionCount >= self.maxConnections:
+         logging.warning ("Connection from %s rejected, too many connections" % client_address[0])
+         try:
+            sock.send(SERVER_BUSY % QUEUE_RETRY_AFTER)
+         except socket.error:
+            pass
+         sock.close()
+         return
+      self._connectionCount += 1
+      _AsyncConnection(self, sock, client_address)
+
+   def handle_error (self):
+      errorMsg = StringIO.StringIO()
+      traceback.print_exc(file=errorMsg)
+      logging.error (errorMsg.getvalue())
+
+   def dispatchConnection (self, connection):
+      # called from the event loop: the connection leaves the loop until a
+      # worker hands it back. del_channel() would forget the file number
+      del self.socketMap[connection._fileno]
+      self._requestQueue.put( (connection, time.time()) )
+
+   def takeBackConnections (self):
+      # called from the event loop
+      while True:
+         try:
+            (connection, keepOpen) = self._handbackQueue.get_nowait()
+         except Queue.Empty:
+            return
+         if keepOpen:
+            connection.socket.setblocking(0)
+            connection.add_channel()
+            connection.lastActivity = time.time()
+         else:
+            connection.close()
+
+   def connectionClosed (self):
+      # called from the event loop
+      self._connectionCount -= 1
+
+   def _workerLoop (self):
+      while True:
+         queued = self._requestQueue.get()
+         if queued is None:
+            return
+         (connection, dispatched) = queued
+         self._workerState.queueWait = time.time() - dispatched
+         handler = connection.handler
+         try:
+            connection.socket.setblocking(1)
+            connection.socket.settimeout(self.idleTimeout)
+            handler.handle_one_request()
+            # pipelined requests received meanwhile
+            while not handler.close_connection and handler.rfile.hasRequestHeader():
+               self._workerState.queueWait = 0.0
+               handler.handle_one_request()
+         except:
+            errorMsg = StringIO.StringIO()
+            traceback.print_exc(file=errorMsg)
+            logging.error (errorMsg.getvalue())
+            handler.close_connection = 1
+         if handler.close_connection:
+            try:
+               handler.wfile.close()
+               connection.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+               pass
+         self._handbackQueue.put( (connection, not handler.close_connection) )
+         self._waker.wake()
+
+   def isBusy (self):
+      # idle connections are held by the event loop and cost no worker, so
+      # they are kept open however many requests are waiting
+      return False
+
+   def getQueueWait (self):
+      return getattr(self._workerState, 'queueWait', 0.0)
+
+   def closeIdleConnections (self):
+      expiretime = time.time() - self.idleTimeout
+      for dispatcher in self.socketMap.values():
+         if isinstance(dispatcher, _AsyncConnection) and dispatcher.lastActivity < expiretime:
+            dispatcher.close()
+
+   def serve_forever (self):
+      usePoll = hasattr(select, 'poll')
+      while not self.serverShuttingDown:
+         asyncore.loop(timeout=1.0, use_poll=usePoll, map=self.socketMap, count=1)
+         self.closeIdleConnections()
+
+   def server_close (self):
+      self.serverShuttingDown = 1
+      for worker in self._workers:
+         self._requestQueue.put(None)
+      asyncore.close_all(self.socketMap)
+
+
+def serve(conf, app):
+    requestTimeout = conf.get('request_timeout', None)
+    if requestTimeout is not None:
+        requestTimeout = float(requestTimeout)
+    server = AsyncExtServer(
+        (conf.get('host', 'localhost'),
+         int(conf.get('port', 8080))), {'': app},
+        idleTimeout=float(conf.get('idle_timeout', IDLE_TIMEOUT)),
+        maxRequests=int(conf.get('max_requests', MAX_REQUESTS)),
+        requestTimeout=requestTimeout,
+        workers=int(conf.get('workers', WORKERS)),
+        maxConnections=int(conf.get('max_connections', MAX_CONNECTIONS)))
+    installReloadHandler(app)
+    server.serve_forever()
+
+options = [
+    Option('--port',
+           metavar="PORT",
+           help='Port to serve on (default: 8080)'),
+    Option('--host',
+           metavar="HOST",
+           help='Host to serve from (default: localhost, which is only accessible from the local computer; use 0.0.0.0 to make your application public)'),
+    Option('--idle-timeout',
+           metavar="SECONDS",
+           help='Seconds before an idle persistent connection is closed (default: %d)' % IDLE_TIMEOUT),
+    Option('--max-requests',
+           metavar="NUMBER",
+           help='Requests served on a connection before it is closed, 1 disables persistent connections (default: %d)' % MAX_REQUESTS),
+    Option('--workers',
+           metavar="NUMBER",
+           help='Worker threads running the application (default: %d)' % WORKERS),
+    Option('--max-connections',
+           metavar="NUMBER",
+           help='Open connections, further connections are refused with 503 (default: %d)' % MAX_CONNECTIONS),
+    Option('--request-timeout',
+           metavar="SECONDS",
+           help='Deadline for serving a request (default: none)'),
+    ]
+
+if __name__ == '__main__':
+    usage = """python ext_asyncore_server.py [options] [config-file]
+      
+config-file: 
+  The configuration file for PyFileServer. if omitted, the application 
+  will look for a file named 'PyFileServer.conf' in the current directory"""
+      
+    optparser = OptionParser(usage, option_list=options)    
+    (options, args) = optparser.parse_args()
+    optionsdict = dict()
+    for optionkey in options.__dict__.keys(): 
+        if not options.__dict__[optionkey] == None:
+            optionsdict[optionkey] = options.__dict__[optionkey]
+    
+    if len(args) > 0:
+       configfilespecified = args[0]
+    else:
+       configfilespecified = None
+    
+    from pyfileserver.mainappwrapper import PyFileApp        
+    serve(optionsdict, PyFileApp(configfilespecified))
@@ -20,6 +20,23 @@ To run as a standalone server using the bundled ext_wsgiutils_server.py::
         --host=HOST  Host to serve from (default: localhost, which is only
                      accessible from the local computer; use 0.0.0.0 to make your
                      application public)
+        --idle-timeout=SECONDS  
+                     Seconds before an idle persistent connection is closed 
+                     (default: 15)
+        --max-requests=NUMBER  
+                     Requests served on a connection before it is closed, 1
+                     disables persistent connections (default: 100)
+        --workers=NUMBER  
+                     Worker threads serving connections, 0 starts a thread
+                     per connection (default: 16)
+        --queue-size=NUMBER  
+                     Connections waiting for a worker before new connections
+                     are refused with 503 (default: 64)
+        --request-timeout=SECONDS  
+                     Deadline for serving a request (default: none)
+        --processes=NUMBER  
+                     Server processes sharing the port, SIGUSR2 replaces them
+                     (default: 1)
         -h, --help   show this help message and exit
       
       
@@ -51,6 +68,43 @@ About ext_wsgiutils_server
 ext_wsgiutils_server.py is an extension of the wsgiutils server in Paste. 
 It supports passing all of the HTTP and WebDAV (rfc 2518) methods.
 
+Request bodies sent with ``Transfer-Encoding: chunked`` are decoded as they
+are read, so the application receives them as a plain ``wsgi.input`` stream 
+with CONTENT_LENGTH left empty.
+
+The status line and headers of a response are sent in one write together with
+the start of the body, and small blocks of the body are collected into writes
+of up to 16 KB, so that small responses (e.g. to PROPFIND or LOCK) go out in 
+a single packet. 
+
+Connections are kept open between requests (HTTP/1.1 persistent connections, 
+including pipelined requests). Responses without a Content-Length header are 
+sent with chunked encoding to HTTP/1.1 clients, and the connection is closed 
+after them for HTTP/1.0 clients. Any part of a request body not read by the 
+application is read and discarded before the next request.
+
+Connections are served by a fixed pool of worker threads (``--workers``). 
+Connections beyond those wait in a queue of ``--queue-size`` connections, and
+are refused with ``503 Service Unavailable`` when the queue is full. While 
+connections are waiting, persistent connections are closed after their 
+current request, and idle ones within half a second, to free the worker. The
+time a connection waited for a worker is passed to the application as 
+``environ['ext_wsgiutils.queuewait']`` (in seconds), and 
+``PooledExtServer.getQueueStats()`` sums it up for sizing the pool.
+
+SIGHUP reloads the configuration of PyFileServer (see ``PyFileApp.reload()``)
+without interrupting the connections being served.
+
+With ``--processes`` (POSIX only) the server runs in several forked processes
+sharing the port, using more than one processor core. A supervising process
+restarts processes that exit, passes SIGHUP on to the processes, and on 
+SIGUSR2 replaces them with new processes (e.g. to run an updated 
+PyFileServer), letting the old processes finish their requests first. Locks
+and dead properties are then kept with the multi-process managers (see 
+``multiprocess`` in PyFileServer-example.conf). Background jobs and upload 
+sessions would remain private to the process that started them, so 
+``asyncjobs`` and ``uploadsessions`` are disabled in this mode.
+
 It includes code from the following sources:
 ``wsgiServer.py`` from wsgiKit <http://www.owlfish.com/software/wsgiutils/> under PSF license, 
 ``wsgiutils_server.py`` from Paste <http://pythonpaste.org> under PSF license, 
@@ -62,7 +116,7 @@ flexible handler method <http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe
 from optparse import Option, OptionParser
 
 import SimpleHTTPServer, SocketServer, BaseHTTPServer, urlparse
-import sys, logging
+import sys, os, errno, signal, logging, socket, time, threading, Queue
 import traceback, StringIO
 
 
@@ -79,9 +133,263 @@ SERVER_ERROR = """\
 </html>
 """
 
+# seconds a persistent connection may stay idle, and the number of requests 
+# served on a connection before it is closed 
+IDLE_TIMEOUT = 15
+MAX_REQUESTS = 100
+
+# an idle persistent connection checks this often whether connections are
+# waiting for its worker
+IDLE_POLL_INTERVAL = 0.5
+
+# worker threads and connections waiting for a worker of the pooled server.
+# Connections arriving while the queue is full are answered with 503 and 
+# asked to come back after QUEUE_RETRY_AFTER seconds
+WORKERS = 16
+QUEUE_SIZE = 64
+QUEUE_RETRY_AFTER = 5
+
+SERVER_BUSY = """\
+HTTP/1.1 503 Service Unavailable\r
+Retry-After: %d\r
+Content-Length: 0\r
+Connection: close\r
+\r
+"""
+
+# processes started by --processes share the listening port with SO_REUSEPORT
+# where available, otherwise they accept on one inherited socket. Processes
+# replaced (SIGUSR2) or stopped get GRACEFUL_TIMEOUT seconds to finish 
+# their requests, and a process exiting on its own is restarted after at 
+# least RESTART_DELAY seconds
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', None)
+GRACEFUL_TIMEOUT = 30
+RESTART_DELAY = 1
+
+# small blocks of a response are collected up to this size and sent in one 
+# write, together with the status line and headers
+COALESCE_SIZE = 16384
+
+# an unread request body up to this size is read and discarded to keep the 
+# connection open, larger bodies close the connection
+MAX_DRAIN_SIZE = 1048576
+
+# longest chunk-size line (size, extensions and CRLF) accepted in a chunked 
+# request body
+MAX_CHUNK_HEADER = 1024
+
+class ChunkedInputStream(object):
+   """
+   wsgi.input for request bodies sent with ``Transfer-Encoding: chunked``.
+   
+   Decodes the chunks as they are read from ``rfile``: read(size) never 
+   returns (or holds) more than ``size`` bytes, and returns '' once the last 
+   chunk and the trailer have been consumed. A malformed body raises IOError.
+   """
+   def __init__(self, rfile):
+      self._rfile = rfile
+      self._chunkremaining = 0
+      self._eof = False
+
+   def _readChunkHeader(self):
+      line = self._rfile.readline(MAX_CHUNK_HEADER)
+      if not line.endswith('\n'):
+         raise IOError('Invalid chunk header in request body')
+      try:
+         chunksize = int(line.split(';', 1)[0].strip(), 16)
+      except ValueError:
+         raise IOError('Invalid chunk size in request body')
+      if chunksize < 0:
+         raise IOError('Invalid chunk size in request body')
+      if chunksize == 0:
+         # last chunk - skip the trailer headers up to the empty line
+         while True:
+            line = self._rfile.readline(MAX_CHUNK_HEADER)
+            if not line.endswith('\n'):
+               raise IOError('Invalid trailer in request body')
+            if line.strip() == '':
+               break
+         self._eof = True
+      self._chunkremaining = chunksize
+
+   def _readChunkEnd(self):
+      if self._rfile.readline(MAX_CHUNK_HEADER).strip() != '':
+         raise IOError('Invalid chunk data in request body')
+
+   def read(self, size=-1):
+      if size is None or size < 0:
+         data = []
+         while True:
+            block = self.read(65536)
+            if not block:
+               break
+            data.append(block)
+         return ''.join(data)
+      if self._eof or size == 0:
+         return ''
+      if self._chunkremaining == 0:
+         self._readChunkHeader()
+         if self._eof:
+            return ''
+      data = self._rfile.read(min(size, self._chunkremaining))
+      if not data:
+         raise IOError('Request body ended within a chunk')
+      self._chunkremaining -= len(data)
+      if self._chunkremaining == 0:
+         self._readChunkEnd()
+      return data
+
+   def readline(self, size=-1):
+      line = []
+      linelength = 0
+      while size < 0 or linelength < size:
+         char = self.read(1)
+         if not char:
+            break
+         line.append(char)
+         linelength += 1
+         if char == '\n':
+            break
+      return ''.join(line)
+
+   def __iter__(self):
+      while True:
+         line = self.readline()
+         if not line:
+            break
+         yield line
+
+
+class LengthLimitedInput(object):
+   """
+   wsgi.input for request bodies of a known length (Content-Length, or 0 for 
+   requests without a body). Never reads beyond the end of the body, which 
+   on a persistent connection is the start of the next request.
+   """
+   def __init__(self, rfile, length):
+      self._rfile = rfile
+      self._remaining = length
+
+   def read(self, size=-1):
+      if size is None or size < 0 or size > self._remaining:
+         size = self._remaining
+      if size == 0:
+         return ''
+      data = self._rfile.read(size)
+      self._remaining -= len(data)
+      if len(data) < size:
+         self._remaining = 0 # connection closed by the client
+      return data
+
+   def readline(self, size=-1):
+      if size is None or size < 0 or size > self._remaining:
+         size = self._remaining
+      if size == 0:
+         return ''
+      data = self._rfile.readline(size)
+      self._remaining -= len(data)
+      return data
+
+   def __iter__(self):
+      while True:
+         line = self.readline()
+         if not line:
+            break
+         yield line
+
+
+class _ExpectContinueInput(object):
+   """
+   Sends the interim 100 Continue response when the application first reads 
+   the body of a request sent with ``Expect: 100-continue``.
+   """
+   def __init__(self, inputstream, handler):
+      self._inputstream = inputstream
+      self._handler = handler
+
+   def _sendContinue(self):
+      if not self._handler.wsgiSentContinue and not self._handler.wsgiSentHeaders:
+         self._handler.wfile.write('HTTP/1.1 100 Continue\r\n\r\n')
+         self._handler.wsgiSentContinue = 1
+
+   def read(self, size=-1):
+      self._sendContinue()
+      return self._inputstream.read(size)
+
+   def readline(self, size=-1):
+      self._sendContinue()
+      return self._inputstream.readline(size)
+
+   def __iter__(self):
+      self._sendContinue()
+      return iter(self._inputstream)
+
+
 class ExtHandler (BaseHTTPServer.BaseHTTPRequestHandler):
    
    _SUPPORTED_METHODS = ['HEAD','GET','PUT','POST','OPTIONS','TRACE','DELETE','PROPFIND','PROPPATCH','MKCOL','COPY','MOVE','LOCK','UNLOCK']
+
+   # persistent connections for HTTP/1.1 clients (and HTTP/1.0 clients 
+   # sending Connection: keep-alive)
+   protocol_version = 'HTTP/1.1'
+
+   def setup (self):
+      # idle connections are dropped after server.idleTimeout seconds
+      self.timeout = self.server.idleTimeout
+      BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+      self.requestCount = 0
+      self.setNoDelay()
+
+   def setNoDelay (self):
+      # responses are coalesced into few writes (see wsgiFlush), so they are
+      # sent at once rather than held back by Nagle's algorithm
+      try:
+         self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      except (socket.error, AttributeError):
+         pass
+
+   def handle (self):
+      # as BaseHTTPRequestHandler.handle, but waiting for the next request of
+      # a persistent connection in short polls, so that an idle connection 
+      # gives up its worker as soon as other connections are waiting
+      self.close_connection = 1
+      self.handle_one_request()
+      while not self.close_connection and self.waitForRequest():
+         self.handle_one_request()
+
+   def waitForRequest (self):
+      # True once the next request (or the end of the connection) can be 
+      # read, False if the connection is to be closed: idle for idleTimeout
+      # seconds, or idle while the server is busy
+      if self.getBufferedSize() != 0:
+         return True # pipelined request already read into rfile
+      idleUntil = time.time() + self.timeout
+      try:
+         try:
+            while True:
+               remaining = idleUntil - time.time()
+               if remaining <= 0:
+                  return False
+               self.connection.settimeout(min(remaining, IDLE_POLL_INTERVAL))
+               try:
+                  self.connection.recv(1, socket.MSG_PEEK)
+                  return True
+               except socket.timeout:
+                  if self.server.isBusy():
+                     return False
+         except socket.error:
+            return False
+      finally:
+         self.connection.settimeout(self.timeout)
+
+   def getBufferedSize (self):
+      # bytes received and buffered by rfile but not read yet, None if unknown
+      buffered = getattr(self.rfile, '_rbuf', None)
+      if isinstance(buffered, str):
+         return len(buffered) # python 2.4, 2.5
+      if hasattr(buffered, 'tell'):
+         return buffered.tell()
+      return None
    
    def log_message (self, *args):
       pass
@@ -124,8 +432,8 @@ class ExtHandler (BaseHTTPServer.BaseHTTPRequestHandler):
       if len(name)>3 and name[0:3] == 'do_' and name[3:] in self._SUPPORTED_METHODS:
          return self.handlerFunctionClosure(name)
       else:
-         self.send_error (501, 'Method Not Implemented.')
-         return
+         # handle_one_request answers 501 for unsupported methods
+         raise AttributeError(name)
 
    def runWSGIApp (self, application, scriptName, pathInfo, query):
       logging.info ("Running application with script name %s path %s" % (scriptName, pathInfo))
@@ -134,7 +442,7 @@ class ExtHandler (BaseHTTPServer.BaseHTTPRequestHandler):
             ,'wsgi.input': self.rfile
             ,'wsgi.errors': sys.stderr
             ,'wsgi.multithread': 1
-            ,'wsgi.multiprocess': 0
+            ,'wsgi.multiprocess': self.server.multiprocess
             ,'wsgi.run_once': 0
             ,'REQUEST_METHOD': self.command
             ,'SCRIPT_NAME': scriptName
@@ -150,9 +458,49 @@ class ExtHandler (BaseHTTPServer.BaseHTTPRequestHandler):
       for httpHeader, httpValue in self.headers.items():
          env ['HTTP_%s' % httpHeader.replace ('-', '_').upper()] = httpValue
 
+      if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+         # the body length is not known - the application reads until wsgi.input
+         # is exhausted. Content-Length must be ignored if sent (rfc 2616 4.4)
+         env['wsgi.input'] = ChunkedInputStream(self.rfile)
+         env['CONTENT_LENGTH'] = ''
+         env.pop('HTTP_CONTENT_LENGTH', None)
+      else:
+         # a request without Content-Length has no body (rfc 2616 4.3)
+         try:
+            contentLength = max(0, long(self.headers.get('Content-Length', 0)))
+         except ValueError:
+            contentLength = 0
+            self.close_connection = 1
+         env['wsgi.input'] = LengthLimitedInput(self.rfile, contentLength)
+
       # Setup the state
       self.wsgiSentHeaders = 0
+      self.wsgiSentContinue = 0
+      self.wsgiOutput = []
+      self.wsgiOutputSize = 0
+      self.wsgiFlushed = 0
       self.wsgiHeaders = []
+      self.wsgiChunked = 0
+      self.wsgiNoBody = 0
+
+      if self.headers.get('Expect', '').lower() == '100-continue' and self.request_version == 'HTTP/1.1':
+         env['wsgi.input'] = _ExpectContinueInput(env['wsgi.input'], self)
+
+      self.requestCount += 1
+      if self.requestCount == 1:
+         env['ext_wsgiutils.queuewait'] = self.server.getQueueWait()
+      else:
+         env['ext_wsgiutils.queuewait'] = 0.0
+      if self.requestCount >= self.server.maxRequests:
+         self.close_connection = 1
+
+      if self.server.requestTimeout:
+         # no single read or write may take longer than the request deadline,
+         # and writing stops once the deadline is reached
+         self.connection.settimeout(self.server.requestTimeout)
+         self.wsgiDeadline = time.time() + self.server.requestTimeout
+      else:
+         self.wsgiDeadline = None
 
       try:
          # We have there environment, now invoke the application
@@ -168,39 +516,152 @@ class ExtHandler (BaseHTTPServer.BaseHTTPRequestHandler):
          errorMsg = StringIO.StringIO()
          traceback.print_exc(file=errorMsg)
          logging.error (errorMsg.getvalue())
-         if not self.wsgiSentHeaders:
-            self.wsgiStartResponse('500 Server Error', [('Content-type', 'text/html')])
-         self.wsgiWriteData(SERVER_ERROR)
+         if not self.wsgiFlushed:
+            # nothing has been sent yet, the response can still be replaced
+            self.wsgiSentHeaders = 0
+            self.wsgiOutput = []
+            self.wsgiOutputSize = 0
+            self.wsgiChunked = 0
+            self.wsgiStartResponse('500 Server Error', [('Content-type', 'text/html'), ('Content-Length', str(len(SERVER_ERROR)))])
+            self.wsgiWriteData(SERVER_ERROR)
+         else:
+            # the response is cut short - only closing the connection tells
+            # the client so
+            self.close_connection = 1
+            return
       
       if (not self.wsgiSentHeaders):
-         # We must write out something!
-         self.wsgiWriteData (" ")
+         # the application sent no data, send the headers only
+         self.wsgiSendHeaders()
+      if self.wsgiChunked:
+         self.wsgiQueueOutput('0\r\n\r\n')
+      self.wsgiFlush()
+
+      if not self.close_connection:
+         self.drainRequestBody(env['wsgi.input'])
+      if self.wsgiDeadline is not None:
+         self.connection.settimeout(self.timeout)
       return
 
+   def drainRequestBody (self, inputStream):
+      # the unread rest of the request body must be consumed before the next
+      # request on the connection can be read
+      if self.headers.get('Expect', '').lower() == '100-continue' and not self.wsgiSentContinue:
+         # the client has been told not to send the body
+         self.close_connection = 1
+         return
+      drained = 0
+      try:
+         while drained <= self.server.maxDrainSize:
+            data = inputStream.read(65536)
+            if not data:
+               return
+            drained += len(data)
+      except IOError:
+         pass # malformed chunked body
+      self.close_connection = 1
+
    def wsgiStartResponse (self, response_status, response_headers, exc_info=None):
       if (self.wsgiSentHeaders):
          raise Exception ("Headers already sent and start_response called again!")
       # Should really take a copy to avoid changes in the application....
       self.wsgiHeaders = (response_status, response_headers)
-      return self.wsgiWriteData
+      return self.wsgiWrite
+
+   def wsgiSendHeaders (self):
+      status, headers = self.wsgiHeaders
+      statusCode = int (status [:status.find (' ')])
+      statusMsg = status [status.find (' ') + 1:]
+
+      if self.server.isBusy():
+         # a busy server frees the worker for the connections waiting
+         self.close_connection = 1
+
+      # the response must be delimited for the connection to be kept open: 
+      # by Content-Length, by chunked encoding, or by closing the connection
+      self.wsgiNoBody = self.command == 'HEAD' or statusCode < 200 or statusCode in (204, 304)
+      headerNames = [header.lower() for header, value in headers]
+      for header, value in headers:
+         if header.lower() == 'connection' and value.lower() == 'close':
+            self.close_connection = 1
+      if not self.wsgiNoBody and 'content-length' not in headerNames:
+         if self.request_version == 'HTTP/1.1' and not self.close_connection:
+            headers = list(headers) + [('Transfer-Encoding', 'chunked')]
+            self.wsgiChunked = 1
+         else:
+            self.close_connection = 1
+
+      self.wsgiSentHeaders = 1
+      if self.request_version == 'HTTP/0.9':
+         return
+
+      # the status line and headers are formatted into one block, which goes
+      # out with the first block of the body (same lines as send_response(),
+      # send_header() and end_headers() write one by one)
+      headerLines = ['%s %d %s\r\n' % (self.protocol_version, statusCode, statusMsg),
+                     'Server: %s\r\n' % self.version_string(),
+                     'Date: %s\r\n' % self.date_time_string()]
+      for header, value in headers:
+         headerLines.append('%s: %s\r\n' % (header, value))
+      if 'connection' in headerNames:
+         pass
+      elif self.close_connection:
+         headerLines.append('Connection: close\r\n')
+      elif self.request_version == 'HTTP/1.0':
+         headerLines.append('Connection: keep-alive\r\n')
+      headerLines.append('\r\n')
+      self.wsgiQueueOutput(''.join(headerLines))
+
+   def wsgiQueueOutput (self, data):
+      self.wsgiOutput.append(data)
+      self.wsgiOutputSize += len(data)
+      if self.wsgiOutputSize >= COALESCE_SIZE:
+         self.wsgiFlush()
+
+   def wsgiFlush (self):
+      if self.wsgiOutput:
+         self.wfile.write (''.join(self.wsgiOutput))
+         self.wsgiOutput = []
+         self.wsgiOutputSize = 0
+         self.wsgiFlushed = 1
+
+   def wsgiWrite (self, data):
+      # the write() callable returned by start_response: the data must be 
+      # sent before it returns
+      self.wsgiWriteData (data)
+      self.wsgiFlush()
 
    def wsgiWriteData (self, data):
       if (not self.wsgiSentHeaders):
-         status, headers = self.wsgiHeaders
          # Need to send header prior to data
-         statusCode = status [:status.find (' ')]
-         statusMsg = status [status.find (' ') + 1:]
-         self.send_response (int (statusCode), statusMsg)
-         for header, value in headers:
-            self.send_header (header, value)
-         self.end_headers()
-         self.wsgiSentHeaders = 1
+         self.wsgiSendHeaders()
       # Send the data
-      self.wfile.write (data)
+      if self.wsgiNoBody or not data:
+         return
+      if self.wsgiDeadline is not None and time.time() > self.wsgiDeadline:
+         raise socket.timeout('Request deadline of %s seconds exceeded' % self.server.requestTimeout)
+      if self.wsgiChunked:
+         self.wsgiQueueOutput ('%x\r\n%s\r\n' % (len(data), data))
+      else:
+         self.wsgiQueueOutput (data)
 
 class ExtServer (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
-   def __init__ (self, serverAddress, wsgiApplications, serveFiles=1):
-      BaseHTTPServer.HTTPServer.__init__ (self, serverAddress, ExtHandler)
+   def __init__ (self, serverAddress, wsgiApplications, serveFiles=1, idleTimeout=IDLE_TIMEOUT, maxRequests=MAX_REQUESTS, requestTimeout=None, listenSocket=None, reusePort=False):
+      # listenSocket: an already listening socket to accept on (inherited
+      # from the launching process), reusePort: bind with SO_REUSEPORT
+      self.reusePort = reusePort
+      if listenSocket is None:
+         BaseHTTPServer.HTTPServer.__init__ (self, serverAddress, ExtHandler)
+      else:
+         BaseHTTPServer.HTTPServer.__init__ (self, serverAddress, ExtHandler, False)
+         self.socket.close()
+         self.socket = listenSocket
+         self.server_address = listenSocket.getsockname()
+      self.multiprocess = 0
+      self.idleTimeout = idleTimeout
+      self.maxRequests = maxRequests
+      self.requestTimeout = requestTimeout
+      self.maxDrainSize = MAX_DRAIN_SIZE
       appList = []
       for urlPath, wsgiApp in wsgiApplications.items():
          appList.append ((urlPath, wsgiApp))
@@ -208,14 +669,293 @@ class ExtServer (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
       self.serveFiles = serveFiles
       self.serverShuttingDown = 0
 
+   def server_bind (self):
+      if self.reusePort:
+         self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+      BaseHTTPServer.HTTPServer.server_bind (self)
+
+   def getRequestThreads (self):
+      # threads serving requests, which a graceful shutdown waits for
+      return [thread for thread in threading.enumerate() if not thread.isDaemon() and thread is not threading.currentThread()]
+
+   def isBusy (self):
+      # True if connections are waiting to be served
+      return False
+
+   def getQueueWait (self):
+      # seconds the current connection waited to be served
+      return 0.0
+
+
+class PooledExtServer (ExtServer):
+   """
+   Serves connections with a fixed number of worker threads instead of a 
+   thread per connection. Accepted connections wait in a queue of queueSize
+   connections for the next free worker; when the queue is full the 
+   connection is answered with 503 Service Unavailable and Retry-After.
+
+   getQueueStats() returns the number of connections served and rejected 
+   and the average and longest time connections waited in the queue.
+   """
+   def __init__ (self, serverAddress, wsgiApplications, serveFiles=1, idleTimeout=IDLE_TIMEOUT, maxRequests=MAX_REQUESTS, requestTimeout=None, workers=WORKERS, queueSize=QUEUE_SIZE, listenSocket=None, reusePort=False):
+      ExtServer.__init__ (self, serverAddress, wsgiApplications, serveFiles, idleTimeout, maxRequests, requestTimeout, listenSocket, reusePort)
+      self._queue = Queue.Queue(queueSize)
+      self._workerState = threading.local()
+      self._statsLock = threading.Lock()
+      self._served = 0
+      self._rejected = 0
+      self._totalWait = 0.0
+      self._maxWait = 0.0
+      self._workers = []
+      for i in range(workers):
+         worker = threading.Thread(target=self._workerLoop, name='ext_wsgiutils-worker-%d' % (i + 1))
+         worker.setDaemon(True)
+         worker.start()
+         self._workers.append(worker)
+
+   def process_request (self, request, client_address):
+      try:
+         self._queue.put_nowait( (request, client_address, time.time()) )
+      except Queue.Full:
+         self._statsLock.acquire()
+         self._rejected += 1
+         self._statsLock.release()
+         logging.warning ("Connection from %s rejected, all workers busy" % client_address[0])
+         try:
+            request.settimeout(1)
+            request.sendall(SERVER_BUSY % QUEUE_RETRY_AFTER)
+         except socket.error:
+            pass
+         self.shutdown_request(request)
+
+   def _workerLoop (self):
+      while True:
+         queued = self._queue.get()
+         if queued is None:
+            return
+         (request, client_address, enqueued) = queued
+         queueWait = time.time() - enqueued
+         self._statsLock.acquire()
+         self._served += 1
+         self._totalWait += queueWait
+         self._maxWait = max(self._maxWait, queueWait)
+         self._statsLock.release()
+         self._workerState.queueWait = queueWait
+         try:
+            self.finish_request(request, client_address)
+         except:
+            self.handle_error(request, client_address)
+         self.shutdown_request(request)
+
+   def getRequestThreads (self):
+      return list(self._workers)
+
+   def isBusy (self):
+      return not self._queue.empty()
+
+   def getQueueWait (self):
+      return getattr(self._workerState, 'queueWait', 0.0)
+
+   def getQueueStats (self):
+      self._statsLock.acquire()
+      try:
+         averageWait = 0.0
+         if self._served > 0:
+            averageWait = self._totalWait / self._served
+         return {'workers': len(self._workers),
+                 'queued': self._queue.qsize(),
+                 'served': self._served,
+                 'rejected': self._rejected,
+                 'averagewait': averageWait,
+                 'maxwait': self._maxWait}
+      finally:
+         self._statsLock.release()
+
+   def server_close (self):
+      ExtServer.server_close (self)
+      for worker in self._workers:
+         self._queue.put(None)
+
+
+def makeServer(conf, app, listenSocket=None, reusePort=False):
+    serverAddress = (conf.get('host', 'localhost'), int(conf.get('port', 8080)))
+    requestTimeout = conf.get('request_timeout', None)
+    if requestTimeout is not None:
+        requestTimeout = float(requestTimeout)
+    workers = int(conf.get('workers', WORKERS))
+    if workers > 0:
+        server = PooledExtServer(serverAddress, {'': app},
+            idleTimeout=float(conf.get('idle_timeout', IDLE_TIMEOUT)),
+            maxRequests=int(conf.get('max_requests', MAX_REQUESTS)),
+            requestTimeout=requestTimeout,
+            workers=workers,
+            queueSize=int(conf.get('queue_size', QUEUE_SIZE)),
+            listenSocket=listenSocket,
+            reusePort=reusePort)
+    else:
+        server = ExtServer(serverAddress, {'': app},
+            idleTimeout=float(conf.get('idle_timeout', IDLE_TIMEOUT)),
+            maxRequests=int(conf.get('max_requests', MAX_REQUESTS)),
+            requestTimeout=requestTimeout,
+            listenSocket=listenSocket,
+            reusePort=reusePort)
+    return server
+
+def installReloadHandler(app):
+    # SIGHUP reloads the configuration of applications supporting it, in a 
+    # thread of its own so that the signal does not hold up the main thread
+    if hasattr(app, 'reload') and hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=app.reload).start())
 
 def serve(conf, app):
-    server = ExtServer(
-        (conf.get('host', 'localhost'),
-         int(conf.get('port', 8080))), {'': app})
+    server = makeServer(conf, app)
+    installReloadHandler(app)
     server.serve_forever()
 
 
+class ProcessSupervisor(object):
+    """
+    Runs the server in a number of forked processes (POSIX only).
+
+    Each process builds its own application with appFactory(). SIGHUP is
+    passed on to the processes, which reload their configuration. On SIGUSR2
+    a new set of processes is started, and the old processes stop accepting
+    connections and exit when their requests are finished. SIGTERM and SIGINT
+    stop all processes the same way. A process that exits on its own is 
+    restarted.
+    """
+    def __init__(self, conf, appFactory, processes):
+        self._conf = conf
+        self._appFactory = appFactory
+        self._processes = processes
+        self._listenSocket = None
+        if SO_REUSEPORT is None:
+            # no SO_REUSEPORT: all processes accept on the one socket
+            self._listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._listenSocket.bind((conf.get('host', 'localhost'), int(conf.get('port', 8080))))
+            self._listenSocket.listen(128)
+            # the processes poll for connections, only one gets each
+            self._listenSocket.setblocking(0)
+        self._children = {}  # pid -> start time
+        self._retiring = set()
+        self._replaceRequested = False
+        self._stopRequested = False
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._onReload)
+        signal.signal(signal.SIGUSR2, self._onReplace)
+        signal.signal(signal.SIGTERM, self._onStop)
+        signal.signal(signal.SIGINT, self._onStop)
+        signal.signal(signal.SIGALRM, self._onGraceExpired)
+        for i in range(self._processes):
+            self._startChild()
+        stopping = False
+        while self._children:
+            if self._stopRequested and not stopping:
+                stopping = True
+                logging.info ("Stopping %d server processes" % len(self._children))
+                self._retireChildren(self._children.keys())
+            if self._replaceRequested and not stopping:
+                self._replaceRequested = False
+                logging.info ("Replacing server processes")
+                oldchildren = self._children.keys()
+                for i in range(self._processes):
+                    self._startChild()
+                self._retireChildren(oldchildren)
+            try:
+                (pid, status) = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue # a signal, handled in the next round
+                raise
+            if pid not in self._children:
+                continue
+            started = self._children.pop(pid)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+            elif not stopping:
+                logging.warning ("Server process %d exited with status %d, restarting it" % (pid, status))
+                if time.time() - started < RESTART_DELAY:
+                    time.sleep(RESTART_DELAY)
+                self._startChild()
+
+    def _onReload(self, signum, frame):
+        for pid in self._children:
+            if pid not in self._retiring:
+                try:
+                    os.kill(pid, signal.SIGHUP)
+                except OSError:
+                    pass
+
+    def _onReplace(self, signum, frame):
+        self._replaceRequested = True
+
+    def _onStop(self, signum, frame):
+        self._stopRequested = True
+
+    def _onGraceExpired(self, signum, frame):
+        # the handler runs between two statements of the main loop, which may
+        # be adding or discarding pids; a copy is taken in one step
+        for pid in list(self._retiring):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def _retireChildren(self, pids):
+        for pid in pids:
+            self._retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        signal.alarm(GRACEFUL_TIMEOUT + 5)
+
+    def _startChild(self):
+        pid = os.fork()
+        if pid == 0:
+            exitcode = 0
+            try:
+                try:
+                    self._runChild()
+                except:
+                    logging.error (traceback.format_exc())
+                    exitcode = 1
+            finally:
+                os._exit(exitcode)
+        self._children[pid] = time.time()
+
+    def _runChild(self):
+        stopRequested = []
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopRequested.append(signum))
+
+        app = self._appFactory()
+        server = makeServer(self._conf, app, self._listenSocket, self._listenSocket is None)
+        installReloadHandler(app)
+        server.multiprocess = 1
+        server.timeout = 1 # handle_request() returns to check for SIGTERM
+        while not stopRequested:
+            server.handle_request()
+
+        # graceful stop: no new connections, connections are closed after
+        # their current request
+        server.maxRequests = 0
+        server.socket.close()
+        deadline = time.time() + GRACEFUL_TIMEOUT
+        requestThreads = server.getRequestThreads()
+        server.server_close()
+        for thread in requestThreads:
+            thread.join(max(0, deadline - time.time()))
+
+def serveProcesses(conf, appFactory, processes):
+    ProcessSupervisor(conf, appFactory, processes).run()
+
+
 description = """\
 Ext_WSGIUtils is an extension of WSGIUtils <http://www.owlfish.com/software/wsgiutils/>, a small threaded server using Python's standard SimpleHTTPServer.
 
@@ -229,6 +969,24 @@ options = [
     Option('--host',
            metavar="HOST",
            help='Host to serve from (default: localhost, which is only accessible from the local computer; use 0.0.0.0 to make your application public)'),
+    Option('--idle-timeout',
+           metavar="SECONDS",
+           help='Seconds before an idle persistent connection is closed (default: %d)' % IDLE_TIMEOUT),
+    Option('--max-requests',
+           metavar="NUMBER",
+           help='Requests served on a connection before it is closed, 1 disables persistent connections (default: %d)' % MAX_REQUESTS),
+    Option('--workers',
+           metavar="NUMBER",
+           help='Worker threads serving connections, 0 starts a thread per connection (default: %d)' % WORKERS),
+    Option('--queue-size',
+           metavar="NUMBER",
+           help='Connections waiting for a worker before new connections are refused with 503 (default: %d)' % QUEUE_SIZE),
+    Option('--request-timeout',
+           metavar="SECONDS",
+           help='Deadline for serving a request (default: none)'),
+    Option('--processes',
+           metavar="NUMBER",
+           help='Server processes sharing the port, SIGUSR2 replaces them (default: 1)'),
     ]
 
 if __name__ == '__main__':
@@ -251,5 +1009,9 @@ config-file:
        configfilespecified = None
     
     from pyfileserver.mainappwrapper import PyFileApp        
-    serve(optionsdict, PyFileApp(configfilespecified))
+    processes = int(optionsdict.get('processes', 1))
+    if processes > 1:
+        serveProcesses(optionsdict, lambda: PyFileApp(configfilespecified, multiprocess=True), processes)
+    else:
+        serve(optionsdict, PyFileApp(configfilespecified))
     
@@ -5,8 +5,20 @@ __all__ = ['mainappwrapper', \
            'requestresolver', 
            'httpauthentication', 
            'pyfiledomaincontroller',
+           'cachingdomaincontroller',
            'loadconfig_primitive',
            'propertylibrary',
            'locklibrary',
+           'lrucache',
+           'accesslog',
+           'metrics',
+           'adminserver',
+           'requestprofiler',
+           'memoryprofiler',
+           'multiprocessstore',
            'fileabstractionlayer',
+           'dedupabstractionlayer',
+           'accountingabstractionlayer',
+           'jobmanager',
+           'uploadsessions',
            'websupportfuncs']
@@ -0,0 +1,221 @@
+"""
+accesslog
+=========
+
+:Module: pyfileserver.accesslog
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+Access log written by a background thread, so that requests do not wait on
+the log file (or on each other for it).
+
+Usage::
+
+   from pyfileserver.accesslog import AccessLog
+   accesslog = AccessLog('/var/log/pyfileserver/access.log', maxbytes=10485760)
+   ...
+   accesslog.logRequest(environ, '200 OK', 1234, starttime, time.time())
+   accesslog.logText('free text, e.g. debugging output\n')
+
+Requests are logged as one line of space separated name=value fields, values
+containing spaces or quotes being quoted as in python::
+
+   2006-05-04T12:30:45Z method=GET path=/pubshare/LICENSE status=200 bytes=26436 duration=0.0031 user=john realm=/pubshare remote=127.0.0.1 alcalls=4
+
+``user``, ``realm`` and ``alcalls`` (the number of abstraction layer calls
+made for the request, if counted in ``environ['pyfileserver.alcalls']``) are
+``-`` if not known. A ``destination`` field follows for requests with a 
+Destination header (COPY, MOVE).
+
+Entries are passed to the writer thread through a queue of ``queuesize``
+entries. When the queue is full, entries are dropped rather than delaying the
+request; the number of dropped entries is counted and noted in the log once
+the writer catches up.
+
+The log file is rotated when writing an entry would make it larger than
+``maxbytes``, and every ``rotateinterval`` seconds (counted from the epoch, so
+86400 rotates at midnight UTC): access.log is renamed to access.log.1,
+access.log.1 to access.log.2, and so on, keeping ``backupcount`` old files.
+A filename of None writes to standard error, without rotation.
+
+Interface
+---------
+
+Classes:
+
++ 'AccessLog': Access log written by a background thread
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import os
+import sys
+import time
+import threading
+import Queue
+
+QUEUE_SIZE = 10000
+
+# closes the writer thread
+_CLOSE = object()
+
+
+def _formatValue(value):
+    if value is None or value == '':
+        return '-'
+    value = str(value)
+    if ' ' in value or '"' in value or "'" in value or '\\' in value or '\n' in value:
+        return repr(value)
+    return value
+
+
+class AccessLog(object):
+    def __init__(self, filename=None, maxbytes=0, rotateinterval=0, backupcount=5, queuesize=QUEUE_SIZE):
+        self._filename = filename
+        self._maxbytes = maxbytes
+        self._rotateinterval = rotateinterval
+        self._backupcount = backupcount
+        self._queue = Queue.Queue(queuesize)
+
+        self._countlock = threading.Lock()
+        self._written = 0
+        self._dropped = 0
+        self._droppednoted = 0
+
+        self._file = None
+        self._size = 0
+        self._nextrotation = None
+        self._openFile()
+
+        self._writer = threading.Thread(target=self._writerLoop, name='AccessLog')
+        self._writer.setDaemon(True)
+        self._writer.start()
+
+    def logRequest(self, environ, status, bytes, starttime, endtime):
+        # only the fields are collected here, formatting is left to the writer
+        entry = (starttime, environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'),
+                 status, bytes, endtime - starttime,
+                 environ.get('pyfileserver.username') or environ.get('httpauthentication.username'),
+                 environ.get('pyfileserver.mappedrealm'), environ.get('REMOTE_ADDR'),
+                 environ.get('pyfileserver.alcalls'), environ.get('HTTP_DESTINATION'))
+        self._put(entry)
+
+    def logText(self, text):
+        self._put(text)
+
+    def getStats(self):
+        return {'queued': self._queue.qsize(), 'written': self._written, 'dropped': self._dropped}
+
+    def close(self, timeout=5):
+        """
+        Writes the queued entries and closes the log file, waiting at most
+        timeout seconds.
+        """
+        try:
+            self._queue.put(_CLOSE, True, timeout)
+        except Queue.Full:
+            return
+        self._writer.join(timeout)
+
+    def _put(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+        except Queue.Full:
+            self._countlock.acquire()
+            try:
+                self._dropped += 1
+            finally:
+                self._countlock.release()
+
+    def _formatEntry(self, entry):
+        if isinstance(entry, str):
+            return entry
+        (starttime, method, path, status, bytes, duration, user, realm, remote, alcalls, destination) = entry
+        if status is not None:
+            status = status.split(' ', 1)[0]
+        line = '%s method=%s path=%s status=%s bytes=%s duration=%.4f user=%s realm=%s remote=%s alcalls=%s' % (
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(starttime)), _formatValue(method),
+            _formatValue(path), _formatValue(status), _formatValue(bytes), duration, _formatValue(user),
+            _formatValue(realm), _formatValue(remote), _formatValue(alcalls))
+        if destination:
+            line = line + ' destination=' + _formatValue(destination)
+        return line + '\n'
+
+    def _writerLoop(self):
+        while True:
+            entry = self._queue.get()
+            while entry is not None:
+                if entry is _CLOSE:
+                    self._closeFile()
+                    return
+                self._write(self._formatEntry(entry))
+                try:
+                    entry = self._queue.get_nowait()
+                except Queue.Empty:
+                    entry = None
+            # queue drained - note the entries dropped meanwhile, and flush
+            dropped = self._dropped
+            if dropped != self._droppednoted:
+                self._write('%s accesslog dropped=%d\n' % (time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), dropped - self._droppednoted))
+                self._droppednoted = dropped
+            try:
+                self._file.flush()
+            except IOError:
+                pass
+
+    def _write(self, line):
+        if self._filename is not None:
+            if (self._maxbytes > 0 and self._size > 0 and self._size + len(line) > self._maxbytes) or \
+               (self._nextrotation is not None and time.time() >= self._nextrotation):
+                self._rotate()
+        try:
+            self._file.write(line)
+        except IOError:
+            self._countlock.acquire()
+            try:
+                self._dropped += 1
+            finally:
+                self._countlock.release()
+            return
+        self._size += len(line)
+        self._written += 1
+
+    def _openFile(self):
+        if self._filename is None:
+            self._file = sys.stderr
+            return
+        self._file = open(self._filename, 'a')
+        self._file.seek(0, 2)
+        self._size = self._file.tell()
+        if self._rotateinterval > 0:
+            self._nextrotation = (int(time.time() // self._rotateinterval) + 1) * self._rotateinterval
+
+    def _closeFile(self):
+        if self._filename is None:
+            self._file.flush()
+        else:
+            self._file.close()
+
+    def _rotate(self):
+        self._file.close()
+        try:
+            if self._backupcount > 0:
+                for index in range(self._backupcount - 1, 0, -1):
+                    backupname = '%s.%d' % (self._filename, index)
+                    if os.path.exists(backupname):
+                        os.rename(backupname, '%s.%d' % (self._filename, index + 1))
+                os.rename(self._filename, self._filename + '.1')
+            else:
+                os.remove(self._filename)
+        except OSError, e:
+            print >> sys.stderr, 'Access log not rotated:', str(e)
+        try:
+            self._openFile()
+        except IOError, e:
+            print >> sys.stderr, 'Access log not reopened, logging to standard error:', str(e)
+            self._filename = None
+            self._openFile()
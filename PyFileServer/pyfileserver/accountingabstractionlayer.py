@@ -0,0 +1,118 @@
+"""
+accountingabstractionlayer
+==========================
+
+:Module: pyfileserver.accountingabstractionlayer
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+This module is specific to the PyFileServer application. It provides the class
+``AccountingAbstractionLayer``, wrapping any resource abstraction layer to
+count the calls made to it, and the time they took, per method and per request.
+
+Usage::
+
+   (see ``alaccounting`` in PyFileServer-example.conf; PyFileApp wraps all the
+   registered abstraction layers when it is set)
+   accountedAL = AccountingAbstractionLayer(resourceAL)
+
+   accounting = startAccounting()
+   ... calls to accountedAL made by this thread ...
+   stopAccounting()
+   accounting  -> {'isCollection': [3, 0.00012], 'getContentLength': [1, 0.00003], ...}
+
+Calls are accounted to the request being served by the calling thread, set
+by startAccounting(). Calls made by other threads (such as background jobs,
+see jobmanager.py) or outside of startAccounting()/stopAccounting() are not
+accounted. The time taken by reading or writing the file objects returned by
+openResourceForRead() and openResourceForWrite() is not included, nor are
+calls an abstraction layer makes to its own methods.
+
+The accounting of a request is passed on (by PyFileApp) to the access log
+(``alcalls``, the total number of calls), the metrics (see metrics.py) and,
+with ``alcallsheader``, to the X-AL-Calls response header::
+
+   X-AL-Calls: total=7, exists=2/0.000041, isCollection=3/0.000052, ...
+
+listing the calls made until the response was started.
+
+Abstraction Layers must provide the methods as described in
+abstractionlayerinterface_
+
+.. _abstractionlayerinterface : interfaces/abstractionlayerinterface.py
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import time
+import threading
+
+_current = threading.local()
+
+
+def startAccounting():
+   """
+   Starts accounting the calls of this thread, returns the accounting dict
+   {method name: [number of calls, seconds]} they are recorded into.
+   """
+   accounting = {}
+   _current.accounting = accounting
+   return accounting
+
+def stopAccounting():
+   _current.accounting = None
+
+def getTotalCalls(accounting):
+   total = 0
+   for (calls, seconds) in accounting.values():
+      total += calls
+   return total
+
+def formatAccounting(accounting):
+   names = accounting.keys()
+   names.sort()
+   fields = ['total=%d' % getTotalCalls(accounting)]
+   for name in names:
+      fields.append('%s=%d/%.6f' % (name, accounting[name][0], accounting[name][1]))
+   return ', '.join(fields)
+
+
+class AccountingAbstractionLayer(object):
+   def __init__(self, resourceAL):
+      self._resourceAL = resourceAL
+
+   def getWrappedLayer(self):
+      return self._resourceAL
+
+   def __getattr__(self, name):
+      # only called for attributes not found, i.e. the first use of each method
+      attribute = getattr(self._resourceAL, name)
+      if name.startswith('_') or not callable(attribute):
+         return attribute
+      accountedcall = _makeAccountedCall(name, attribute)
+      self.__dict__[name] = accountedcall
+      return accountedcall
+
+   def __repr__(self):
+      return 'AccountingAbstractionLayer(%r)' % (self._resourceAL,)
+
+
+def _makeAccountedCall(name, method):
+   def accountedcall(*args, **kwargs):
+      accounting = getattr(_current, 'accounting', None)
+      if accounting is None:
+         return method(*args, **kwargs)
+      starttime = time.time()
+      try:
+         return method(*args, **kwargs)
+      finally:
+         elapsed = time.time() - starttime
+         entry = accounting.get(name, None)
+         if entry is None:
+            accounting[name] = [1, elapsed]
+         else:
+            entry[0] += 1
+            entry[1] += elapsed
+   return accountedcall
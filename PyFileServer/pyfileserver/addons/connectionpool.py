@@ -0,0 +1,239 @@
+"""
+connectionpool
+==============
+
+:Module: pyfileserver.addons.connectionpool
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+This module is specific to the PyFileServer application. It provides the class
+``ConnectionPool``, a thread-safe pool of DB-API connections for the database
+abstraction layers (see simplemysqlabstractionlayer.py).
+
+Usage::
+
+   from pyfileserver.addons.connectionpool import getPool
+   pool = getPool(key, connect, maxsize=5)
+
+   conn = pool.getConnection()
+   try:
+      ... use conn ...
+   except:
+      pool.putConnection(conn, broken=True)
+      raise
+   pool.putConnection(conn)
+
+   key - identifies the database, e.g. (host, user, db). Abstraction layers
+   configured alike get the same pool, also after the configuration is
+   reloaded (see mainappwrapper.py).
+   connect - function returning a new DB-API connection, e.g.
+   lambda: MySQLdb.connect(host=..., user=..., passwd=..., db=...)
+   maxsize - maximum number of connections open at the same time
+
+At most ``maxsize`` connections are open. A thread asking for a connection
+when all of them are in use waits up to ``timeout`` seconds for one to be put
+back, after which the request fails with 503 Service Unavailable.
+
+Connections put back are rolled back (ending the transaction, so the next
+user does not read an old snapshot) and kept for reuse. A connection that has
+not been used for ``checkinterval`` seconds is checked with ``checkquery``
+before it is handed out again, and replaced if that fails - e.g. if the
+database server closed it in the meantime. Connections put back as broken
+(after a database error) are closed instead of kept.
+
+The pool only uses DB-API 2.0 methods (cursor, execute, rollback, close), so
+it can be tried out with any DB-API module, e.g. ``sqlite3.connect``.
+
+Interface
+---------
+
+Classes:
+
++ 'ConnectionPool': thread-safe pool of DB-API connections
+
+Functions:
+
++ 'getPool': returns the pool registered for a database, creating it
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import time
+import threading
+
+from pyfileserver.processrequesterrorhandler import HTTPRequestException
+from pyfileserver import processrequesterrorhandler
+
+POOL_SIZE = 5
+POOL_TIMEOUT = 30
+CHECK_INTERVAL = 30
+CHECK_QUERY = 'SELECT 1'
+
+# pools by key, shared by the abstraction layers using the same database
+_pools = {}
+_poolslock = threading.Lock()
+
+
+def getPool(key, connect, maxsize=POOL_SIZE, timeout=POOL_TIMEOUT, checkinterval=CHECK_INTERVAL, checkquery=CHECK_QUERY):
+   """
+   returns the pool registered for key, creating it with the given
+   parameters if there is none. The parameters of an existing pool are
+   updated.
+   """
+   _poolslock.acquire()
+   try:
+      pool = _pools.get(key, None)
+      if pool is None:
+         pool = ConnectionPool(connect, maxsize, timeout, checkinterval, checkquery)
+         _pools[key] = pool
+      else:
+         pool.setParameters(maxsize, timeout, checkinterval, checkquery)
+      return pool
+   finally:
+      _poolslock.release()
+
+
+class ConnectionPool(object):
+   def __init__(self, connect, maxsize=POOL_SIZE, timeout=POOL_TIMEOUT, checkinterval=CHECK_INTERVAL, checkquery=CHECK_QUERY):
+      self._connect = connect
+      self._condition = threading.Condition(threading.Lock())
+      self._idle = []      # [(connection, time put back)], last put back last
+      self._opened = 0     # connections open, idle or in use
+      self._stats = {'opened': 0, 'reused': 0, 'replaced': 0, 'waits': 0, 'timeouts': 0}
+      self.setParameters(maxsize, timeout, checkinterval, checkquery)
+
+   def setParameters(self, maxsize, timeout, checkinterval, checkquery):
+      self._condition.acquire()
+      try:
+         self._maxsize = maxsize
+         self._timeout = timeout
+         self._checkinterval = checkinterval
+         self._checkquery = checkquery
+         self._condition.notifyAll()
+      finally:
+         self._condition.release()
+
+   def getConnection(self):
+      """
+      returns an idle connection, or a new one if there is none and fewer
+      than maxsize connections are open. Waits for a connection to be put
+      back otherwise.
+      """
+      deadline = None
+      self._condition.acquire()
+      try:
+         while not self._idle and self._opened >= self._maxsize:
+            if deadline is None:
+               self._stats['waits'] += 1
+               deadline = time.time() + self._timeout
+            remaining = deadline - time.time()
+            if remaining <= 0:
+               self._stats['timeouts'] += 1
+               raise HTTPRequestException(processrequesterrorhandler.HTTP_SERVICE_UNAVAILABLE)
+            self._condition.wait(remaining)
+         if self._idle:
+            (conn, idlesince) = self._idle.pop()
+         else:
+            (conn, idlesince) = (None, None)
+            self._opened += 1
+      finally:
+         self._condition.release()
+
+      # checks and connects outside of the lock
+      if conn is not None:
+         if time.time() - idlesince < self._checkinterval or self._isHealthy(conn):
+            self._count('reused')
+            return conn
+         self._count('replaced')
+         self._closeConnection(conn)
+      try:
+         conn = self._connect()
+      except:
+         self._release()
+         raise
+      self._count('opened')
+      return conn
+
+   def putConnection(self, conn, broken=False):
+      """
+      puts back a connection from getConnection(). Broken connections
+      (after database errors) are closed.
+      """
+      if not broken:
+         try:
+            conn.rollback()
+         except Exception:
+            broken = True
+      if broken:
+         self._closeConnection(conn)
+         self._release()
+         return
+      self._condition.acquire()
+      try:
+         if self._opened > self._maxsize:
+            # the pool was made smaller
+            self._opened -= 1
+            self._closeConnection(conn)
+         else:
+            self._idle.append((conn, time.time()))
+         self._condition.notify()
+      finally:
+         self._condition.release()
+
+   def closeIdleConnections(self):
+      self._condition.acquire()
+      try:
+         idle = self._idle
+         self._idle = []
+         self._opened -= len(idle)
+         self._condition.notifyAll()
+      finally:
+         self._condition.release()
+      for (conn, idlesince) in idle:
+         self._closeConnection(conn)
+
+   def getStats(self):
+      self._condition.acquire()
+      try:
+         stats = dict(self._stats)
+         stats['open'] = self._opened
+         stats['idle'] = len(self._idle)
+         return stats
+      finally:
+         self._condition.release()
+
+   def _isHealthy(self, conn):
+      try:
+         cursor = conn.cursor()
+         try:
+            cursor.execute(self._checkquery)
+            cursor.fetchall()
+         finally:
+            cursor.close()
+      except Exception:
+         return False
+      return True
+
+   def _count(self, name):
+      self._condition.acquire()
+      try:
+         self._stats[name] += 1
+      finally:
+         self._condition.release()
+
+   def _closeConnection(self, conn):
+      try:
+         conn.close()
+      except Exception:
+         pass
+
+   def _release(self):
+      # a connection was closed, or could not be opened
+      self._condition.acquire()
+      try:
+         self._opened -= 1
+         self._condition.notify()
+      finally:
+         self._condition.release()
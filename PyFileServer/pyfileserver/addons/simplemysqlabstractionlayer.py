@@ -13,12 +13,27 @@ classes ``SimpleMySQLResourceAbstractionLayer``.
 Usage::
    
    (see PyFileServer-example.conf)
-   SimpleMySQLResourceAbstractionLayer(host, user, passwd, db)
+   SimpleMySQLResourceAbstractionLayer(host, user, passwd, db, poolsize=5, schemattl=60, maxstreams=2)
 
    host - host of database server
    user - username to access database
    passwd - passwd to access database
    db - name of database on database server
+   poolsize - maximum number of connections to the database (default = 5)
+   schemattl - seconds the table list and table schemas are cached (default = 60)
+   maxstreams - maximum number of table contents downloads at a time (default = 2)
+
+Connections are taken from a pool (see connectionpool.py) shared by the layers
+using the same database, and kept when the configuration is reloaded. The table
+list and the schema of each table (fields, primary key and whether it is 
+numeric) are cached for ``schemattl`` seconds, so tables created or altered 
+meanwhile show up after at most that long; clearSchemaCache() forgets them 
+at once.
+
+For trying out without a MySQL server, ``connect`` (a function returning a new
+DB-API connection) and ``placeholder`` (the parameter marker of its module) 
+may be given, with _queryTables() and _queryColumns() overridden for the SQL 
+dialect of that database.
    
 The ``SimpleMySQLResourceAbstractionLayer`` provides a very basic, read-only
 resource layer emulation of a MySQL database. It provides the following interface:
@@ -48,13 +63,18 @@ its limitations:
 + There is no handling for cases like BLOBs as primary keys or such. Well, there is
   no handling for BLOBs in general.
 
-+ When returning contents, it buffers the entire contents! A bad way to return
-  large tables. Ideally you would have a FileMixin that reads the database even
-  as the application reads the file object....
++ The contents of a table (_ENTIRE_CONTENTS) are streamed: rows are fetched 
+  from the server ``streambatch`` at a time (default = 1000) as the response
+  is sent, through an unbuffered (server-side) cursor. The download holds its
+  connection until it completes, so downloads take their connections from a
+  separate pool of ``maxstreams`` connections; slow downloads thus do not 
+  keep the other requests from the ``poolsize`` connections of the layer.
+  A download waiting longer than the pool timeout for one of the 
+  ``maxstreams`` connections fails with 503 Service Unavailable. MySQL 
+  aborts downloads read more slowly than its net_write_timeout allows.
 
-+ It takes too many database queries to return information. 
-  Ideally there should be some sort of caching for metadata at least, to avoid
-  unnecessary queries to the database.
++ The metadata is cached, but record existence and properties are queried 
+  each time they are needed.
 
 
 Abstraction Layers must provide the methods as described in 
@@ -66,44 +86,137 @@ See extrequestserver.py for more information about resource abstraction layers i
 PyFileServer
 
 """
-import MySQLdb
-import MySQLdb.cursors
 import md5
 import time
 import StringIO
 import csv
+try:
+   import MySQLdb
+   import MySQLdb.cursors
+except ImportError:
+   MySQLdb = None
+
+from pyfileserver.processrequesterrorhandler import HTTPRequestException
+from pyfileserver import processrequesterrorhandler
+from pyfileserver.addons.connectionpool import getPool, POOL_SIZE
+
+SCHEMA_TTL = 60
+STREAM_BATCH = 1000
+MAX_STREAMS = 2
 
 class SimpleMySQLResourceAbstractionLayer(object):
    
-   def __init__(self, host, user, passwd, db):
+   def __init__(self, host, user, passwd, db, poolsize=POOL_SIZE, schemattl=SCHEMA_TTL, connect=None, placeholder='%s', streambatch=STREAM_BATCH, maxstreams=MAX_STREAMS):
+      self._configuration = (host, user, passwd, db, poolsize, schemattl, connect, placeholder, streambatch, maxstreams)
       self._host = host
       self._user = user
       self._passwd = passwd
       self._db = db
-   
-   def _initConnection(self):
-      return MySQLdb.connect (host = self._host,
-                              user = self._user,
-                              passwd = self._passwd,
-                              db = self._db)
+      if connect is None:
+         if MySQLdb is None:
+            raise ImportError('SimpleMySQLResourceAbstractionLayer requires the MySQLdb module')
+         connect = lambda: MySQLdb.connect(host = host, user = user, passwd = passwd, db = db)
+      self._pool = getPool((host, user, passwd, db), connect, poolsize)
+      # table contents downloads hold their connection as long as the client
+      # takes, so they get their own connections
+      self._streampool = getPool((host, user, passwd, db, 'streams'), connect, maxstreams)
+      self._placeholder = placeholder
+      self._schemattl = schemattl
+      self._tablescache = None      # (expiry time, table names)
+      self._schemacache = {}        # table name: (expiry time, (field list, primary key, primary key numeric))
+      self._streambatch = streambatch
+
+   def getConfiguration(self):
+      # the caches are not part of the configuration, so that a reload keeps
+      # this layer with them
+      return self._configuration
+
+   def _withConnection(self, func, *args):
+      # runs func(conn, *args) with a connection of the pool
+      conn = self._pool.getConnection()
+      try:
+         result = func(conn, *args)
+      except:
+         self._pool.putConnection(conn, broken=True)
+         raise
+      self._pool.putConnection(conn)
+      return result
+
+   def _fetchDicts(self, cursor, rows):
+      names = [description[0] for description in cursor.description]
+      return [dict(zip(names, row)) for row in rows]
+
+   def _queryTables(self, conn):
+      retlist = []      
+      cursor = conn.cursor ()
+      cursor.execute ("SHOW TABLES")
+      result_set = cursor.fetchall ()
+      for row in result_set:
+          retlist.append("%s" % (row[0]))
+      cursor.close ()
+      return retlist
 
-   def _getFieldList(self, conn, table_name):
+   def _queryColumns(self, conn, table_name):
+      """
+      returns [(field name, data type, is primary key)] of the table
+      """
       retlist = []
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+      cursor = conn.cursor ()
       cursor.execute ("DESCRIBE " + table_name)
-      result_set = cursor.fetchall ()
-      for row in result_set:
-         retlist.append(row["Field"])
+      for row in self._fetchDicts(cursor, cursor.fetchall ()):
+         retlist.append((row["Field"], row["Type"], row["Key"] == "PRI"))
       cursor.close ()
-      return retlist      
-   
+      return retlist
+
+   def _listTables(self):
+      cached = self._tablescache
+      if cached is not None and cached[0] > time.time():
+         return cached[1]
+      tables = self._withConnection(self._queryTables)
+      self._tablescache = (time.time() + self._schemattl, tables)
+      return tables
+
+   def _getTableSchema(self, table_name):
+      """
+      returns (field list, primary key, primary key numeric) of the table,
+      primary key being None if the table has none or more than one (multipart
+      key). Tables that do not exist are not found.
+      """
+      cached = self._schemacache.get(table_name, None)
+      if cached is not None and cached[0] > time.time():
+         return cached[1]
+      if table_name not in self._listTables():
+         raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+
+      fieldlist = []
+      pri_key = None
+      pri_field_type = None
+      pri_key_count = 0
+      for (fieldname, fieldtype, iskey) in self._withConnection(self._queryColumns, table_name):
+         fieldlist.append(fieldname)
+         if iskey:
+            pri_key_count += 1
+            pri_key = fieldname
+            pri_field_type = fieldtype
+      if pri_key_count != 1:
+         pri_key = pri_field_type = None
+      schema = (fieldlist, pri_key, self._isDataTypeNumeric(pri_field_type))
+      self._schemacache[table_name] = (time.time() + self._schemattl, schema)
+      return schema
+
+   def clearSchemaCache(self):
+      self._tablescache = None
+      self._schemacache = {}
+
+   def _getFieldList(self, table_name):
+      return self._getTableSchema(table_name)[0]
    
    def _isDataTypeNumeric(self, datatype):
       if datatype is None:
          return False
       #how many MySQL datatypes does it take to change a lig... I mean, store numbers
       numerictypes = ['BIGINT',\
-                      'INTT',
+                      'INT',
                       'MEDIUMINT',
                       'SMALLINT',
                       'TINYINT',
@@ -121,134 +234,58 @@ class SimpleMySQLResourceAbstractionLayer(object):
          if datatype.startswith(numtype):
             return True                     
       return False                 
-   
-   def _existsRecordByPrimaryKey(self, conn, table_name, pri_key_value):
-      pri_key = None
-      pri_field_type = None
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-      cursor.execute ("DESCRIBE " + table_name)
-      result_set = cursor.fetchall ()
-      for row in result_set:
-         if row["Key"] == "PRI":
-            if pri_key is None:
-               pri_key = row["Field"]
-               pri_field_type = row["Type"]         
-            else:
-               return False #more than one primary key - multipart key?
-      cursor.close ()
 
-      isNumType = self._isDataTypeNumeric(pri_field_type)      
-      
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-      if isNumType:
-         cursor.execute("SELECT " + pri_key + " FROM " + self._db + "." + table_name + " WHERE " + pri_key + " = " + pri_key_value)
-      else:
-         cursor.execute("SELECT " + pri_key + " FROM " + self._db + "." + table_name + " WHERE " + pri_key + " = '" + pri_key_value + "'")
-      row = cursor.fetchone ()
-      if row is None:
-         cursor.close()
-         return False
-      cursor.close()
-      return True            
-
-   def _getFieldByPrimaryKey(self, conn, table_name, pri_key_value, field_name):      
-      pri_key = None
-      pri_field_type = None
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-      cursor.execute ("DESCRIBE " + table_name)
-      result_set = cursor.fetchall ()
-      for row in result_set:
-         if row["Key"] == "PRI":
-            if pri_key is None:
-               pri_key = row["Field"]
-               pri_field_type = row["Type"]         
-            else:
-               return None #more than one primary key - multipart key?
-      cursor.close ()
-
-      isNumType = self._isDataTypeNumeric(pri_field_type)      
-      
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+   def _getRecordByPrimaryKey(self, table_name, pri_key_value, field_names = "*"):
+      """
+      returns the record of the table as a dict of string values (the fields
+      field_names only), None if there is none or the table has no single 
+      primary key
+      """
+      (fieldlist, pri_key, isNumType) = self._getTableSchema(table_name)
+      if pri_key is None:
+         return None #no or more than one primary key - multipart key?
       if isNumType:
-         cursor.execute("SELECT " + field_name + " FROM " + self._db + "." + table_name + " WHERE " + pri_key + " = " + pri_key_value)
-      else:
-         cursor.execute("SELECT " + field_name + " FROM " + self._db + "." + table_name + " WHERE " + pri_key + " = '" + pri_key_value + "'")
+         # MySQL would compare '12abc' equal to 12
+         try:
+            float(pri_key_value)
+         except ValueError:
+            return None
+      return self._withConnection(self._queryRecord, table_name, pri_key, pri_key_value, field_names)
+
+   def _queryRecord(self, conn, table_name, pri_key, pri_key_value, field_names):
+      cursor = conn.cursor ()
+      cursor.execute("SELECT " + field_names + " FROM " + self._db + "." + table_name + " WHERE " + pri_key + " = " + self._placeholder, (pri_key_value,))
       row = cursor.fetchone ()
       if row is None:
          cursor.close()
          return None
-      val = str(row[field_name])         
+      dictRet = {}
+      for (fname, value) in self._fetchDicts(cursor, [row])[0].items():
+         dictRet[fname] = str(value)
       cursor.close()
-      return val            
+      return dictRet
 
-                         
-   def _getRecordByPrimaryKey(self, conn, table_name, pri_key_value):      
-      dictRet = {}            
-      pri_key = None
-      pri_field_type = None
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-      cursor.execute ("DESCRIBE " + table_name)
-      result_set = cursor.fetchall ()
-      for row in result_set:
-         if row["Key"] == "PRI":
-            if pri_key is None:
-               pri_key = row["Field"]
-               pri_field_type = row["Type"]         
-            else:
-               return None #more than one primary key - multipart key?
-      cursor.close ()
+   def _existsRecordByPrimaryKey(self, table_name, pri_key_value):
+      pri_key = self._getTableSchema(table_name)[1]
+      if pri_key is None:
+         return False
+      return self._getRecordByPrimaryKey(table_name, pri_key_value, pri_key) is not None
 
-      isNumType = self._isDataTypeNumeric(pri_field_type)      
-      
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-      if isNumType:
-         cursor.execute("SELECT * FROM " + self._db + "." + table_name + " WHERE " + pri_key + " = " + pri_key_value)
-      else:
-         cursor.execute("SELECT * FROM " + self._db + "." + table_name + " WHERE " + pri_key + " = '" + pri_key_value + "'")
-      row = cursor.fetchone ()
-      if row is None:
-         cursor.close()
+   def _getFieldByPrimaryKey(self, table_name, pri_key_value, field_name):      
+      record = self._getRecordByPrimaryKey(table_name, pri_key_value, field_name)
+      if record is None:
          return None
-      for fname in row.keys():
-         dictRet[fname] = str(row[fname])         
-      cursor.close()
-      return dictRet            
-   
-   def _findPrimaryKey(self, conn, table_name):
-      pri_key = None
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-      cursor.execute ("DESCRIBE " + table_name)
-      result_set = cursor.fetchall ()
-      for row in result_set:
-         fieldname = row["Field"]
-         keyvalue = row["Key"]
-         if keyvalue == "PRI":
-            if pri_key is None:
-               pri_key = fieldname         
-            else:
-               return None #more than one primary key - multipart key?
-      cursor.close ()
-      return pri_key
-            
+      return record[field_name]
+
    def _listFields(self, conn, table_name, field_name):
       retlist = []
-      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+      cursor = conn.cursor ()
       cursor.execute('SELECT ' + field_name + " FROM " + self._db + "." + table_name)
       result_set = cursor.fetchall ()
       for row in result_set:
-         retlist.append(str(row[field_name]))      
+         retlist.append(str(row[0]))      
       cursor.close()
       return retlist
-   
-   def _listTables(self, conn):
-      retlist = []      
-      cursor = conn.cursor ()
-      cursor.execute ("SHOW TABLES")
-      result_set = cursor.fetchall ()
-      for row in result_set:
-          retlist.append("%s" % (row[0]))
-      cursor.close ()
-      return retlist
       
    def resolvePath(self, resheadpath, urlelementlist):
       """ 
@@ -327,20 +364,14 @@ class SimpleMySQLResourceAbstractionLayer(object):
    def exists(self, respath):
       resdata = respath.strip(":").split(":")
       if len(resdata) >= 2:     #database:table_name check
-         conn = self._initConnection()
-         tbllist = self._listTables(conn)
-         conn.close()
-         if resdata[1] not in tbllist:
+         if resdata[1] not in self._listTables():
             return False
 
       if len(resdata) == 3:     #database:table_name:value check
          if resdata[2] == "_ENTIRE_CONTENTS":
             return True
          else:
-            conn = self._initConnection()            
-            val =  self._existsRecordByPrimaryKey(conn, resdata[1], resdata[2]) 
-            conn.close()
-            return val
+            return self._existsRecordByPrimaryKey(resdata[1], resdata[2]) 
       return True 
    
    def createCollection(self, respath):
@@ -367,50 +398,67 @@ class SimpleMySQLResourceAbstractionLayer(object):
 
       The application will close() the stream.      
       """
-      filestream = StringIO.StringIO()
-
       resdata = respath.strip(":").split(":")
+      if len(resdata) == 3 and resdata[2] == "_ENTIRE_CONTENTS":
+         table_name = resdata[1]
+         self._getTableSchema(table_name)     # table exists
+         conn = self._streampool.getConnection()
+         try:
+            cursor = self._openStreamingCursor(conn)
+            cursor.execute ("SELECT * from " + self._db + "." + table_name)
+         except:
+            self._streampool.putConnection(conn, broken=True)
+            raise
+         return _TableContentsStream(self._streampool, conn, cursor, self._streambatch)
+
+      filestream = StringIO.StringIO()
       if len(resdata) == 3:
          table_name = resdata[1] 
-         conn = self._initConnection()
-         listFields = self._getFieldList(conn, table_name)
+         listFields = self._getFieldList(table_name)
          csvwriter = csv.DictWriter(filestream, listFields, extrasaction='ignore') 
          dictFields = {}
          for field_name in listFields:
             dictFields[field_name] = field_name
          csvwriter.writerow(dictFields)
-
-         if resdata[2] == "_ENTIRE_CONTENTS":
-            cursor = conn.cursor (MySQLdb.cursors.DictCursor)            
-            cursor.execute ("SELECT * from " + self._db + "." + table_name)
-            result_set = cursor.fetchall ()
-            for row in result_set:
-               csvwriter.writerow(row)
-            cursor.close ()      
-         else:
-            row = self._getRecordByPrimaryKey(conn, table_name, resdata[2])  
-            if row is not None:
-               csvwriter.writerow(row)
-         conn.close()
-            
-      #this suffices for small dbs, but 
-      #for a production big database, I imagine you would have a FileMixin that
-      #does the retrieving and population even as the file object is being read 
+         row = self._getRecordByPrimaryKey(table_name, resdata[2])  
+         if row is not None:
+            csvwriter.writerow(row)
       filestream.seek(0)
       return filestream 
-      
-      #filevalue = filestream.getvalue() 
-      #filestream.close()
-      #return StringIO.StringIO(filevalue)
+
+   def _openStreamingCursor(self, conn):
+      """
+      returns a cursor fetching the rows from the server as they are read
+      rather than all at once
+      """
+      return conn.cursor (MySQLdb.cursors.SSCursor)
    
-   def openResourceForWrite(self, respath, contenttype=None):
+   def openResourceForWrite(self, respath, contenttype=None, contentlength=None):
       raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
    
+   def supportWriteLength(self, respath):
+      return True
+   
    def deleteResource(self, respath):
       raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
    
    def copyResource(self, respath, destrespath):
       raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
+
+   def supportPartialWrites(self, respath):
+      return False
+
+   def openResourceRangeForWrite(self, respath, rangestart, totallength):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
+
+   def getUploadStatus(self, respath):
+      return None
+
+   def commitUpload(self, respath):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
+
+   def abortUpload(self, respath):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
    
    def getContainingCollection(self, respath):
       dsplit = respath.rsplit(":",1)
@@ -423,20 +471,18 @@ class SimpleMySQLResourceAbstractionLayer(object):
       returns a list of names of resources contained in the collection resource
       specified
       """
-      conn = self._initConnection()
       resdata = respath.strip(":").split(":")
       if len(resdata) == 1:
-         retlist = self._listTables(conn)         
+         retlist = list(self._listTables())
       elif len(resdata) == 2:
-         pri_key = self._findPrimaryKey(conn, resdata[1])
+         pri_key = self._getTableSchema(resdata[1])[1]
          if pri_key is not None:
-            retlist = self._listFields(conn, resdata[1], pri_key)      
+            retlist = self._withConnection(self._listFields, resdata[1], pri_key)      
          else:
             retlist = []
          retlist[0:0] = ["_ENTIRE_CONTENTS"]
       else:
          retlist = []      
-      conn.close()
       return retlist
       
    def joinPath(self, rescollectionpath, resname):
@@ -513,13 +559,9 @@ class SimpleMySQLResourceAbstractionLayer(object):
       resdata = respath.strip(":").split(":")
       if len(resdata) == 3:
          if propertyns == resdata[1] + ":":
-            conn = self._initConnection()
-            fieldlist = self._getFieldList(conn, resdata[1])
+            fieldlist = self._getFieldList(resdata[1])
             if propertyname in fieldlist:
-               val = self._getFieldByPrimaryKey(conn, resdata[1], resdata[2], propertyname)
-               conn.close()
-               return val
-            conn.close()
+               return self._getFieldByPrimaryKey(resdata[1], resdata[2], propertyname)
       raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)               
    
    def isPropertySupported(self, respath, propertyname, propertyns):
@@ -529,9 +571,7 @@ class SimpleMySQLResourceAbstractionLayer(object):
 
       resdata = respath.strip(":").split(":")
       if len(resdata) == 3:
-         conn = self._initConnection()
-         fieldlist = self._getFieldList(conn, resdata[1])
-         conn.close()
+         fieldlist = self._getFieldList(resdata[1])
          ns = resdata[1] + ":"
          if propertyns == ns and propertyname in fieldlist:
             return True
@@ -547,10 +587,75 @@ class SimpleMySQLResourceAbstractionLayer(object):
 
       resdata = respath.strip(":").split(":")
       if len(resdata) == 3:
-         conn = self._initConnection()
-         fieldlist = self._getFieldList(conn, resdata[1])
+         fieldlist = self._getFieldList(resdata[1])
          ns = resdata[1] + ":"
          for fieldname in fieldlist:
             appProps.append( (ns,fieldname) )
-         conn.close()
       return appProps
+
+
+class _TableContentsStream(object):
+   """
+   Read-only file object returning the CSV representation of the rows of a
+   cursor, fetching batchsize rows at a time as it is read. The connection
+   is put back into the pool once all rows are read, or on close().
+   """
+   def __init__(self, pool, conn, cursor, batchsize):
+      self._pool = pool
+      self._conn = conn
+      self._cursor = cursor
+      self._batchsize = batchsize
+      self._csvbuffer = StringIO.StringIO()
+      self._csvwriter = csv.writer(self._csvbuffer)
+      self._csvwriter.writerow([description[0] for description in cursor.description])
+      self._data = self._csvbuffer.getvalue()
+      self._offset = 0
+
+   def _fetch(self):
+      # encodes the next batch of rows, returns False if there are no more
+      try:
+         rows = self._cursor.fetchmany(self._batchsize)
+      except:
+         self._release(broken=True)
+         raise
+      if not rows:
+         self._release(broken=False)
+         return False
+      self._csvbuffer.seek(0)
+      self._csvbuffer.truncate()
+      self._csvwriter.writerows(rows)
+      self._data = self._data[self._offset:] + self._csvbuffer.getvalue()
+      self._offset = 0
+      return True
+
+   def read(self, size=-1):
+      while self._conn is not None and (size < 0 or len(self._data) - self._offset < size):
+         if not self._fetch():
+            break
+      if size < 0:
+         size = len(self._data) - self._offset
+      data = self._data[self._offset:self._offset + size]
+      self._offset += len(data)
+      return data
+
+   def _release(self, broken):
+      conn = self._conn
+      if conn is None:
+         return
+      self._conn = None
+      if not broken:
+         try:
+            self._cursor.close()
+         except Exception:
+            broken = True
+      # unread rows of a server-side cursor would have to be fetched before
+      # the connection could be used again
+      self._pool.putConnection(conn, broken)
+
+   def close(self):
+      self._release(broken=True)
+      self._data = ''
+      self._offset = 0
+
+   def __del__(self):
+      self._release(broken=True)
@@ -0,0 +1,99 @@
+"""
+adminserver
+===========
+
+:Module: pyfileserver.adminserver
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+WSGI Middleware serving the administration pages of PyFileServer under the
+admin path (``adminpath`` in PyFileServer.conf)::
+
+   http://<servername:port>/<approot>/_admin/           index of the pages
+   http://<servername:port>/<approot>/_admin/metrics    Prometheus metrics
+
+The admin pages are not subject to authentication. They are only served to
+clients connecting from the addresses in ``adminallow`` (by default the local
+host); others are answered with 403 Forbidden. No realm may be shared under
+the admin path.
+
+Usage::
+
+   from pyfileserver.adminserver import AdminServer
+   adminserver = AdminServer(application, '/_admin', ['127.0.0.1'])
+   adminserver.addPage('metrics', 'Request metrics', func)
+   application = adminserver
+
+where func(environ, subpath) returns (content type, body) for the page
+(subpath being the rest of the url after the page name), or raises
+HTTPRequestException.
+
+Interface
+---------
+
+Classes:
+
++ 'AdminServer': Middleware serving the administration pages
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import cgi
+
+import processrequesterrorhandler
+from processrequesterrorhandler import HTTPRequestException
+import httpdatehelper
+
+ADMIN_PATH = '/_admin'
+ADMIN_ALLOW = ('127.0.0.1', '::1')
+
+
+class AdminServer(object):
+    def __init__(self, application, adminpath=ADMIN_PATH, allowedaddresses=ADMIN_ALLOW):
+        self._application = application
+        self._adminpath = adminpath.rstrip('/')
+        if isinstance(allowedaddresses, basestring):
+            # a single address, where 'in' would match substrings of it
+            allowedaddresses = (allowedaddresses,)
+        self._allowedaddresses = allowedaddresses
+        self._pages = {}
+        self._pagenames = []
+
+    def addPage(self, name, title, func):
+        self._pages[name] = (title, func)
+        self._pagenames.append(name)
+
+    def __call__(self, environ, start_response):
+        pathinfo = environ.get('PATH_INFO', '')
+        if pathinfo != self._adminpath and not pathinfo.startswith(self._adminpath + '/'):
+            return self._application(environ, start_response)
+
+        if environ.get('REMOTE_ADDR', '') not in self._allowedaddresses:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)
+        requestmethod = environ['REQUEST_METHOD']
+        if requestmethod != 'GET' and requestmethod != 'HEAD':
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_METHOD_NOT_ALLOWED)
+
+        (name, subpath) = (pathinfo[len(self._adminpath):].strip('/') + '/').split('/', 1)
+        if name == '':
+            (contenttype, body) = ('text/html', self.getIndexPage(environ))
+        elif name in self._pages:
+            (contenttype, body) = self._pages[name][1](environ, subpath.rstrip('/'))
+        else:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+
+        start_response('200 OK', [('Content-Type', contenttype), ('Content-Length', str(len(body))), ('Cache-Control', 'no-cache'), ('Date',httpdatehelper.getstrftime())])
+        if requestmethod == 'HEAD':
+            return ['']
+        return [body]
+
+    def getIndexPage(self, environ):
+        pageurl = environ.get('SCRIPT_NAME', '') + self._adminpath
+        links = []
+        for name in self._pagenames:
+            links.append('<li><a href="%s/%s">%s</a> - %s</li>' % (pageurl, name, name, cgi.escape(self._pages[name][0])))
+        return '<html><head><title>PyFileServer administration</title></head><body><h1>PyFileServer administration</h1><ul>%s</ul><hr>%s</body></html>' % (''.join(links), environ.get('pyfileserver.trailer', ''))
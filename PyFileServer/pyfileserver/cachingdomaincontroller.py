@@ -0,0 +1,160 @@
+"""
+cachingdomaincontroller
+=======================
+
+:Module: pyfileserver.cachingdomaincontroller
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+A domain controller remembering the answers of another domain controller, for
+domain controllers that are expensive to ask (e.g. a Windows domain logon in
+``addons.windowsdomaincontroller``, or a directory server).
+
+Usage::
+
+   from pyfileserver.cachingdomaincontroller import CachingDomainController
+   domaincontroller = CachingDomainController(SimpleWindowsDomainController(),
+                                              timeout=300, failuredelay=5,
+                                              maxfailures=5)
+
+   (or set authcachetimeout in PyFileServer.conf to wrap the configured
+   domain controller)
+
++ A successful basic authentication check of a user's password is
+  remembered for ``timeout`` seconds. Only a salted hash of the password is
+  kept, and a different password is checked with the wrapped domain
+  controller again.
+
++ After a failed check, checks of the same user in the realm with the same
+  password fail for ``failuredelay`` seconds without asking the wrapped
+  domain controller, which spares it clients resending wrong credentials.
+  The failure is remembered by a salted hash of the password too, so that a
+  wrong password does not lock the user out with the correct one.
+
++ Failed checks are also counted per user in the realm. After
+  ``maxfailures`` of them, with less than ``failuredelay`` seconds between
+  one and the next, any password not remembered as correct is refused
+  without asking the wrapped domain controller, until ``failuredelay``
+  seconds have passed since the last failure. Guessing different passwords
+  is thus held to ``maxfailures`` tries every ``failuredelay`` seconds,
+  while a user whose correct password is remembered keeps logging in.
+
++ ``isRealmUser`` results are remembered for ``timeout`` seconds.
+
++ Passwords for digest authentication (``getRealmUserPassword``) are not
+  cached here; HTTPAuthenticator keeps the derived HA1 values itself.
+
+A password changed or an account disabled in the wrapped domain controller
+is thus only noticed after ``timeout`` seconds, or once ``clearCaches()`` is
+called (PyFileApp calls it when the configuration is reloaded).
+
+``getCacheStats()`` returns the number of checks answered from the cache
+(hits), passed to the wrapped domain controller (misses) and refused during a
+failure delay (failures).
+
+Domain Controllers must provide the methods as described in
+domaincontrollerinterface_
+
+.. _domaincontrollerinterface : interfaces/domaincontrollerinterface.py
+
+"""
+__docformat__ = 'reStructuredText'
+
+import os
+import hmac
+import threading
+
+try:
+    import hashlib
+    _sha1 = hashlib.sha1
+except ImportError:
+    import sha
+    _sha1 = sha
+
+from lrucache import LRUCache
+
+CACHE_SIZE = 1000
+MAX_FAILURES = 5
+
+
+class CachingDomainController(object):
+    def __init__(self, domaincontroller, timeout=300, failuredelay=5, cachesize=CACHE_SIZE,
+                 maxfailures=MAX_FAILURES):
+        self._domaincontroller = domaincontroller
+        self._salt = os.urandom(16)
+        self._authcache = LRUCache(cachesize, timeout)
+        self._usercache = LRUCache(cachesize, timeout)
+        self._failurecache = None
+        self._usercounts = None
+        if failuredelay > 0:
+            self._failurecache = LRUCache(cachesize, failuredelay)
+            # failures per (realm, user), forgotten failuredelay seconds after the last
+            self._usercounts = LRUCache(cachesize, failuredelay)
+        self._maxfailures = maxfailures
+        self._statslock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._failures = 0
+
+    def __getattr__(self, name):
+        # optional methods (e.g. getRealmUserHA1) of the wrapped controller
+        return getattr(self._domaincontroller, name)
+
+    def getDomainRealm(self, inputURL, environ):
+        return self._domaincontroller.getDomainRealm(inputURL, environ)
+
+    def requireAuthentication(self, realmname, environ):
+        return self._domaincontroller.requireAuthentication(realmname, environ)
+
+    def isRealmUser(self, realmname, username, environ):
+        isuser = self._usercache.get((realmname, username))
+        if isuser is None:
+            isuser = self._domaincontroller.isRealmUser(realmname, username, environ)
+            self._usercache.set((realmname, username), isuser)
+        return isuser
+
+    def getRealmUserPassword(self, realmname, username, environ):
+        return self._domaincontroller.getRealmUserPassword(realmname, username, environ)
+
+    def authDomainUser(self, realmname, username, password, environ):
+        key = (realmname, username)
+        passwordhash = hmac.new(self._salt, password, _sha1).digest()
+
+        if self._authcache.get(key) == passwordhash:
+            self._count('_hits')
+            return True
+        failurekey = (realmname, username, passwordhash)
+        if self._failurecache is not None:
+            if self._failurecache.get(failurekey) is not None or \
+                    self._usercounts.get(key, 0) >= self._maxfailures:
+                self._count('_failures')
+                return False
+
+        self._count('_misses')
+        if self._domaincontroller.authDomainUser(realmname, username, password, environ):
+            self._authcache.set(key, passwordhash)
+            return True
+        if self._failurecache is not None:
+            self._failurecache.set(failurekey, True)
+            # not atomic: concurrent failures may count once, which only lets
+            # a guess or two more through
+            self._usercounts.set(key, self._usercounts.get(key, 0) + 1)
+        return False
+
+    def clearCaches(self):
+        self._authcache.clear()
+        self._usercache.clear()
+        if self._failurecache is not None:
+            self._failurecache.clear()
+            self._usercounts.clear()
+
+    def getCacheStats(self):
+        return {'hits': self._hits, 'misses': self._misses, 'failures': self._failures}
+
+    def _count(self, counter):
+        self._statslock.acquire()
+        try:
+            setattr(self, counter, getattr(self, counter) + 1)
+        finally:
+            self._statslock.release()
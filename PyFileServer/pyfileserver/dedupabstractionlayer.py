@@ -0,0 +1,346 @@
+"""
+dedupabstractionlayer
+=====================
+
+:Module: pyfileserver.dedupabstractionlayer
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+This module is specific to the PyFileServer application. It provides the class
+``DedupFilesystemAbstractionLayer``, a resource abstraction layer that stores
+the content of resources once, however many times it is uploaded or copied.
+
+Usage::
+
+   (see PyFileServer-example.conf)
+   addAL('dedup', DedupFilesystemAbstractionLayer(blobdir, chunksize))
+   addrealm('installers', '/srv/installers', 'dedup')
+
+   blobdir - directory where the content chunks are stored. It may be shared
+   by any number of realms, which then share their content.
+   chunksize - size of the content chunks in bytes (default = 1048576)
+
+Collections are directories in the realm, as for the
+``FilesystemAbstractionLayer``, but each resource is a small manifest file
+listing the chunks making up its content::
+
+   pyfileserver-manifest 1
+   length <content length>
+   sha1 <sha1 of the content>
+   <sha1 of chunk 1> <length of chunk 1>
+   <sha1 of chunk 2> <length of chunk 2>
+   ...
+
+Chunks are stored in blobdir by their sha1, as blobdir/ab/cd/abcd...; a chunk
+that is already present is not written again. The content is split into
+fixed-size chunks and hashed while it is written by PUT, so there is no second
+pass over the data:
+
++ COPY (and MOVE) only copies the manifest.
+
++ GET reads the chunks in order. Ranges are served by seeking to the chunk
+  holding the first byte of the range.
+
++ The entity tag of a resource is the sha1 of its content, so identical content
+  has the same entity tag in every realm.
+
+Files in the realm that are not manifests (e.g. files that were there before the
+realm was switched to this layer) are served as they are. A file beginning
+with the manifest line but not a valid manifest (truncated, or with chunk
+hashes that are not sha1 hex digests) is refused with 500 Internal Server
+Error.
+
+Limitations:
+
++ Chunks are never deleted. Deleting or overwriting resources leaves the
+  chunks they used in blobdir; a garbage collector walking all manifests
+  sharing the blobdir is needed to reclaim that space.
+
++ Chunk boundaries are fixed, so content that is shifted by an insertion does
+  not share chunks with the original.
+
++ Partial (Content-Range) uploads and upload sessions are not supported.
+
+Abstraction Layers must provide the methods as described in
+abstractionlayerinterface_
+
+.. _abstractionlayerinterface : interfaces/abstractionlayerinterface.py
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import os
+import sys
+import errno
+import bisect
+import tempfile
+
+try:
+   import hashlib
+   _newsha1 = hashlib.sha1
+except ImportError:
+   import sha
+   _newsha1 = sha.new
+
+from processrequesterrorhandler import HTTPRequestException
+import processrequesterrorhandler
+from fileabstractionlayer import FilesystemAbstractionLayer, _RenameOnCloseFile, _syncFile, TEMPFILE_PREFIX, SYNC_NONE, BUFFER_SIZE
+
+MANIFEST_MAGIC = 'pyfileserver-manifest 1'
+DEFAULT_CHUNK_SIZE = 1048576
+
+
+class _Manifest(object):
+   def __init__(self, length, contenthash, chunks):
+      self.length = length
+      self.contenthash = contenthash
+      self.chunks = chunks
+
+
+def _isSha1(value):
+   # hashes are used in blob paths, anything but a sha1 hex digest could point
+   # outside of blobdir
+   return len(value) == 40 and value.strip('0123456789abcdef') == ''
+
+
+def _readManifest(respath, headeronly=False):
+   # returns the _Manifest for respath, or None if respath is not a manifest
+   try:
+      manifestfile = file(respath, 'r')
+   except IOError:
+      return None
+   try:
+      # bounded: any large file in the realm is checked here
+      if manifestfile.readline(len(MANIFEST_MAGIC) + 2).rstrip('\r\n') != MANIFEST_MAGIC:
+         return None
+      try:
+         (lengthkey, length) = manifestfile.readline().split()
+         (hashkey, contenthash) = manifestfile.readline().split()
+         length = long(length)
+         if lengthkey != 'length' or hashkey != 'sha1' or length < 0 or not _isSha1(contenthash):
+            raise ValueError('malformed manifest header')
+         chunks = []
+         if not headeronly:
+            for line in manifestfile:
+               (chunkhash, chunklength) = line.split()
+               chunklength = long(chunklength)
+               if not _isSha1(chunkhash) or chunklength < 0:
+                  raise ValueError('malformed manifest chunk')
+               chunks.append( (chunkhash, chunklength) )
+      except ValueError, e:
+         # truncated or malformed
+         raise HTTPRequestException(processrequesterrorhandler.HTTP_INTERNAL_ERROR, contextinfo=respath, srcexception=e)
+      return _Manifest(length, contenthash, chunks)
+   finally:
+      manifestfile.close()
+
+
+class _ManifestReader(object):
+   """
+   Seekable read stream over the chunks of a manifest.
+   """
+   def __init__(self, layer, manifest):
+      self._layer = layer
+      self._chunks = manifest.chunks
+      self._length = manifest.length
+      # offset of the first byte of each chunk
+      self._offsets = []
+      offset = 0
+      for (chunkhash, chunklength) in self._chunks:
+         self._offsets.append(offset)
+         offset += chunklength
+      self._position = 0
+      self._chunkindex = -1
+      self._chunkfile = None
+      self.closed = False
+
+   def seek(self, offset, whence=0):
+      if whence == 1:
+         offset += self._position
+      elif whence == 2:
+         offset += self._length
+      self._position = max(0, offset)
+
+   def tell(self):
+      return self._position
+
+   def read(self, size=-1):
+      if size is None or size < 0:
+         size = self._length - self._position
+      data = []
+      while size > 0 and self._position < self._length:
+         chunkindex = bisect.bisect_right(self._offsets, self._position) - 1
+         if chunkindex != self._chunkindex:
+            self._closeChunk()
+            self._chunkfile = file(self._layer.getBlobPath(self._chunks[chunkindex][0]), 'rb', BUFFER_SIZE)
+            self._chunkindex = chunkindex
+         chunkoffset = self._position - self._offsets[chunkindex]
+         if self._chunkfile.tell() != chunkoffset:
+            self._chunkfile.seek(chunkoffset)
+         readbuffer = self._chunkfile.read(min(size, self._chunks[chunkindex][1] - chunkoffset))
+         if not readbuffer:
+            raise IOError('Chunk ' + self._chunks[chunkindex][0] + ' is truncated')
+         data.append(readbuffer)
+         self._position += len(readbuffer)
+         size -= len(readbuffer)
+      return ''.join(data)
+
+   def _closeChunk(self):
+      if self._chunkfile is not None:
+         self._chunkfile.close()
+         self._chunkfile = None
+         self._chunkindex = -1
+
+   def close(self):
+      self._closeChunk()
+      self.closed = True
+
+
+class _DedupWriteFile(object):
+   """
+   Write stream that splits the data into chunks, stores the chunks not yet
+   in the blob directory and writes the manifest over the resource on close().
+   abort() leaves the resource untouched.
+   """
+   def __init__(self, layer, respath, chunksize, syncpolicy):
+      self._layer = layer
+      self._respath = respath
+      self._chunksize = chunksize
+      self._syncpolicy = syncpolicy
+      self._buffer = []
+      self._buffered = 0
+      self._length = 0
+      self._contenthash = _newsha1()
+      self._chunks = []
+      self.closed = False
+
+   def write(self, data):
+      # the content hash is computed inline, as the data arrives
+      self._contenthash.update(data)
+      self._length += len(data)
+      self._buffer.append(data)
+      self._buffered += len(data)
+      if self._buffered >= self._chunksize:
+         data = ''.join(self._buffer)
+         offset = 0
+         while len(data) - offset >= self._chunksize:
+            self._storeChunk(data[offset:offset + self._chunksize])
+            offset += self._chunksize
+         self._buffer = [data[offset:]]
+         self._buffered = len(data) - offset
+
+   def _storeChunk(self, chunkdata):
+      chunkhash = _newsha1(chunkdata).hexdigest()
+      self._layer.storeBlob(chunkhash, chunkdata, self._syncpolicy)
+      self._chunks.append( (chunkhash, len(chunkdata)) )
+
+   def flush(self):
+      pass
+
+   def close(self):
+      if self.closed:
+         return
+      self.closed = True
+      if self._buffered > 0:
+         self._storeChunk(''.join(self._buffer))
+      self._buffer = []
+      manifestlines = [MANIFEST_MAGIC, 'length ' + str(self._length), 'sha1 ' + self._contenthash.hexdigest()]
+      for (chunkhash, chunklength) in self._chunks:
+         manifestlines.append(chunkhash + ' ' + str(chunklength))
+      manifestfile = _RenameOnCloseFile(self._respath, False, None, self._syncpolicy)
+      try:
+         manifestfile.write('\n'.join(manifestlines) + '\n')
+      except:
+         manifestfile.abort()
+         raise
+      manifestfile.close()
+
+   def abort(self):
+      # chunks already stored are left for the garbage collector
+      self.closed = True
+      self._buffer = []
+
+
+class DedupFilesystemAbstractionLayer(FilesystemAbstractionLayer):
+
+   def __init__(self, blobdir, chunksize=DEFAULT_CHUNK_SIZE, hardlinkcopies=False, syncpolicy=SYNC_NONE):
+      FilesystemAbstractionLayer.__init__(self, hardlinkcopies, syncpolicy)
+      self._blobdir = os.path.abspath(blobdir)
+      self._chunksize = chunksize
+      if not os.path.isdir(self._blobdir):
+         os.makedirs(self._blobdir)
+
+   def getBlobPath(self, chunkhash):
+      return os.path.join(self._blobdir, chunkhash[0:2], chunkhash[2:4], chunkhash)
+
+   def storeBlob(self, chunkhash, chunkdata, syncpolicy=SYNC_NONE):
+      blobpath = self.getBlobPath(chunkhash)
+      if os.path.exists(blobpath):
+         return
+      blobparent = os.path.dirname(blobpath)
+      try:
+         os.makedirs(blobparent)
+      except OSError, e:
+         if e.errno != errno.EEXIST:
+            raise
+      # written under a temporary name, so that a blob that exists is complete
+      (fd, temppath) = tempfile.mkstemp(prefix=TEMPFILE_PREFIX, dir=blobparent)
+      try:
+         offset = 0
+         while offset < len(chunkdata):
+            offset += os.write(fd, buffer(chunkdata, offset))
+         _syncFile(fd, syncpolicy)
+      except:
+         os.close(fd)
+         os.unlink(temppath)
+         raise
+      os.close(fd)
+      if sys.platform == 'win32' and os.path.exists(blobpath):
+         os.unlink(temppath) # stored meanwhile by another request
+      else:
+         os.rename(temppath, blobpath)
+
+   def getContentLength(self, respath):
+      if os.path.isfile(respath):
+         manifest = _readManifest(respath, True)
+         if manifest is not None:
+            return manifest.length
+      return FilesystemAbstractionLayer.getContentLength(self, respath)
+
+   def getEntityTag(self, respath):
+      if os.path.isfile(respath):
+         manifest = _readManifest(respath, True)
+         if manifest is not None:
+            return manifest.contenthash
+      return FilesystemAbstractionLayer.getEntityTag(self, respath)
+
+   def openResourceForRead(self, respath):
+      manifest = _readManifest(respath)
+      if manifest is None:
+         return FilesystemAbstractionLayer.openResourceForRead(self, respath)
+      return _ManifestReader(self, manifest)
+
+   def openResourceForWrite(self, respath, contenttype=None, contentlength=None):
+      return _DedupWriteFile(self, respath, self._chunksize, self._syncpolicy)
+
+   def supportPartialWrites(self, respath):
+      return False
+
+   def openResourceRangeForWrite(self, respath, rangestart, totallength):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_IMPLEMENTED)
+
+   def getUploadStatus(self, respath):
+      return None
+
+   def commitUpload(self, respath):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_IMPLEMENTED)
+
+   def abortUpload(self, respath):
+      pass
+
+   def getProperty(self, respath, propertyname, propertyns):
+      if propertyns == 'DAV:' and propertyname == 'getcontentlength' and os.path.isfile(respath):
+         return str(self.getContentLength(respath))
+      return FilesystemAbstractionLayer.getProperty(self, respath, propertyname, propertyns)
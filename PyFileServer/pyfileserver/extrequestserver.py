@@ -15,13 +15,19 @@ subapplication::
 
       constructor :
          __init__(self, propertymanager, 
-                        lockmanager)
+                        lockmanager,
+                        jobmanager = None,
+                        uploadsessionmanager = None)
    
       main application:      
          __call__(self, environ, start_response)
 
       application methods:
          doPUT(self, environ, start_response)
+         doPUTRange(self, environ, start_response, isnewfile)
+         doPUTPart(self, environ, start_response)
+         doPOST(self, environ, start_response)
+         doHEADUploadStatus(self, environ, start_response)
          doOPTIONS(self, environ, start_response)
          doGETHEADDirectory(self, environ, start_response)
          doGETHEADFile(self, environ, start_response)
@@ -34,7 +40,33 @@ subapplication::
          doLOCK(self, environ, start_response)
          doUNLOCK(self, environ, start_response)
 
+      background job methods:
+         performDelete(self, environ, start_response, resourceAL, actionList, 
+                                   job = None)
+         performCopy(self, environ, start_response, resourceAL, ressrclist, 
+                                   resdestlist, job = None)
+         performMove(self, environ, start_response, resourceAL, ressrclist, 
+                                   resdestlist, resdelsrclist, job = None)
+         isAsyncJobRequest(self, environ, entriestotal)
+         startAsyncJob(self, environ, start_response, entriestotal, 
+                                   performfunc, resultpath, successstatus)
+
+      metadata invalidation methods:
+         addMetadataListener(self, listener)
+         invalidateMetadata(self, environ)
+
       misc methods:
+         getQueryArguments(self, environ)
+         openResourceForWrite(self, resourceAL, mappedpath, contenttype, 
+                                   contentlength)
+         supportPartialWrites(self, resourceAL, mappedpath)
+         abortWrite(self, fileobj)
+         getUploadStatusHeaders(self, uploadstatus)
+         getResultStatus(self, dictError, resultpath, successstatus)
+         sendErrorResponse(self, environ, start_response, dictError, 
+                                   resultpath, successstatus)
+         evaluatePUTConditionalsDoException(self, mappedpath, displaypath, 
+                                   resourceAL, environ, start_response)
          evaluateSingleIfConditionalDoException(self, mappedpath, displaypath, 
                                    environ, start_response, checkLock = False)
          evaluateSingleHTTPConditionalsDoException(self, mappedpath, 
@@ -43,6 +75,28 @@ subapplication::
 This module is specific to the PyFileServer application.
 
 
+Resumable uploads
+-----------------
+
+A PUT with a ``Content-Range: bytes first-last/total`` header writes only the
+given range, for abstraction layers that support partial writes. Until all 
+``total`` bytes have been received the resource is left unchanged and the PUT
+is answered with 202 Accepted and the headers::
+
+   X-Upload-Length: <total>
+   X-Upload-Received: <number of bytes received>
+   X-Upload-Ranges: bytes 0-1023,4096-8191
+
+The same headers are returned on a HEAD of the resource (404 Not Found if 
+it does not exist yet), so a client that lost its connection can find out
+which ranges to send again. The PUT that completes the ranges replaces the 
+resource and is answered as a normal PUT. A range PUT with a different total
+restarts the upload.
+
+Very large files can also be uploaded as numbered parts over several 
+connections at once, using an upload session. See uploadsessions.py.
+
+
 Supporting Objects
 ------------------
 
@@ -65,7 +119,20 @@ lockmanager
 
    See locklibrary.LockManager for a sample implementation
    using shelve.
+
+jobmanager
+   An optional object that runs long COPY, MOVE and DELETE requests in the
+   background. The request is answered with 202 Accepted and a job status
+   URL when the client sends a ``Prefer: respond-async`` header, or when the
+   number of entries exceeds the threshold configured for the realm. 
+
+   See jobmanager.JobManager. If None, all requests are processed 
+   synchronously.
 
+uploadsessionmanager
+   An optional object that keeps track of multi-part upload sessions, see
+   uploadsessions.UploadSessionManager. If None, POST is not allowed.
+
 The RequestServer also uses a resource abstraction layer placed in 
 ``environ['pyfileserver.resourceAL']`` by requestresolver.py
 
@@ -89,6 +156,7 @@ __docformat__ = 'reStructuredText'
 
 import urllib
 import re
+import cgi
 import StringIO
 import traceback
 import sys
@@ -107,11 +175,30 @@ from xml.dom import implementation, Node
 
 BUFFER_SIZE = 8192
 BUF_SIZE = 8192
+PUT_BUFFER_SIZE = 65536
 
 class RequestServer(object):
-    def __init__(self, propertymanager, lockmanager):
+    def __init__(self, propertymanager, lockmanager, jobmanager=None, uploadsessionmanager=None):
         self._propertymanager = propertymanager
         self._lockmanager = lockmanager
+        self._jobmanager = jobmanager
+        self._uploadsessionmanager = uploadsessionmanager
+        self._metadatalisteners = []
+
+    def addMetadataListener(self, listener):
+        """
+        Registers listener(resourceAL, mappedpath) to be called after a 
+        request may have created, removed or replaced resources at or below 
+        mappedpath, for caches of resource metadata.
+        """
+        self._metadatalisteners.append(listener)
+
+    def invalidateMetadata(self, environ):
+        resourceAL = environ['pyfileserver.resourceAL']
+        for listener in self._metadatalisteners:
+            listener(resourceAL, environ['pyfileserver.mappedpath'])
+            if 'pyfileserver.destpath' in environ:
+                listener(resourceAL, environ['pyfileserver.destpath'])
 
     def __call__(self, environ, start_response):
 
@@ -133,6 +220,8 @@ class RequestServer(object):
                 return self.doGETHEADDirectory(environ, start_response)
             elif resourceAL.isResource(mappedpath):
                 return self.doGETHEADFile(environ, start_response)
+            elif requestmethod == 'HEAD' and self.supportPartialWrites(resourceAL, mappedpath):
+                return self.doHEADUploadStatus(environ, start_response)
             else:
                 raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)               
 
@@ -154,20 +243,34 @@ class RequestServer(object):
 
         elif requestmethod == 'PUT':
             return self.doPUT(environ, start_response)
+        elif requestmethod == 'POST':
+            return self.doPOST(environ, start_response)
         elif requestmethod == 'DELETE':
-            return self.doDELETE(environ, start_response)
+            try:
+                return self.doDELETE(environ, start_response)
+            finally:
+                self.invalidateMetadata(environ)
         elif requestmethod == 'OPTIONS':
             return self.doOPTIONS(environ, start_response)
         elif requestmethod == 'MKCOL':
-            return self.doMKCOL(environ, start_response)
+            try:
+                return self.doMKCOL(environ, start_response)
+            finally:
+                self.invalidateMetadata(environ)
         elif requestmethod == 'PROPPATCH':
             return self.doPROPPATCH(environ, start_response)
         elif requestmethod == 'PROPFIND':
             return self.doPROPFIND(environ, start_response)
         elif requestmethod == 'COPY':
-            return self.doCOPY(environ, start_response)
+            try:
+                return self.doCOPY(environ, start_response)
+            finally:
+                self.invalidateMetadata(environ)
         elif requestmethod == 'MOVE':
-            return self.doMOVE(environ, start_response)
+            try:
+                return self.doMOVE(environ, start_response)
+            finally:
+                self.invalidateMetadata(environ)
         elif requestmethod == 'LOCK':
             return self.doLOCK(environ, start_response)
         elif requestmethod == 'UNLOCK':
@@ -186,70 +289,54 @@ class RequestServer(object):
         displaypath =  environ['pyfileserver.mappedURI']
         resourceAL = environ['pyfileserver.resourceAL']
 
-        if resourceAL.isCollection(mappedpath):
-            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
-
-        if not resourceAL.isCollection(resourceAL.getContainingCollection(mappedpath)):
-            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
-
-        isnewfile = not resourceAL.isResource(mappedpath)
-        if not isnewfile:
-            if resourceAL.supportLastModified(mappedpath):
-                lastmodified = resourceAL.getLastModified(mappedpath)            
-            else:
-                lastmodified = -1
-            
-            if resourceAL.supportEntityTag(mappedpath):
-                entitytag = resourceAL.getEntityTag(mappedpath)         
-            else:
-                entitytag = '[]'
-        else:
-            lastmodified = -1
-            entitytag = '[]'
-
-            # must check locking on collection if is new file - adding entry to collection
-            urlparentpath = websupportfuncs.getLevelUpURL(displaypath)      
-            if locklibrary.isUrlLocked(self._lockmanager, urlparentpath):
-                self.evaluateSingleIfConditionalDoException(resourceAL.getContainingCollection(mappedpath), urlparentpath, environ, start_response, checkLock=True)
+        if 'uploadsession' in self.getQueryArguments(environ):
+            return self.doPUTPart(environ, start_response)
 
-        # isUrlLocked returns lock type - None if not locked
-        if resourceAL.exists(mappedpath) or locklibrary.isUrlLocked(self._lockmanager, displaypath):
-            self.evaluateSingleIfConditionalDoException( mappedpath, displaypath, environ, start_response, checkLock=True)
-        self.evaluateSingleHTTPConditionalsDoException( mappedpath, displaypath, environ, start_response)
+        isnewfile = self.evaluatePUTConditionalsDoException(mappedpath, displaypath, resourceAL, environ, start_response)
 
         ## Test for unsupported stuff
         if 'HTTP_CONTENT_ENCODING' in environ:
             raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_IMPLEMENTED)
 
         if 'HTTP_CONTENT_RANGE' in environ:
-            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_IMPLEMENTED)
+            if not self.supportPartialWrites(resourceAL, mappedpath):
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_IMPLEMENTED)
+            return self.doPUTRange(environ, start_response, isnewfile)
 
         ## Start Content Processing
-        if 'HTTP_CONTENT_LENGTH' in environ:
-            try:
-                contentlength = long(environ.get('HTTP_CONTENT_LENGTH', -1))
-            except ValueError: 
-                contentlength = -1 #read as much as possible
+        contentlength = -1 #read as much as possible
+        try:
+            contentlength = long(environ.get('CONTENT_LENGTH', '') or environ.get('HTTP_CONTENT_LENGTH', -1))
+        except ValueError: 
+            pass
 
+        fileobj = None
         try:      
-            fileobj = resourceAL.openResourceForWrite(mappedpath, contenttype=environ.get('HTTP_CONTENT_TYPE', None))
+            fileobj = self.openResourceForWrite(resourceAL, mappedpath, environ.get('HTTP_CONTENT_TYPE', None), (contentlength >= 0 and contentlength or None))
             contentlengthremaining = contentlength
 
             while 1:
-                if contentlengthremaining < 0 or contentlengthremaining > BUFFER_SIZE:
-                    readbuffer = environ['wsgi.input'].read(BUFFER_SIZE)
+                if contentlengthremaining < 0 or contentlengthremaining > PUT_BUFFER_SIZE:
+                    readbuffer = environ['wsgi.input'].read(PUT_BUFFER_SIZE)
                 else:
                     readbuffer = environ['wsgi.input'].read(contentlengthremaining)
                 contentlengthremaining -= len(readbuffer)
                 fileobj.write(readbuffer)
                 if len(readbuffer) == 0 or contentlengthremaining == 0:
                     break
+
+            if contentlengthremaining > 0:
+                # client went away before sending the whole body
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
             fileobj.close()
+            fileobj = None
             locklibrary.checkLocksToAdd(self._lockmanager, displaypath)
             
         except HTTPRequestException, e:
+            self.abortWrite(fileobj)
             raise
         except Exception, e:
+            self.abortWrite(fileobj)
             raise HTTPRequestException(processrequesterrorhandler.HTTP_INTERNAL_ERROR, srcexception=e) 
 
         if isnewfile:
@@ -260,6 +347,180 @@ class RequestServer(object):
         return ['']
 
 
+    def doPUTRange(self, environ, start_response, isnewfile):
+        mappedpath = environ['pyfileserver.mappedpath']
+        displaypath =  environ['pyfileserver.mappedURI']
+        resourceAL = environ['pyfileserver.resourceAL']
+
+        contentrange = websupportfuncs.obtainContentRange(environ['HTTP_CONTENT_RANGE'])
+        if contentrange is None:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+        (rangestart, rangeend, totallength) = contentrange
+        rangelength = rangeend - rangestart + 1
+
+        contentlength = -1
+        try:
+            contentlength = long(environ.get('CONTENT_LENGTH', '') or environ.get('HTTP_CONTENT_LENGTH', -1))
+        except ValueError: 
+            pass
+        if contentlength >= 0 and contentlength != rangelength:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+
+        fileobj = None
+        try:
+            fileobj = resourceAL.openResourceRangeForWrite(mappedpath, rangestart, totallength)
+            contentlengthremaining = rangelength
+            while contentlengthremaining > 0:
+                readbuffer = environ['wsgi.input'].read(min(contentlengthremaining, PUT_BUFFER_SIZE))
+                if len(readbuffer) == 0:
+                    break
+                fileobj.write(readbuffer)
+                contentlengthremaining -= len(readbuffer)
+
+            if contentlengthremaining > 0:
+                # the bytes received are kept, the client may resume after them
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+            fileobj.close()
+            fileobj = None
+
+            uploadstatus = resourceAL.getUploadStatus(mappedpath)
+            if uploadstatus is not None and uploadstatus[1] == [(0, totallength - 1)]:
+                try:
+                    resourceAL.commitUpload(mappedpath)
+                except HTTPRequestException:
+                    # a concurrent request for the last range may have committed it
+                    if resourceAL.getUploadStatus(mappedpath) is not None:
+                        raise
+                uploadstatus = None
+                locklibrary.checkLocksToAdd(self._lockmanager, displaypath)
+
+        except HTTPRequestException, e:
+            self.abortWrite(fileobj)
+            raise
+        except Exception, e:
+            self.abortWrite(fileobj)
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_INTERNAL_ERROR, srcexception=e) 
+
+        if uploadstatus is not None:
+            responseHeaders = [('Content-Type', 'text/html'), ('Content-Length','0'), ('Date',httpdatehelper.getstrftime())]
+            responseHeaders.extend(self.getUploadStatusHeaders(uploadstatus))
+            start_response('202 Accepted', responseHeaders)
+        elif isnewfile:
+            start_response('201 Created', [('Content-Type', 'text/html'), ('Content-Length','0'), ('Date',httpdatehelper.getstrftime())])
+        else:
+            start_response('200 OK', [('Content-Type', 'text/html'), ('Content-Length','0'), ('Date',httpdatehelper.getstrftime())])
+        return ['']
+
+    def doHEADUploadStatus(self, environ, start_response):
+        # the resource does not exist yet, but a partial upload for it does
+        mappedpath = environ['pyfileserver.mappedpath']
+        resourceAL = environ['pyfileserver.resourceAL']
+
+        uploadstatus = resourceAL.getUploadStatus(mappedpath)
+        if uploadstatus is None:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)               
+        responseHeaders = [('Content-Length','0'), ('Date',httpdatehelper.getstrftime())]
+        responseHeaders.extend(self.getUploadStatusHeaders(uploadstatus))
+        start_response('404 Not Found', responseHeaders)
+        return ['']
+
+    def doPOST(self, environ, start_response):
+        # POST is only used for upload sessions
+        mappedpath = environ['pyfileserver.mappedpath']
+        displaypath =  environ['pyfileserver.mappedURI']
+        resourceAL = environ['pyfileserver.resourceAL']
+
+        queryargs = self.getQueryArguments(environ)
+        if self._uploadsessionmanager is None or ('uploads' not in queryargs and 'uploadsession' not in queryargs):
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_METHOD_NOT_ALLOWED)
+
+        if 'uploads' in queryargs:
+            # open session
+            if not self.supportPartialWrites(resourceAL, mappedpath):
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_IMPLEMENTED)
+            self.evaluatePUTConditionalsDoException(mappedpath, displaypath, resourceAL, environ, start_response)
+            try:
+                totallength = long(environ.get('HTTP_X_UPLOAD_LENGTH', ''))
+                partsize = environ.get('HTTP_X_UPLOAD_PART_SIZE', None)
+                if partsize is not None:
+                    partsize = long(partsize)
+            except ValueError:
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+            session = self._uploadsessionmanager.createSession(resourceAL, mappedpath, displaypath, environ['pyfileserver.username'], totallength, partsize)
+            start_response('201 Created', [('Content-Length','0'), ('X-Upload-Session', session.sessionid), ('X-Upload-Part-Size', str(session.partsize)), ('X-Upload-Parts', str(session.numparts)), ('Date',httpdatehelper.getstrftime())])
+            return ['']
+
+        session = self._uploadsessionmanager.getSession(queryargs['uploadsession'][0], mappedpath, environ['pyfileserver.username'])
+        if 'commit' in queryargs:
+            isnewfile = self.evaluatePUTConditionalsDoException(mappedpath, displaypath, resourceAL, environ, start_response)
+            self._uploadsessionmanager.commitSession(session)
+            locklibrary.checkLocksToAdd(self._lockmanager, displaypath)
+            if isnewfile:
+                start_response('201 Created', [('Content-Length','0'), ('Date',httpdatehelper.getstrftime())])
+            else:
+                start_response('204 No Content', [('Content-Length','0'), ('Date',httpdatehelper.getstrftime())])
+            return ['']
+        elif 'abort' in queryargs:
+            self._uploadsessionmanager.abortSession(session)
+            start_response('204 No Content', [('Content-Length','0'), ('Date',httpdatehelper.getstrftime())])
+            return ['']
+        raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+
+    def doPUTPart(self, environ, start_response):
+        mappedpath = environ['pyfileserver.mappedpath']
+        resourceAL = environ['pyfileserver.resourceAL']
+
+        if self._uploadsessionmanager is None:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_IMPLEMENTED)
+
+        queryargs = self.getQueryArguments(environ)
+        session = self._uploadsessionmanager.getSession(queryargs['uploadsession'][0], mappedpath, environ['pyfileserver.username'])
+        try:
+            partnumber = int(queryargs.get('part', [''])[0])
+        except ValueError:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+        (rangestart, rangeend) = session.getPartRange(partnumber)
+
+        contentlength = -1
+        try:
+            contentlength = long(environ.get('CONTENT_LENGTH', '') or environ.get('HTTP_CONTENT_LENGTH', -1))
+        except ValueError: 
+            pass
+        if contentlength >= 0 and contentlength != rangeend - rangestart + 1:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+
+        self._uploadsessionmanager.beginPart(session)
+        fileobj = None
+        try:
+            try:
+                fileobj = resourceAL.openResourceRangeForWrite(mappedpath, rangestart, session.totallength)
+                contentlengthremaining = rangeend - rangestart + 1
+                while contentlengthremaining > 0:
+                    readbuffer = environ['wsgi.input'].read(min(contentlengthremaining, PUT_BUFFER_SIZE))
+                    if len(readbuffer) == 0:
+                        break
+                    fileobj.write(readbuffer)
+                    contentlengthremaining -= len(readbuffer)
+                if contentlengthremaining > 0:
+                    raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+                fileobj.close()
+                fileobj = None
+            except HTTPRequestException, e:
+                self.abortWrite(fileobj)
+                raise
+            except Exception, e:
+                self.abortWrite(fileobj)
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_INTERNAL_ERROR, srcexception=e) 
+        finally:
+            self._uploadsessionmanager.endPart(session)
+
+        responseHeaders = [('Content-Length','0'), ('Date',httpdatehelper.getstrftime())]
+        uploadstatus = resourceAL.getUploadStatus(mappedpath)
+        if uploadstatus is not None:
+            responseHeaders.extend(self.getUploadStatusHeaders(uploadstatus))
+        start_response('204 No Content', responseHeaders)
+        return ['']
+
     def doOPTIONS(self, environ, start_response):
         resourceAL = environ['pyfileserver.resourceAL']
 
@@ -408,6 +669,10 @@ a.symlink { font-style: italic; }
         responseHeaders.append(('Date', httpdatehelper.getstrftime()))
         if resourceAL.supportEntityTag(mappedpath):
             responseHeaders.append(('ETag', '"%s"' % entitytag))
+        if environ['REQUEST_METHOD'] == 'HEAD' and self.supportPartialWrites(resourceAL, mappedpath):
+            uploadstatus = resourceAL.getUploadStatus(mappedpath)
+            if uploadstatus is not None:
+                responseHeaders.extend(self.getUploadStatusHeaders(uploadstatus))
  
         if ispartialranges:
             responseHeaders.append(('Content-Ranges', 'bytes ' + str(rangestart) + '-' + str(rangeend) + '/' + rangelength))
@@ -420,21 +685,23 @@ a.symlink { font-style: italic; }
             return
 
         fileobj = resourceAL.openResourceForRead(mappedpath)
+        # closed also if the client goes away before the end
+        try:
+            if not doignoreranges:
+                fileobj.seek(rangestart)
 
-        if not doignoreranges:
-            fileobj.seek(rangestart)
-
-        contentlengthremaining = rangelength
-        while 1:
-            if contentlengthremaining < 0 or contentlengthremaining > BUFFER_SIZE:
-                readbuffer = fileobj.read(BUFFER_SIZE)
-            else:
-                readbuffer = fileobj.read(contentlengthremaining)
-            yield readbuffer
-            contentlengthremaining -= len(readbuffer)
-            if len(readbuffer) == 0 or contentlengthremaining == 0:
-                break
-        fileobj.close()
+            contentlengthremaining = rangelength
+            while 1:
+                if contentlengthremaining < 0 or contentlengthremaining > BUFFER_SIZE:
+                    readbuffer = fileobj.read(BUFFER_SIZE)
+                else:
+                    readbuffer = fileobj.read(contentlengthremaining)
+                yield readbuffer
+                contentlengthremaining -= len(readbuffer)
+                if len(readbuffer) == 0 or contentlengthremaining == 0:
+                    break
+        finally:
+            fileobj.close()
         return
 
 
@@ -501,9 +768,25 @@ a.symlink { font-style: italic; }
 
         actionList = websupportfuncs.getDepthActionList(resourceAL, mappedpath, displaypath, environ['HTTP_DEPTH'], False)
 
+        if self.isAsyncJobRequest(environ, len(actionList)):
+            def performfunc(job, jobenviron):
+                return self.performDelete(jobenviron, start_response, resourceAL, actionList, job)
+            return self.startAsyncJob(environ, start_response, len(actionList), performfunc, displaypath, '204 No Content')
+
+        dictError = self.performDelete(environ, start_response, resourceAL, actionList)
+        return self.sendErrorResponse(environ, start_response, dictError, displaypath, '204 No Content')
+
+
+    def performDelete(self, environ, start_response, resourceAL, actionList, job=None):
         dictError = {} #errors in deletion
+        if job is not None:
+            job.dictError = dictError
         dictHidden = {} #hidden errors, ancestors of failed deletes
         for (filepath, filedisplaypath) in actionList:
+            if job is not None:
+                if job.cancelrequested:
+                    break
+                job.entriesdone += 1
             if filepath in dictHidden:
                 dictHidden[resourceAL.getContainingCollection(filepath)] = ''
                 continue            
@@ -533,21 +816,7 @@ a.symlink { font-style: italic; }
                 if resourceAL.exists(filepath) and filedisplaypath not in dictError:
                     dictError[filedisplaypath] = '500 Internal Server Error'
                     dictHidden[resourceAL.getContainingCollection(filepath)] = ''
-
-        if len(dictError) == 1 and displaypath in dictError:
-            start_response(dictError[displaypath], [('Content-Length','0')])
-            yield ''      
-        elif len(dictError) > 0:
-            start_response('207 Multi Status', [('Content-Length','0')])
-            yield "<?xml version='1.0' ?>\n<D:multistatus xmlns:D='DAV:'>"
-            for filedisplaypath in dictError.keys():
-                yield "<D:response>\n<D:href>" + websupportfuncs.constructFullURL(filedisplaypath, environ) + "</D:href>"            
-                yield "<D:status>HTTP/1.1 " + dictError[filedisplaypath] + "</D:status>\n</D:response>"            
-            yield "</D:multistatus>"
-        else:
-            start_response('204 No Content', [('Content-Length','0')])
-            yield ''
-        return
+        return dictError
 
 
     def doPROPPATCH(self, environ, start_response):
@@ -824,10 +1093,31 @@ a.symlink { font-style: italic; }
         if 'HTTP_OVERWRITE' not in environ:
             environ['HTTP_OVERWRITE'] = 'T'
 
+        if destexists:
+            successstatus = '204 No Content'
+        else:
+            successstatus = '201 Created'
+
+        if self.isAsyncJobRequest(environ, len(ressrclist)):
+            def performfunc(job, jobenviron):
+                return self.performCopy(jobenviron, start_response, resourceAL, ressrclist, resdestlist, job)
+            return self.startAsyncJob(environ, start_response, len(ressrclist), performfunc, destdisplaypath, successstatus)
+
+        dictError = self.performCopy(environ, start_response, resourceAL, ressrclist, resdestlist)
+        return self.sendErrorResponse(environ, start_response, dictError, destdisplaypath, successstatus)
+
+
+    def performCopy(self, environ, start_response, resourceAL, ressrclist, resdestlist, job=None):
         # @@: This is a complex and highly nested loop; it should be refactored somehow
         dictError = {}
         dictHidden = {}        
+        if job is not None:
+            job.dictError = dictError
         for cpidx in range(0, len(ressrclist)):
+            if job is not None:
+                if job.cancelrequested:
+                    break
+                job.entriesdone += 1
             (filepath, filedisplaypath) = ressrclist[cpidx]     
             (destfilepath, destfiledisplaypath) = resdestlist[cpidx]     
             destparentpath = resourceAL.getContainingCollection(destfilepath)
@@ -890,24 +1180,7 @@ a.symlink { font-style: italic; }
                     dictHidden[destfilepath] = ''           
             else:
                 dictHidden[destfilepath] = ''
-
-        if len(dictError) == 1 and destdisplaypath in dictError:
-            start_response(dictError[destdisplaypath], [('Content-Length','0')])
-            yield ''      
-        elif len(dictError) > 0:
-            start_response('207 Multi Status', [('Content-Length','0')])
-            yield "<?xml version='1.0' ?>\n<D:multistatus xmlns:D='DAV:'>"
-            for filedisplaypath in dictError.keys():
-                yield "<D:response>\n<D:href>" + websupportfuncs.constructFullURL(filedisplaypath, environ) + "</D:href>"            
-                yield "<D:status>HTTP/1.1 " + dictError[filedisplaypath] + "</D:status>\n</D:response>"            
-            yield "</D:multistatus>"
-        else:
-            if destexists:
-                start_response('204 No Content', [('Content-Length','0')])         
-            else:
-                start_response('201 Created', [('Content-Length','0')])
-            yield ''
-        return
+        return dictError
 
     def doMOVE(self, environ, start_response):
         mappedrealm = environ['pyfileserver.mappedrealm']
@@ -945,11 +1218,32 @@ a.symlink { font-style: italic; }
         if 'HTTP_OVERWRITE' not in environ:
             environ['HTTP_OVERWRITE'] = 'T'
 
+        if destexists:
+            successstatus = '204 No Content'
+        else:
+            successstatus = '201 Created'
+
+        if self.isAsyncJobRequest(environ, len(ressrclist)):
+            def performfunc(job, jobenviron):
+                return self.performMove(jobenviron, start_response, resourceAL, ressrclist, resdestlist, resdelsrclist, job)
+            return self.startAsyncJob(environ, start_response, len(ressrclist) + len(resdelsrclist), performfunc, destdisplaypath, successstatus)
+
+        dictError = self.performMove(environ, start_response, resourceAL, ressrclist, resdestlist, resdelsrclist)
+        return self.sendErrorResponse(environ, start_response, dictError, destdisplaypath, successstatus)
+
+
+    def performMove(self, environ, start_response, resourceAL, ressrclist, resdestlist, resdelsrclist, job=None):
         dictError = {}
         dictHidden = {}        
         dictDoNotDel = {}
+        if job is not None:
+            job.dictError = dictError
         # @@: Against, this should be refactored to be shorter and less deeply nested
         for cpidx in range(0, len(ressrclist)):
+            if job is not None:
+                if job.cancelrequested:
+                    return dictError # leave the source alone
+                job.entriesdone += 1
             (filepath, filedisplaypath) = ressrclist[cpidx]     
             (destfilepath, destfiledisplaypath) = resdestlist[cpidx]     
             destparentpath = resourceAL.getContainingCollection(destfilepath)
@@ -1022,6 +1316,10 @@ a.symlink { font-style: italic; }
         # do DELETE with infinity on source
         FdictHidden = {} #hidden errors, ancestors of failed deletes         
         for (Ffilepath, Ffiledisplaypath) in resdelsrclist:         
+            if job is not None:
+                if job.cancelrequested:
+                    break
+                job.entriesdone += 1
             if Ffilepath not in FdictHidden and Ffilepath not in dictDoNotDel:
                 try:      
                     if resourceAL.isCollection(Ffilepath):
@@ -1036,24 +1334,7 @@ a.symlink { font-style: italic; }
                     FdictHidden[resourceAL.getContainingCollection(Ffilepath)] = ''
             else:
                 FdictHidden[resourceAL.getContainingCollection(Ffilepath)] = ''
-
-        if len(dictError) == 1 and destdisplaypath in dictError:
-            start_response(dictError[destdisplaypath], [('Content-Length','0')])
-            yield ''      
-        elif len(dictError) > 0:
-            start_response('207 Multi Status', [('Content-Length','0')])
-            yield "<?xml version='1.0' ?>\n<D:multistatus xmlns:D='DAV:'>"
-            for filedisplaypath in dictError.keys():
-                yield "<D:response>\n<D:href>" + websupportfuncs.constructFullURL(filedisplaypath, environ) + "</D:href>"            
-                yield "<D:status>HTTP/1.1 " + dictError[filedisplaypath] + "</D:status>\n</D:response>"            
-            yield "</D:multistatus>"
-        else:
-            if destexists:
-                start_response('204 No Content', [('Content-Length','0')])         
-            else:
-                start_response('201 Created', [('Content-Length','0')])
-            yield ''
-        return
+        return dictError
 
     def doLOCK(self, environ, start_response):
         environ.setdefault('HTTP_DEPTH', 'infinity')         
@@ -1244,6 +1525,127 @@ a.symlink { font-style: italic; }
         raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
         return
 
+    def getQueryArguments(self, environ):
+        return cgi.parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values=True)
+
+    def openResourceForWrite(self, resourceAL, mappedpath, contenttype, contentlength):
+        # abstraction layers written before the contentlength argument lack
+        # supportWriteLength
+        supportwritelength = getattr(resourceAL, 'supportWriteLength', None)
+        if supportwritelength is not None and supportwritelength(mappedpath):
+            return resourceAL.openResourceForWrite(mappedpath, contenttype=contenttype, contentlength=contentlength)
+        return resourceAL.openResourceForWrite(mappedpath, contenttype=contenttype)
+
+    def supportPartialWrites(self, resourceAL, mappedpath):
+        # abstraction layers written before partial uploads lack the method
+        supportpartialwrites = getattr(resourceAL, 'supportPartialWrites', None)
+        return supportpartialwrites is not None and supportpartialwrites(mappedpath)
+
+    def abortWrite(self, fileobj):
+        # streams from openResourceForWrite may support abort() to discard 
+        # a partial upload, otherwise the partial data is kept
+        if fileobj is None:
+            return
+        try:
+            if hasattr(fileobj, 'abort'):
+                fileobj.abort()
+            else:
+                fileobj.close()
+        except Exception:
+            pass
+
+    def getUploadStatusHeaders(self, uploadstatus):
+        (totallength, extents) = uploadstatus
+        receivedlength = 0
+        for (firstpos, lastpos) in extents:
+            receivedlength += lastpos - firstpos + 1
+        headers = [('X-Upload-Length', str(totallength)), ('X-Upload-Received', str(receivedlength))]
+        if len(extents) > 0:
+            headers.append( ('X-Upload-Ranges', 'bytes ' + ','.join(['%d-%d' % extent for extent in extents])) )
+        return headers
+
+    def getResultStatus(self, dictError, resultpath, successstatus):
+        if len(dictError) == 1 and resultpath in dictError:
+            return dictError[resultpath]
+        elif len(dictError) > 0:
+            return '207 Multi Status'
+        return successstatus
+
+    def sendErrorResponse(self, environ, start_response, dictError, resultpath, successstatus):
+        respstatus = self.getResultStatus(dictError, resultpath, successstatus)
+        if respstatus != '207 Multi Status':
+            start_response(respstatus, [('Content-Length','0'), ('Date',httpdatehelper.getstrftime())])
+            return ['']
+        start_response(respstatus, [('Content-Type','text/xml'), ('Date',httpdatehelper.getstrftime())])
+        respbody = ["<?xml version='1.0' ?>\n<D:multistatus xmlns:D='DAV:'>"]
+        for filedisplaypath in dictError.keys():
+            respbody.append("<D:response>\n<D:href>" + websupportfuncs.constructFullURL(filedisplaypath, environ) + "</D:href>")
+            respbody.append("<D:status>HTTP/1.1 " + dictError[filedisplaypath] + "</D:status>\n</D:response>")
+        respbody.append("</D:multistatus>")
+        return respbody
+
+    def isAsyncJobRequest(self, environ, entriestotal):
+        if self._jobmanager is None:
+            return False
+        if 'respond-async' in environ.get('HTTP_PREFER', '').lower():
+            return True
+        threshold = self._jobmanager.getThreshold(environ['pyfileserver.mappedrealm'])
+        return threshold > 0 and entriestotal > threshold
+
+    def startAsyncJob(self, environ, start_response, entriestotal, performfunc, resultpath, successstatus):
+        # the job outlives this request - keep a copy of the environ the 
+        # conditionals are evaluated against, minus the request streams
+        jobenviron = environ.copy()
+        jobenviron.pop('wsgi.input', None)
+        def _runjob(job):
+            try:
+                dictError = performfunc(job, jobenviron)
+            finally:
+                self.invalidateMetadata(jobenviron)
+            return self.getResultStatus(dictError, resultpath, successstatus)
+        job = self._jobmanager.submitJob(environ['REQUEST_METHOD'], environ['pyfileserver.mappedURI'], environ.get('pyfileserver.username', ''), entriestotal, _runjob)
+        statusxml = self._jobmanager.getJobStatusXML(job, environ)
+        headers = [('Content-Type','text/xml'), ('Content-Length', str(len(statusxml))), ('Location', self._jobmanager.getJobURL(job, environ)), ('Date',httpdatehelper.getstrftime())]
+        if 'respond-async' in environ.get('HTTP_PREFER', '').lower():
+            headers.append( ('Preference-Applied', 'respond-async') )
+        start_response('202 Accepted', headers)
+        return [statusxml]
+
+    def evaluatePUTConditionalsDoException(self, mappedpath, displaypath, resourceAL, environ, start_response):
+        # checks common to all requests that write the content of a resource, 
+        # returns whether the resource is new
+        if resourceAL.isCollection(mappedpath):
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+
+        if not resourceAL.isCollection(resourceAL.getContainingCollection(mappedpath)):
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+
+        isnewfile = not resourceAL.isResource(mappedpath)
+        if not isnewfile:
+            if resourceAL.supportLastModified(mappedpath):
+                lastmodified = resourceAL.getLastModified(mappedpath)            
+            else:
+                lastmodified = -1
+            
+            if resourceAL.supportEntityTag(mappedpath):
+                entitytag = resourceAL.getEntityTag(mappedpath)         
+            else:
+                entitytag = '[]'
+        else:
+            lastmodified = -1
+            entitytag = '[]'
+
+            # must check locking on collection if is new file - adding entry to collection
+            urlparentpath = websupportfuncs.getLevelUpURL(displaypath)      
+            if locklibrary.isUrlLocked(self._lockmanager, urlparentpath):
+                self.evaluateSingleIfConditionalDoException(resourceAL.getContainingCollection(mappedpath), urlparentpath, environ, start_response, checkLock=True)
+
+        # isUrlLocked returns lock type - None if not locked
+        if resourceAL.exists(mappedpath) or locklibrary.isUrlLocked(self._lockmanager, displaypath):
+            self.evaluateSingleIfConditionalDoException( mappedpath, displaypath, environ, start_response, checkLock=True)
+        self.evaluateSingleHTTPConditionalsDoException( mappedpath, displaypath, environ, start_response)
+        return isnewfile
+
     def evaluateSingleIfConditionalDoException(self, mappedpath, displaypath, environ, start_response, checkLock=False):
         resourceAL = environ['pyfileserver.resourceAL']
 
@@ -18,6 +18,67 @@ abstractionlayerinterface_
 See extrequestserver.py for more information about resource abstraction layers in 
 PyFileServer
 
+
+Hardlinked copies
+-----------------
+
+``FilesystemAbstractionLayer`` can be constructed with ``hardlinkcopies=True``
+for realms whose files are copied far more often than they are modified 
+(release promotion of build artifacts, for example)::
+
+   addAL('releases', FilesystemAbstractionLayer(hardlinkcopies=True))
+   
+COPY (and MOVE, which is implemented as copy and delete) then creates a hard 
+link to the source file instead of copying its bytes, so copying a large tree
+only costs metadata. Copies stay independent since resources are never 
+written in place (see below).
+
+If the platform or filesystem cannot link (e.g. when the copy crosses a mount
+point) the file is copied as usual.
+
+
+Resource writes
+---------------
+
+``FilesystemAbstractionLayer.openResourceForWrite`` never writes into the 
+resource itself. The data is written into a temporary file in the same 
+directory, which is renamed over the resource when the stream is closed, so
+readers see either the old or the new contents and a failed upload (the 
+stream is aborted) leaves the resource unchanged. Since the resource is 
+replaced, any other hard link to it keeps the old contents.
+
+Data is written in large blocks and, where the platform provides 
+posix_fallocate, space for the whole upload is allocated up front. How the data
+is flushed to disk before the rename is set per abstraction layer with 
+``syncpolicy``::
+
+   addAL('durable', FilesystemAbstractionLayer(syncpolicy='full'))
+
+none
+   leave flushing to the operating system (default)
+
+data
+   flush the file data (fdatasync) before renaming
+
+full
+   flush the file (fsync) before renaming, and the directory after renaming
+
+
+Partial uploads
+---------------
+
+``FilesystemAbstractionLayer`` supports PUT with a Content-Range header, so
+that an interrupted upload can be resumed instead of restarted. The ranges
+are written at their offsets into a staging file next to the resource, and
+the ranges received so far are recorded in a small sidecar file. Both are
+hidden from collection listings. Once the ranges cover the whole length, the
+staging file is renamed over the resource like any other write. 
+
+The progress of an upload is reported by ``getUploadStatus``, which the 
+RequestServer returns in HEAD responses and which is available as the live
+properties ``uploadlength``, ``uploadreceived`` and ``uploadranges`` in the 
+``http://pyfilesync.berlios.de/ns/uploads`` namespace of an existing resource.
+
 """
 
 __docformat__ = 'reStructuredText'
@@ -28,6 +89,8 @@ import md5
 import mimetypes
 import shutil
 import stat
+import tempfile
+import threading
 
 from processrequesterrorhandler import HTTPRequestException
 import processrequesterrorhandler
@@ -35,7 +98,265 @@ import httpdatehelper
 
 BUFFER_SIZE = 8192
 
+# temporary files written next to the resources use this prefix, and are
+# never listed as collection members
+TEMPFILE_PREFIX = '.pyfileserver-'
+
+# resource data is written to disk in blocks of this size (a multiple of the
+# filesystem block size)
+WRITE_BLOCK_SIZE = 1048576
+
+# when written resources are flushed to disk: 
+#    none - left to the operating system
+#    data - file data is flushed before the resource is replaced
+#    full - file data and the directory entry are flushed 
+SYNC_NONE = 'none'
+SYNC_DATA = 'data'
+SYNC_FULL = 'full'
+SYNC_POLICIES = [SYNC_NONE, SYNC_DATA, SYNC_FULL]
+
+# staging files of partial uploads, and the list of byte ranges received in
+# the sidecar file next to it
+UPLOAD_PREFIX = TEMPFILE_PREFIX + 'upload-'
+UPLOAD_SIDECAR_SUFFIX = '.ranges'
+
+# namespace of the live properties reporting partial uploads
+UPLOAD_NAMESPACE = 'http://pyfilesync.berlios.de/ns/uploads'
+
+# os.posix_fallocate is only available from python 3.3
+_posix_fallocate = getattr(os, 'posix_fallocate', None)
+
+# mkstemp creates files readable only by the owner, new resources get the 
+# usual permissions
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# windows needs binary mode to write at byte offsets
+_O_BINARY = getattr(os, 'O_BINARY', 0)
+
+# locks serializing the sidecar updates of an upload, chosen by the hash of 
+# its staging path. A fixed number of them, shared by unrelated uploads now 
+# and then, rather than one per upload ever made
+UPLOAD_LOCK_STRIPES = 64
+_uploadlocks = [threading.Lock() for stripe in range(UPLOAD_LOCK_STRIPES)]
+
+
+def _syncFile(fd, syncpolicy):
+   if syncpolicy == SYNC_DATA:
+      getattr(os, 'fdatasync', os.fsync)(fd)
+   elif syncpolicy == SYNC_FULL:
+      os.fsync(fd)
+
+
+def _replaceResource(temppath, respath, syncpolicy):
+   # renames the fully written temppath over respath
+   if os.path.exists(respath):
+      shutil.copymode(respath, temppath)
+      if sys.platform == 'win32':
+         # rename does not replace an existing file on windows
+         os.unlink(respath)
+   else:
+      os.chmod(temppath, 0666 & ~_UMASK)
+   os.rename(temppath, respath)
+   if syncpolicy == SYNC_FULL and sys.platform != 'win32':
+      # make the rename itself durable
+      dirfd = os.open(os.path.dirname(respath) or os.curdir, os.O_RDONLY)
+      try:
+         os.fsync(dirfd)
+      finally:
+         os.close(dirfd)
+
+
+def _getUploadLock(stagingpath):
+   return _uploadlocks[hash(stagingpath) % UPLOAD_LOCK_STRIPES]
+
+
+def _mergeExtents(extents, firstpos, lastpos):
+   # adds the byte range firstpos-lastpos to the sorted list of disjoint 
+   # (firstpos, lastpos) extents, joining overlapping and adjacent extents
+   mergedextents = []
+   for (efirstpos, elastpos) in extents:
+      if elastpos < firstpos - 1 or efirstpos > lastpos + 1:
+         mergedextents.append( (efirstpos, elastpos) )
+      else:
+         firstpos = min(firstpos, efirstpos)
+         lastpos = max(lastpos, elastpos)
+   mergedextents.append( (firstpos, lastpos) )
+   mergedextents.sort()
+   return mergedextents
+
+
+def _readUploadSidecar(sidecarpath):
+   # returns (totallength, extents) or None if there is no upload
+   try:
+      sidecarfile = file(sidecarpath, 'r')
+   except IOError:
+      return None
+   try:
+      lines = sidecarfile.read().split()
+   finally:
+      sidecarfile.close()
+   extents = []
+   for line in lines[1:]:
+      (firstpos, lastpos) = line.split('-')
+      extents.append( (long(firstpos), long(lastpos)) )
+   return (long(lines[0]), extents)
+
+
+def _writeUploadSidecar(sidecarpath, totallength, extents):
+   (fd, temppath) = tempfile.mkstemp(prefix=TEMPFILE_PREFIX, dir=os.path.dirname(sidecarpath))
+   try:
+      os.write(fd, str(totallength) + '\n' + ''.join(['%d-%d\n' % extent for extent in extents]))
+   finally:
+      os.close(fd)
+   if sys.platform == 'win32' and os.path.exists(sidecarpath):
+      os.unlink(sidecarpath)
+   os.rename(temppath, sidecarpath)
+
+
+class _RenameOnCloseFile(object):
+   """
+   Write stream for ``respath`` that writes into a temporary file in the same
+   directory. close() renames the temporary file over ``respath``, abort() 
+   discards it and leaves ``respath`` untouched.
+
+   Data is written to the file descriptor in blocks of WRITE_BLOCK_SIZE bytes, 
+   and the file is preallocated when ``contentlength`` is given and the 
+   platform supports it. ``syncpolicy`` is one of SYNC_POLICIES.
+   """
+   def __init__(self, respath, istext, contentlength=None, syncpolicy=SYNC_NONE):
+      self._respath = respath
+      self._syncpolicy = syncpolicy
+      (self._fd, self._temppath) = tempfile.mkstemp(prefix=TEMPFILE_PREFIX, dir=os.path.dirname(respath), text=istext)
+      self._buffer = []
+      self._buffered = 0
+      self._written = 0
+      self._preallocated = False
+      if contentlength and _posix_fallocate is not None:
+         try:
+            _posix_fallocate(self._fd, 0, contentlength)
+            self._preallocated = True
+         except (OSError, IOError):
+            pass # not supported by the filesystem
+      self.closed = False
+
+   def write(self, data):
+      self._buffer.append(data)
+      self._buffered += len(data)
+      if self._buffered >= WRITE_BLOCK_SIZE:
+         self._writeBlocks(False)
+
+   def _writeBlocks(self, final):
+      data = ''.join(self._buffer)
+      if final:
+         writelen = len(data)
+      else:
+         writelen = len(data) - len(data) % WRITE_BLOCK_SIZE
+      offset = 0
+      while offset < writelen:
+         offset += os.write(self._fd, buffer(data, offset, writelen - offset))
+      self._written += writelen
+      self._buffer = [data[writelen:]]
+      self._buffered = len(data) - writelen
+
+   def flush(self):
+      pass # data is held back until a full block is available
+
+   def close(self):
+      if self.closed:
+         return
+      self.closed = True
+      try:
+         self._writeBlocks(True)
+         if self._preallocated:
+            os.ftruncate(self._fd, self._written)
+         _syncFile(self._fd, self._syncpolicy)
+      except:
+         os.close(self._fd)
+         os.unlink(self._temppath)
+         raise
+      os.close(self._fd)
+      _replaceResource(self._temppath, self._respath, self._syncpolicy)
+
+   def abort(self):
+      if self.closed:
+         return
+      self.closed = True
+      os.close(self._fd)
+      os.unlink(self._temppath)
+
+
+class _RangeWriteFile(object):
+   """
+   Write stream for the bytes from ``rangestart`` on of the staging file of 
+   an upload. close() and abort() both record the bytes actually written in
+   the upload's sidecar, so that an interrupted range can be resumed from 
+   where it stopped.
+   """
+   def __init__(self, fd, sidecarpath, uploadlock, rangestart, totallength, syncpolicy=SYNC_NONE):
+      self._fd = fd
+      self._sidecarpath = sidecarpath
+      self._uploadlock = uploadlock
+      self._rangestart = rangestart
+      self._totallength = totallength
+      self._syncpolicy = syncpolicy
+      self._written = 0
+      # python 2 has no os.pwrite - each stream has its own descriptor, so 
+      # seeking it once is equivalent
+      os.lseek(fd, rangestart, 0)
+      self.closed = False
+
+   def write(self, data):
+      if self._rangestart + self._written + len(data) > self._totallength:
+         raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+      offset = 0
+      while offset < len(data):
+         byteswritten = os.write(self._fd, buffer(data, offset))
+         offset += byteswritten
+         self._written += byteswritten
+
+   def flush(self):
+      pass
+
+   def close(self):
+      if self.closed:
+         return
+      self.closed = True
+      try:
+         _syncFile(self._fd, self._syncpolicy)
+      finally:
+         os.close(self._fd)
+      self._recordExtent()
+
+   def abort(self):
+      if self.closed:
+         return
+      self.closed = True
+      os.close(self._fd)
+      self._recordExtent()
+
+   def _recordExtent(self):
+      if self._written == 0:
+         return
+      self._uploadlock.acquire()
+      try:
+         uploadstatus = _readUploadSidecar(self._sidecarpath)
+         if uploadstatus is None or uploadstatus[0] != self._totallength:
+            return # upload was committed, aborted or restarted meanwhile
+         extents = _mergeExtents(uploadstatus[1], self._rangestart, self._rangestart + self._written - 1)
+         _writeUploadSidecar(self._sidecarpath, self._totallength, extents)
+      finally:
+         self._uploadlock.release()
+
+
 class FilesystemAbstractionLayer(object):
+
+   def __init__(self, hardlinkcopies=False, syncpolicy=SYNC_NONE):
+      # os.link is not available on all platforms
+      self._hardlinkcopies = hardlinkcopies and hasattr(os, 'link')
+      if syncpolicy not in SYNC_POLICIES:
+         raise ValueError('syncpolicy must be one of ' + ', '.join(SYNC_POLICIES))
+      self._syncpolicy = syncpolicy
    
    def getResourceDescriptor(self, respath):
       resdesc = self.getResourceDescription(respath)
@@ -120,27 +441,93 @@ class FilesystemAbstractionLayer(object):
       else:
          return file(respath, 'rb', BUFFER_SIZE)
    
-   def openResourceForWrite(self, respath, contenttype=None):
+   def openResourceForWrite(self, respath, contenttype=None, contentlength=None):
       if contenttype is None:
          istext = False
       else:
          istext = contenttype.startswith("text")            
-      if istext:
-         return file(respath, 'w', BUFFER_SIZE)
-      else:
-         return file(respath, 'wb', BUFFER_SIZE)
+      return _RenameOnCloseFile(respath, istext, contentlength, self._syncpolicy)
+   
+   def supportWriteLength(self, respath):
+      return True
    
    def deleteResource(self, respath):
       os.unlink(respath)
    
    def copyResource(self, respath, destrespath):
+      if self._hardlinkcopies:
+         try:
+            os.link(respath, destrespath)
+            return
+         except OSError:
+            pass # cross-device, existing destination or no link support - copy the bytes
       shutil.copy2(respath, destrespath)
+
+   def _getUploadPaths(self, respath):
+      (dirpath, resname) = os.path.split(respath)
+      stagingpath = os.path.join(dirpath, UPLOAD_PREFIX + resname)
+      return (stagingpath, stagingpath + UPLOAD_SIDECAR_SUFFIX)
+
+   def supportPartialWrites(self, respath):
+      return True
+
+   def openResourceRangeForWrite(self, respath, rangestart, totallength):
+      (stagingpath, sidecarpath) = self._getUploadPaths(respath)
+      uploadlock = _getUploadLock(stagingpath)
+      uploadlock.acquire()
+      try:
+         uploadstatus = _readUploadSidecar(sidecarpath)
+         if uploadstatus is None or uploadstatus[0] != totallength:
+            # new upload, or the client restarted with a different length
+            fd = os.open(stagingpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY, 0600)
+            try:
+               if _posix_fallocate is not None:
+                  _posix_fallocate(fd, 0, totallength)
+               else:
+                  os.ftruncate(fd, totallength)
+               _writeUploadSidecar(sidecarpath, totallength, [])
+            except:
+               os.close(fd)
+               raise
+         else:
+            fd = os.open(stagingpath, os.O_WRONLY | _O_BINARY)
+      finally:
+         uploadlock.release()
+      return _RangeWriteFile(fd, sidecarpath, uploadlock, rangestart, totallength, self._syncpolicy)
+
+   def getUploadStatus(self, respath):
+      (stagingpath, sidecarpath) = self._getUploadPaths(respath)
+      return _readUploadSidecar(sidecarpath)
+
+   def commitUpload(self, respath):
+      (stagingpath, sidecarpath) = self._getUploadPaths(respath)
+      uploadlock = _getUploadLock(stagingpath)
+      uploadlock.acquire()
+      try:
+         uploadstatus = _readUploadSidecar(sidecarpath)
+         if uploadstatus is None or uploadstatus[1] != [(0, uploadstatus[0] - 1)]:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_CONFLICT)
+         _replaceResource(stagingpath, respath, self._syncpolicy)
+         os.unlink(sidecarpath)
+      finally:
+         uploadlock.release()
+
+   def abortUpload(self, respath):
+      (stagingpath, sidecarpath) = self._getUploadPaths(respath)
+      uploadlock = _getUploadLock(stagingpath)
+      uploadlock.acquire()
+      try:
+         for uploadpath in [sidecarpath, stagingpath]:
+            if os.path.exists(uploadpath):
+               os.unlink(uploadpath)
+      finally:
+         uploadlock.release()
    
    def getContainingCollection(self, respath):
       return os.path.dirname(respath)
    
    def getCollectionContents(self, respath):
-      return os.listdir(respath)
+      return [f for f in os.listdir(respath) if not f.startswith(TEMPFILE_PREFIX)]
       
    def joinPath(self, rescollectionpath, resname):
       return os.path.join(rescollectionpath, resname)
@@ -177,10 +564,22 @@ class FilesystemAbstractionLayer(object):
             raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)               
          elif propertyname == 'getetag':
             return self.getEntityTag(respath)
+      elif propertyns == UPLOAD_NAMESPACE:
+         uploadstatus = self.getUploadStatus(respath)
+         if uploadstatus is not None:
+            (totallength, extents) = uploadstatus
+            if propertyname == 'uploadlength':
+               return str(totallength)
+            elif propertyname == 'uploadreceived':
+               return str(sum([lastpos - firstpos + 1 for (firstpos, lastpos) in extents]))
+            elif propertyname == 'uploadranges':
+               return ','.join(['%d-%d' % extent for extent in extents])
       raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)               
    
    def isPropertySupported(self, respath, propertyname, propertyns):
       supportedliveprops = ['creationdate', 'getcontenttype','resourcetype','getlastmodified', 'getcontentlength', 'getetag']
+      if propertyns == UPLOAD_NAMESPACE:
+         return propertyname in ['uploadlength', 'uploadreceived', 'uploadranges']
       if propertyns != "DAV:" or propertyname not in supportedliveprops:
          return False      
       return True
@@ -195,6 +594,11 @@ class FilesystemAbstractionLayer(object):
       if os.path.isfile(respath):
          appProps.append( ('DAV:','getcontentlength') )
          appProps.append( ('DAV:','getetag') )
+         if self.getUploadStatus(respath) is not None:
+            # a partial upload is replacing this resource
+            appProps.append( (UPLOAD_NAMESPACE,'uploadlength') )
+            appProps.append( (UPLOAD_NAMESPACE,'uploadreceived') )
+            appProps.append( (UPLOAD_NAMESPACE,'uploadranges') )
       return appProps
    
    def resolvePath(self, resheadpath, urlelementlist):
@@ -298,14 +702,32 @@ class ReadOnlyFilesystemAbstractionLayer(object):
       else:
          return file(respath, 'rb', BUFFER_SIZE)
    
-   def openResourceForWrite(self, respath, contenttype=None):
+   def openResourceForWrite(self, respath, contenttype=None, contentlength=None):
       raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
    
+   def supportWriteLength(self, respath):
+      return True
+   
    def deleteResource(self, respath):
       raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
    
    def copyResource(self, respath, destrespath):
       raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
+
+   def supportPartialWrites(self, respath):
+      return False
+
+   def openResourceRangeForWrite(self, respath, rangestart, totallength):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
+
+   def getUploadStatus(self, respath):
+      return None
+
+   def commitUpload(self, respath):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
+
+   def abortUpload(self, respath):
+      raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)               
    
    def getContainingCollection(self, respath):
       return os.path.dirname(respath)
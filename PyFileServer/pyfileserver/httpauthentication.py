@@ -32,6 +32,9 @@ Usage::
      request will be sent a basic authentication required response 
      (default = True)
 
+   and optionally:
+     noncesecret, noncetimeout, trackncount (see Digest nonces below)
+
 The HTTPAuthenticator will put the following authenticated information in the 
 environ dictionary::
    
@@ -39,6 +42,31 @@ environ dictionary::
    environ['httpauthentication.username'] = username
    
 
+Digest nonces
+-------------
+
+The nonces sent with digest challenges are timestamps signed with an HMAC 
+using ``noncesecret``, so any nonce issued by the server (or by another 
+server process sharing the secret) is validated without keeping server state.
+If ``noncesecret`` is not given, a random secret is chosen on startup, which
+makes the nonces of one process unusable in other processes, and after a 
+restart.
+
+A nonce is accepted for ``noncetimeout`` seconds (default 300). A request 
+with the correct credentials but an expired nonce is answered with a challenge
+marked ``stale=true``, so that clients retry with the new nonce without asking
+the user again.
+
+If ``trackncount`` is True, the highest nonce count (``nc``) used with each 
+nonce is remembered (for the most recently used nonces), and a request 
+repeating a nonce count is rejected as a replay.
+
+The MD5 of "username:realm:password" (HA1) is kept for HA1_CACHE_TIMEOUT 
+seconds per realm and user, so that the password is not looked up for every 
+request. Domain controllers may also provide the HA1 value themselves with 
+``getRealmUserHA1(realmname, username, environ)``, instead of the password.
+
+
 Domain Controllers
 ------------------
 
@@ -90,12 +118,45 @@ Classes
 """
 __docformat__ = 'reStructuredText'
 
-import random
+import os
 import base64
 import md5
+import hmac
 import time
 import re
 
+try:
+    import hashlib
+    _sha1 = hashlib.sha1
+except ImportError:
+    import sha
+    _sha1 = sha
+
+try:
+    _compare_digest = hmac.compare_digest
+except AttributeError:
+    # python before 2.7.7
+    def _compare_digest(a, b):
+        # compares in a time not depending on where a and b differ
+        if len(a) != len(b):
+            return False
+        result = 0
+        for (x, y) in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
+from lrucache import LRUCache
+
+NONCE_TIMEOUT = 300
+NONCE_CACHE_SIZE = 10000
+HA1_CACHE_SIZE = 1000
+HA1_CACHE_TIMEOUT = 300
+
+# results of validateNonce()
+NONCE_VALID = 0
+NONCE_STALE = 1
+NONCE_INVALID = 2
+
 class SimpleDomainController(object):
     def __init__(self, dictusers = None, realmname = 'SimpleDomain'):
         if dictusers is None:
@@ -119,19 +180,30 @@ class SimpleDomainController(object):
         else:
             return None
             
-    def authRealmUser(self, realmname, username, password, environ):
+    def authDomainUser(self, realmname, username, password, environ):
         if username in self._users:
             return self._users[username] == password
         else:
             return False        
+
+    # former name of authDomainUser
+    authRealmUser = authDomainUser
               
        
 class HTTPAuthenticator(object):
 
-    def __init__(self, application, domaincontroller, acceptbasic=True, acceptdigest=True, defaultdigest=True):
+    def __init__(self, application, domaincontroller, acceptbasic=True, acceptdigest=True, defaultdigest=True, noncesecret=None, noncetimeout=NONCE_TIMEOUT, trackncount=False):
         self._domaincontroller = domaincontroller
         self._application = application
-        self._noncedict = dict([])
+
+        if noncesecret is None:
+            noncesecret = os.urandom(32)
+        self._noncesecret = noncesecret
+        self._noncetimeout = noncetimeout
+        self._nccache = None
+        if trackncount:
+            self._nccache = LRUCache(NONCE_CACHE_SIZE, noncetimeout)
+        self._ha1cache = LRUCache(HA1_CACHE_SIZE, HA1_CACHE_TIMEOUT)
 
         self._headerparser = re.compile(r"([\w]+)=([^,]*),")
         self._headermethod = re.compile(r"^([\w]+)")
@@ -185,24 +257,78 @@ class HTTPAuthenticator(object):
         authvalue = authvalue.strip().decode('base64')
         username, password = authvalue.split(':',1)
         
-        if self._domaincontroller.authRealmUser(realmname, username, password, environ):
+        if self._domaincontroller.authDomainUser(realmname, username, password, environ):
             environ['httpauthentication.realm'] = realmname
             environ['httpauthentication.username'] = username
             return self._application(environ, start_response)
         else:
             return self.sendBasicAuthResponse(environ, start_response)
         
-    def sendDigestAuthResponse(self, environ, start_response):    
+    def sendDigestAuthResponse(self, environ, start_response, stale=False):    
         realmname = self._domaincontroller.getDomainRealm(environ['PATH_INFO'] , environ)
-        random.seed()
-        serverkey = hex(random.getrandbits(32))[2:]
-        etagkey = md5.new(environ['PATH_INFO']).hexdigest()
-        timekey = str(time.time())  
-        nonce = base64.b64encode(timekey + md5.new(timekey + ":" + etagkey + ":" + serverkey).hexdigest())
-        wwwauthheaders = "Digest realm=\"" + realmname + "\", nonce=\"" + nonce + \
+        wwwauthheaders = "Digest realm=\"" + realmname + "\", nonce=\"" + self.generateNonce() + \
             "\", algorithm=\"MD5\", qop=\"auth\""                 
+        if stale:
+            wwwauthheaders = wwwauthheaders + ", stale=true"
         start_response("401 Not Authorized", [('WWW-Authenticate', wwwauthheaders)])
         return [self.getErrorMessage()]
+
+    def generateNonce(self):
+        timekey = str(int(time.time()))
+        return base64.b64encode(timekey + ":" + hmac.new(self._noncesecret, timekey, _sha1).hexdigest())
+
+    def validateNonce(self, nonce):
+        try:
+            timekey, signature = base64.b64decode(nonce).split(":", 1)
+            issued = int(timekey)
+        except (TypeError, ValueError):
+            return NONCE_INVALID
+        if not _compare_digest(signature, hmac.new(self._noncesecret, timekey, _sha1).hexdigest()):
+            return NONCE_INVALID
+        if issued + self._noncetimeout < time.time():
+            return NONCE_STALE
+        return NONCE_VALID
+
+    def checkNonceCount(self, nonce, nc):
+        # False if nc was already used with nonce
+        if self._nccache is None or nc is None:
+            return True
+        try:
+            nccount = int(nc, 16)
+        except ValueError:
+            return False
+        # not atomic across threads: two requests with the same nc arriving
+        # together may both pass
+        if nccount <= self._nccache.get(nonce, 0):
+            return False
+        self._nccache.set(nonce, nccount)
+        return True
+
+    def getCacheStats(self):
+        return {'hits': self._ha1cache.hits, 'misses': self._ha1cache.misses, 'size': len(self._ha1cache)}
+
+    def clearCaches(self):
+        """
+        Forgets the cached user credentials, e.g. after the users were 
+        reconfigured. Also clears the caches of the domain controller if it
+        has a clearCaches() method.
+        """
+        self._ha1cache.clear()
+        if hasattr(self._domaincontroller, 'clearCaches'):
+            self._domaincontroller.clearCaches()
+
+    def getRealmUserHA1(self, realmname, username, environ):
+        ha1 = self._ha1cache.get((realmname, username))
+        if ha1 is None:
+            if hasattr(self._domaincontroller, 'getRealmUserHA1'):
+                ha1 = self._domaincontroller.getRealmUserHA1(realmname, username, environ)
+            else:
+                password = self._domaincontroller.getRealmUserPassword(realmname, username, environ)
+                if password is not None:
+                    ha1 = self.md5h(username + ":" + realmname + ":" + password)
+            if ha1 is not None:
+                self._ha1cache.set((realmname, username), ha1)
+        return ha1
         
     def authDigestAuthRequest(self, environ, start_response):  
 
@@ -240,8 +366,14 @@ class HTTPAuthenticator(object):
         if 'uri' in authheaderdict:
             req_uri = authheaderdict['uri']
 
+        isstalenonce = False
         if 'nonce' in authheaderdict:
             req_nonce = authheaderdict['nonce']
+            noncestatus = self.validateNonce(req_nonce)
+            if noncestatus == NONCE_INVALID:
+                isinvalidreq = True
+            elif noncestatus == NONCE_STALE:
+                isstalenonce = True
         else:
             isinvalidreq = True
 
@@ -261,7 +393,7 @@ class HTTPAuthenticator(object):
             if req_hasqop:
                 isinvalidreq = True
          
-        if 'nc' in authheaderdict:    # is read but nonce-count checking not implemented
+        if 'nc' in authheaderdict:
             req_nc = authheaderdict['nc']
         else:
             req_nc = None
@@ -274,27 +406,37 @@ class HTTPAuthenticator(object):
             isinvalidreq = True
              
         if not isinvalidreq:
-            req_password = self._domaincontroller.getRealmUserPassword(realmname, req_username, environ)
+            req_ha1 = self.getRealmUserHA1(realmname, req_username, environ)
             req_method = environ['REQUEST_METHOD']
-             
-            required_digest = self.computeDigestResponse(req_username, realmname, req_password, req_method, req_uri, req_nonce, req_cnonce, req_qop, req_nc)
-            if required_digest != req_response:
+            if req_ha1 is None:
+                isinvalidreq = True
+            elif not _compare_digest(self.computeDigestResponseFromHA1(req_ha1, req_method, req_uri, req_nonce, req_cnonce, req_qop, req_nc), req_response):
                 isinvalidreq = True
 
-        if not isinvalidreq:
+        if not isinvalidreq and not isstalenonce:
+            if not self.checkNonceCount(req_nonce, req_nc):
+                # a replayed request, or a client reusing a count: the client
+                # may retry with a new nonce
+                isstalenonce = True
+
+        if not isinvalidreq and not isstalenonce:
             environ['httpauthentication.realm'] = realmname
             environ['httpauthentication.username'] = req_username
             return self._application(environ, start_response)                
      
-        return self.sendDigestAuthResponse(environ, start_response)
+        # the credentials were right, only the nonce has to be renewed
+        return self.sendDigestAuthResponse(environ, start_response, stale = not isinvalidreq)
 
     def computeDigestResponse(self, username, realm, password, method, uri, nonce, cnonce, qop, nc):
         A1 = username + ":" + realm + ":" + password
+        return self.computeDigestResponseFromHA1(self.md5h(A1), method, uri, nonce, cnonce, qop, nc)
+
+    def computeDigestResponseFromHA1(self, ha1, method, uri, nonce, cnonce, qop, nc):
         A2 = method + ":" + uri
         if qop:
-            digestresp = self.md5kd( self.md5h(A1), nonce + ":" + nc + ":" + cnonce + ":" + qop + ":" + self.md5h(A2))
+            digestresp = self.md5kd( ha1, nonce + ":" + nc + ":" + cnonce + ":" + qop + ":" + self.md5h(A2))
         else:
-            digestresp = self.md5kd( self.md5h(A1), nonce + ":" + self.md5h(A2))
+            digestresp = self.md5kd( ha1, nonce + ":" + self.md5h(A2))
         return digestresp
                 
     def md5h(self, data):
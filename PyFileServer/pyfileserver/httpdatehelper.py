@@ -22,7 +22,12 @@ The following time type strings are supported by getsecstime() and getgmtime()::
 
    Sun, 06 Nov 1994 08:49:37 GMT  ; RFC 822, updated by RFC 1123
    Sunday, 06-Nov-94 08:49:37 GMT ; RFC 850, obsoleted by RFC 1036
-   Sun Nov  6 08:49:37 1994       ; ANSI C's asctime() format  
+   Sun Nov  6 08:49:37 1994       ; ANSI C's asctime() format
+
+getstrftime() formats the current time once per second, and keeps the
+formatted dates of recently used times (e.g. the modification times of
+resources listed by PROPFIND) in a small cache. Dates are formatted with the
+English day and month names required by HTTP, whatever the locale.
 
 """
 __docformat__ = 'reStructuredText'
@@ -30,44 +35,119 @@ __docformat__ = 'reStructuredText'
 import calendar
 import time
 
+_WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+_WEEKDAYS_LONG = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+_MONTHNUMBERS = dict([(name, number + 1) for (number, name) in enumerate(_MONTHS)])
+_WEEKDAYNAMES = [name.lower() for name in _WEEKDAYS]
+_WEEKDAYNAMES_LONG = [name.lower() for name in _WEEKDAYS_LONG]
+
+FORMAT_CACHE_SIZE = 1024
+
+# (second, formatted date) of the current time
+_currentdate = (None, None)
+# formatted dates of recently used times. A plain dictionary, emptied when
+# full: single dictionary operations need no lock, which keeps a lookup 
+# cheaper than formatting the date again
+_formatcache = {}
+
+
+def _formatdate(secs):
+   (year, month, day, hour, minute, second, weekday) = time.gmtime(secs)[0:7]
+   return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (_WEEKDAYS[weekday], day, _MONTHS[month - 1], year, hour, minute, second)
 
-def getstrftime(secs=None):   
+
+def getstrftime(secs=None):
    # rfc 1123 date/time format
-   return time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(secs))
+   global _currentdate
+   if secs is None:
+      now = int(time.time())
+      (cachedsecond, cacheddate) = _currentdate
+      if cachedsecond != now:
+         cacheddate = _formatdate(now)
+         _currentdate = (now, cacheddate)
+      return cacheddate
+   secs = int(secs)
+   formatted = _formatcache.get(secs, None)
+   if formatted is None:
+      formatted = _formatdate(secs)
+      if len(_formatcache) >= FORMAT_CACHE_SIZE:
+         _formatcache.clear()
+      _formatcache[secs] = formatted
+   return formatted
 
 
 def getsecstime(timeformat):
-   result = getgmtime(timeformat)
-   if result:
-      return calendar.timegm(result)
-   else:
+   result = _parsedate(timeformat)
+   if result is None:
       return None
+   return calendar.timegm(result)
 
 def getgmtime(timeformat):
+   result = getsecstime(timeformat)
+   if result is None:
+      return None
+   return time.gmtime(result)
 
-   # Sun, 06 Nov 1994 08:49:37 GMT  ; RFC 822, updated by RFC 1123
-   try:
-      vtime = time.strptime(timeformat, "%a, %d %b %Y %H:%M:%S GMT")   
-      return vtime
-   except:
-      pass
-
-   # Sunday, 06-Nov-94 08:49:37 GMT ; RFC 850, obsoleted by RFC 1036
-   try:
-      vtime = time.strptime(timeformat, "%A %d-%b-%y %H:%M:%S GMT")
-      return vtime
-   except:
-      pass   
-
-   # Sun Nov  6 08:49:37 1994       ; ANSI C's asctime() format  
-   try:
-      vtime = time.strptime(timeformat, "%a %b %d %H:%M:%S %Y")
-      return vtime
-   
-   except:
-      pass
-      
-   return None
 
+def _parsetime(token):
+   # h:m:s with one or two digits each, as time.strptime %H:%M:%S
+   fields = token.split(':')
+   if len(fields) != 3:
+      return None
+   for field in fields:
+      if len(field) not in (1, 2) or not field.isdigit():
+         return None
+   (hour, minute, second) = (int(fields[0]), int(fields[1]), int(fields[2]))
+   if hour > 23 or minute > 59 or second > 61:
+      return None
+   return (hour, minute, second)
 
+def _parsedate(timeformat):
+   # returns (year, month, day, hour, minute, second, 0, 0, 0) or None.
+   # Names are matched regardless of case, as time.strptime did.
+   if timeformat != timeformat.strip():
+      return None
+   tokens = timeformat.split()
+   if not tokens:
+      return None
+   first = tokens[0].lower()
+
+   if len(tokens) == 6 and first[-1:] == ',' and first[:-1] in _WEEKDAYNAMES and tokens[5].upper() == 'GMT':
+      # Sun, 06 Nov 1994 08:49:37 GMT  ; RFC 822, updated by RFC 1123
+      (daytoken, monthtoken, yeartoken, timetoken) = tokens[1:5]
+      if len(yeartoken) != 4:
+         return None
+   elif len(tokens) == 4 and first.rstrip(',') in _WEEKDAYNAMES_LONG and first.count(',') <= 1 and tokens[3].upper() == 'GMT':
+      # Sunday, 06-Nov-94 08:49:37 GMT ; RFC 850, obsoleted by RFC 1036
+      # (also without the comma, as parsed by earlier versions)
+      datefields = tokens[1].split('-')
+      if len(datefields) != 3 or len(datefields[2]) != 2:
+         return None
+      (daytoken, monthtoken, yeartoken) = datefields
+      timetoken = tokens[2]
+   elif len(tokens) == 5 and first in _WEEKDAYNAMES:
+      # Sun Nov  6 08:49:37 1994       ; ANSI C's asctime() format
+      (monthtoken, daytoken, timetoken, yeartoken) = tokens[1:5]
+      if len(yeartoken) != 4:
+         return None
+   else:
+      return None
 
+   if not daytoken.isdigit() or len(daytoken) > 2 or not yeartoken.isdigit():
+      return None
+   month = _MONTHNUMBERS.get(monthtoken.capitalize(), None)
+   day = int(daytoken)
+   year = int(yeartoken)
+   clock = _parsetime(timetoken)
+   if month is None or clock is None:
+      return None
+   if len(yeartoken) == 2:
+      # as time.strptime %y
+      if year < 69:
+         year += 2000
+      else:
+         year += 1900
+   if year < 1 or day < 1 or day > calendar.monthrange(year, month)[1]:
+      return None
+   return (year, month, day) + clock + (0, 0, 0)
@@ -182,16 +182,88 @@ class AbstractionLayerInterface(object):
       The application will close() the stream.      
       """
    
-   def openResourceForWrite(self, respath, contenttype=None):
+   def openResourceForWrite(self, respath, contenttype=None, contentlength=None):
       """
       respath - path identifier for the resource
 
       contenttype - Content-Type header data given if available.
+
+      contentlength - number of bytes that will be written, if known (from 
+      the Content-Length header). May be used to preallocate storage. Only 
+      passed if supportWriteLength() returns True.
       
       returns a file-like object / stream that the resource data will 
       be ``write()``-en to. 
+
+      The application will close() the stream once all the data has been
+      written. If the stream has an ``abort()`` method, the application will 
+      call it instead of close() when the upload fails (for example, when the
+      client disconnects before sending Content-Length bytes); the resource 
+      should then be left as it was before the request.
+      """
+   
+   def supportWriteLength(self, respath):
+      """
+      respath - path identifier for the resource
+
+      returns True if openResourceForWrite() takes the contentlength 
+      argument. Layers without this method are called without it.
       """
    
+   def supportPartialWrites(self, respath):
+      """
+      respath - path identifier for the resource
+      
+      returns True if the resource may be uploaded in parts (PUT with a 
+      Content-Range header) using openResourceRangeForWrite(), 
+      getUploadStatus(), commitUpload() and abortUpload(). If False, the 
+      application responds 501 Not Implemented to such requests and the other
+      four methods are not called. Layers without this method are treated as
+      returning False.
+      """
+
+   def openResourceRangeForWrite(self, respath, rangestart, totallength):
+      """
+      respath - path identifier for the resource
+
+      rangestart - offset of the first byte that will be written
+
+      totallength - total length of the resource being uploaded
+      
+      returns a file-like object / stream that the bytes from rangestart on
+      will be ``write()``-en to. The data is staged and must not be visible
+      in the resource until commitUpload() is called. If totallength differs
+      from that of the upload in progress, the upload is restarted.
+
+      The application will close() the stream, or abort() it if the client 
+      sent less data than announced. In both cases the bytes written so far
+      must be recorded as received.
+      """
+
+   def getUploadStatus(self, respath):
+      """
+      respath - path identifier for the resource
+      
+      returns None if no partial upload is in progress for the resource, or
+      a tuple (totallength, extents) where extents is the sorted list of 
+      (firstbyte, lastbyte) ranges received so far.
+      """
+
+   def commitUpload(self, respath):
+      """
+      respath - path identifier for the resource
+      
+      replaces the resource with the uploaded data once all totallength 
+      bytes have been received, and ends the upload.
+      """
+
+   def abortUpload(self, respath):
+      """
+      respath - path identifier for the resource
+      
+      discards the partial upload in progress for the resource, if any.
+      """
+
    def deleteResource(self, respath):
       """
       respath - path identifier for the resource
@@ -240,6 +312,16 @@ class AbstractionLayerInterface(object):
       containing the resource, and b is the name of the resource.      
       """
 
+   def getConfiguration(self):
+      """
+      returns a value (e.g. a tuple of the constructor arguments) equal for 
+      layers of the class configured alike. Optional: when the configuration 
+      is reloaded, the layer of the previous configuration is kept if it is of
+      the same class and configured alike, which layers without this method 
+      are if all their attributes are equal. Layers keeping caches or 
+      connections in attributes should have it.
+      """
+
 
    """
    Properties and PyFileServer
@@ -6,7 +6,7 @@ class DomainControllerInterface(object):
       pyfileserver.pyfiledomaincontroller.PyFileServerDomainController
       pyfileserver.addons.windowsdomaincontroller.SimpleWindowsDomainController
       
-   All methods must be implemented.
+   All methods must be implemented, except those marked optional.
    
    The environ variable here is the WSGI 'environ' dictionary. It is passed to 
    all methods of the domain controller as a means for developers to pass information
@@ -54,6 +54,14 @@ class DomainControllerInterface(object):
       Used for digest authentication.
       """
 
+   def getRealmUserHA1(self, realmname, username, environ):
+      """
+      optional. Returns the MD5 hex digest of "username:realm:password" for
+      the given username for the realm, or None. If provided, it is used for
+      digest authentication instead of getRealmUserPassword, so that the
+      domain controller need not store passwords in the clear.
+      """
+
    def authDomainUser(self, realmname, username, password, environ):
       """
       returns True if this username/password pair is valid for the realm, 
@@ -95,4 +95,9 @@ class PropertyManagerInterface(object):
       """
       copy all properties from url specified by origurl to url specified by desturl
       """
-      
\ No newline at end of file
+
+   def getResourceCount(self):
+      """
+      optional - returns the number of urls with properties, reported by the 
+      metrics of the admin pages (see adminserver.py).
+      """
@@ -0,0 +1,283 @@
+"""
+jobmanager
+==========
+
+:Module: pyfileserver.jobmanager
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+Background job executor for long-running COPY, MOVE and DELETE requests.
+
+A COPY, MOVE or DELETE over a large collection may take minutes to complete,
+holding the server thread and the client connection for the duration. When
+a client asks for it (with a ``Prefer: respond-async`` request header) or when
+the number of entries to be processed exceeds the threshold configured for
+the realm, the RequestServer hands the operation to the JobManager and
+responds immediately with ``202 Accepted`` and a ``Location`` header giving
+the job status URL::
+
+   http://<servername:port>/<approot>/_jobs/<jobid>
+
+The job status URL is served by the JobStatusServer middleware:
+
+GET / HEAD
+   Returns an XML document with the state of the job (queued, running, done,
+   cancelled or failed), the number of entries done out of the total, the final
+   response code once the job is finished and a multistatus of the per-entry
+   errors encountered so far (the same data that is returned in a 207
+   Multi Status response for synchronous requests)
+
+DELETE
+   Requests cancellation of the job. A queued job is never started. A running
+   job stops before processing the next entry - entries already processed are
+   not rolled back, and a MOVE cancelled during its copy phase leaves the
+   source untouched.
+
+Job ids are long random strings, and the status URL is not subject to
+authentication - the id acts as the access token for the job. Finished jobs
+are kept around for ``retaintime`` seconds (up to ``maxfinished`` of them) so
+that clients can collect the final result.
+
+Usage::
+
+   from pyfileserver.jobmanager import JobManager, JobStatusServer
+   jobmanager = JobManager(numworkers, jobpath, threshold)
+   application = RequestServer(propertymanager, lockmanager, jobmanager)
+   ...
+   application = JobStatusServer(application, jobmanager)
+
+where:
+   numworkers is the number of worker threads, ie. the number of jobs that may
+   run concurrently (default = 2)
+
+   jobpath is the path, relative to the application root, of the job status
+   URLs (default = '/_jobs'). No realm may be shared under this name.
+
+   threshold is either a number of entries or a dictionary mapping realm names
+   to numbers of entries. COPY/MOVE/DELETE requests on more entries than the
+   threshold are run as jobs even without a Prefer header. 0 disables the
+   threshold (default = 0)
+
+   maxqueued is the maximum number of jobs waiting for a worker. Requests
+   beyond this are rejected with 503 Service Unavailable (default = 100)
+
+Interface
+---------
+
+Classes:
+
++ 'Job': State of a single background job
+
++ 'JobManager': Queue and worker threads running the jobs
+
++ 'JobStatusServer': WSGI Middleware serving the job status URLs
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import os
+import time
+import threading
+import Queue
+import binascii
+
+from processrequesterrorhandler import HTTPRequestException
+import processrequesterrorhandler
+
+import websupportfuncs
+import httpdatehelper
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+
+JOBS_NAMESPACE = 'http://pyfilesync.berlios.de/ns/jobs'
+
+
+class Job(object):
+    def __init__(self, jobid, method, displaypath, username, entriestotal, performfunc):
+        self.jobid = jobid
+        self.method = method
+        self.displaypath = displaypath
+        self.username = username
+        self.entriestotal = entriestotal
+        self.entriesdone = 0
+        self.dictError = {}
+        self.state = JOB_QUEUED
+        self.status = None
+        self.cancelrequested = False
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._performfunc = performfunc
+
+    def isFinished(self):
+        return self.state in (JOB_DONE, JOB_CANCELLED, JOB_FAILED)
+
+
+class JobManager(object):
+    def __init__(self, numworkers=2, jobpath='/_jobs', threshold=0, maxqueued=100, maxfinished=1000, retaintime=3600):
+        self._numworkers = max(1, int(numworkers))
+        self._jobpath = '/' + jobpath.strip('/')
+        self._threshold = threshold
+        self._maxfinished = maxfinished
+        self._retaintime = retaintime
+        self._queue = Queue.Queue(maxqueued)
+        self._jobs = {}
+        self._finished = []
+        self._lock = threading.RLock()
+        self._workers = []
+
+    def getJobPath(self):
+        return self._jobpath
+
+    def getThreshold(self, realm):
+        if isinstance(self._threshold, dict):
+            # realms may be given as 'vroot' or '/vroot'
+            realm = realm.strip('/')
+            return self._threshold.get(realm, self._threshold.get('/' + realm, 0))
+        return self._threshold
+
+    def submitJob(self, method, displaypath, username, entriestotal, performfunc):
+        self._lock.acquire()
+        try:
+            self._startWorkers()
+            job = Job(binascii.hexlify(os.urandom(16)), method, displaypath, username, entriestotal, performfunc)
+            try:
+                self._queue.put_nowait(job)
+            except Queue.Full:
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_SERVICE_UNAVAILABLE)
+            self._jobs[job.jobid] = job
+            return job
+        finally:
+            self._lock.release()
+
+    def getJob(self, jobid):
+        self._lock.acquire()
+        try:
+            self._expireFinished()
+            return self._jobs.get(jobid, None)
+        finally:
+            self._lock.release()
+
+    def cancelJob(self, jobid):
+        job = self.getJob(jobid)
+        if job is None:
+            return None
+        job.cancelrequested = True
+        return job
+
+    def getJobs(self):
+        self._lock.acquire()
+        try:
+            return self._jobs.values()
+        finally:
+            self._lock.release()
+
+    def _startWorkers(self):
+        # workers are started lazily on the first job, so that a server that
+        # never sees a job never starts any thread
+        while len(self._workers) < self._numworkers:
+            worker = threading.Thread(target=self._workerLoop, name='pyfileserver-job-%d' % len(self._workers))
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _workerLoop(self):
+        while True:
+            job = self._queue.get()
+            self._runJob(job)
+
+    def _runJob(self, job):
+        if job.cancelrequested:
+            job.state = JOB_CANCELLED
+        else:
+            job.state = JOB_RUNNING
+            job.started = time.time()
+            try:
+                job.status = job._performfunc(job)
+                if job.cancelrequested:
+                    job.state = JOB_CANCELLED
+                else:
+                    job.state = JOB_DONE
+            except HTTPRequestException, e:
+                job.status = processrequesterrorhandler.interpretErrorException(e)
+                job.state = JOB_FAILED
+            except Exception:
+                job.status = '500 Internal Server Error'
+                job.state = JOB_FAILED
+        job._performfunc = None
+        job.finished = time.time()
+        self._lock.acquire()
+        try:
+            self._finished.append(job)
+            self._expireFinished()
+        finally:
+            self._lock.release()
+
+    def _expireFinished(self):
+        expiretime = time.time() - self._retaintime
+        while self._finished and (len(self._finished) > self._maxfinished or self._finished[0].finished < expiretime):
+            job = self._finished.pop(0)
+            self._jobs.pop(job.jobid, None)
+
+    def getJobURL(self, job, environ):
+        return websupportfuncs.constructFullURL(environ.get('SCRIPT_NAME', '') + self._jobpath + '/' + job.jobid, environ)
+
+    def getJobStatusXML(self, job, environ):
+        xmlstr = "<?xml version='1.0' ?>\n<P:job xmlns:P='" + JOBS_NAMESPACE + "' xmlns:D='DAV:'>\n"
+        xmlstr = xmlstr + "<P:id>" + job.jobid + "</P:id>\n"
+        xmlstr = xmlstr + "<P:method>" + job.method + "</P:method>\n"
+        xmlstr = xmlstr + "<D:href>" + websupportfuncs.constructFullURL(job.displaypath, environ) + "</D:href>\n"
+        xmlstr = xmlstr + "<P:state>" + job.state + "</P:state>\n"
+        xmlstr = xmlstr + "<P:entriesdone>" + str(job.entriesdone) + "</P:entriesdone>\n"
+        xmlstr = xmlstr + "<P:entriestotal>" + str(job.entriestotal) + "</P:entriestotal>\n"
+        xmlstr = xmlstr + "<P:created>" + httpdatehelper.getstrftime(job.created) + "</P:created>\n"
+        if job.finished is not None:
+            xmlstr = xmlstr + "<P:finished>" + httpdatehelper.getstrftime(job.finished) + "</P:finished>\n"
+        if job.status is not None:
+            xmlstr = xmlstr + "<D:status>HTTP/1.1 " + job.status + "</D:status>\n"
+        dictError = job.dictError.copy()
+        if len(dictError) > 0:
+            xmlstr = xmlstr + "<D:multistatus>\n"
+            for filedisplaypath in dictError.keys():
+                xmlstr = xmlstr + "<D:response>\n<D:href>" + websupportfuncs.constructFullURL(filedisplaypath, environ) + "</D:href>\n"
+                xmlstr = xmlstr + "<D:status>HTTP/1.1 " + dictError[filedisplaypath] + "</D:status>\n</D:response>\n"
+            xmlstr = xmlstr + "</D:multistatus>\n"
+        xmlstr = xmlstr + "</P:job>"
+        return xmlstr
+
+
+class JobStatusServer(object):
+    def __init__(self, application, jobmanager):
+        self._application = application
+        self._jobmanager = jobmanager
+
+    def __call__(self, environ, start_response):
+        jobpath = self._jobmanager.getJobPath()
+        pathinfo = environ.get('PATH_INFO', '')
+        if pathinfo != jobpath and not pathinfo.startswith(jobpath + '/'):
+            return self._application(environ, start_response)
+
+        jobid = pathinfo[len(jobpath):].strip('/')
+        job = self._jobmanager.getJob(jobid)
+        if job is None:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+
+        requestmethod = environ['REQUEST_METHOD']
+        if requestmethod == 'DELETE':
+            self._jobmanager.cancelJob(jobid)
+        elif requestmethod != 'GET' and requestmethod != 'HEAD':
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_METHOD_NOT_ALLOWED)
+
+        statusxml = self._jobmanager.getJobStatusXML(job, environ)
+        start_response('200 OK', [('Content-Type','text/xml'), ('Content-Length', str(len(statusxml))), ('Cache-Control', 'no-cache'), ('Date',httpdatehelper.getstrftime())])
+        if requestmethod == 'HEAD':
+            return ['']
+        return [statusxml]
@@ -23,6 +23,7 @@ lockmanagerinterface_
 Classes::
    
    class LockManager(object)
+   class MultiProcessLockManager(LockManager)
 
 Misc methods::
 
@@ -77,6 +78,7 @@ import httpdatehelper
 import websupportfuncs
 from processrequesterrorhandler import HTTPRequestException
 import processrequesterrorhandler
+from multiprocessstore import InterProcessLock, storeOperation
 
 """
 A low performance lock library using shelve
@@ -95,9 +97,9 @@ class LockManager(object):
         self._init_lock.acquire(True)
         try:
             if self._loaded:       # test again within the critical section
-                self._lock.release()
                 return True
             self._dict = shelve.open(self._persiststorepath)
+            self._loaded = True
         finally:
             self._init_lock.release()         
 
@@ -326,6 +328,46 @@ class LockManager(object):
             self._dict.sync()
             self._write_lock.release()
 
+    def getLockCount(self):
+        self._write_lock.acquire(True)
+        try:
+            if not self._loaded:
+                self._performInitialization()
+            count = 0
+            for key in self._dict.keys():
+                if key.startswith('LOCKTIME:'):
+                    count += 1
+            return count
+        finally:
+            self._write_lock.release()
+
+
+class MultiProcessLockManager(LockManager):
+    """
+    LockManager whose shelve may be shared by several server processes, see
+    multiprocessstore.py
+    """
+    def __init__(self, persiststore):
+        LockManager.__init__(self, persiststore)
+        self._processlock = InterProcessLock(persiststore + '.lock')
+
+    def __del__(self):
+        pass
+
+    generateLock = storeOperation(LockManager.generateLock)
+    deleteLock = storeOperation(LockManager.deleteLock)
+    isTokenLockedByUser = storeOperation(LockManager.isTokenLockedByUser)
+    isUrlLocked = storeOperation(LockManager.isUrlLocked)
+    getUrlLockScope = storeOperation(LockManager.getUrlLockScope)
+    getLockProperty = storeOperation(LockManager.getLockProperty)
+    isUrlLockedByToken = storeOperation(LockManager.isUrlLockedByToken)
+    getTokenListForUrl = storeOperation(LockManager.getTokenListForUrl)
+    getTokenListForUrlByUser = storeOperation(LockManager.getTokenListForUrlByUser)
+    addUrlToLock = storeOperation(LockManager.addUrlToLock)
+    removeAllLocksFromUrl = storeOperation(LockManager.removeAllLocksFromUrl)
+    refreshLock = storeOperation(LockManager.refreshLock)
+    getLockCount = storeOperation(LockManager.getLockCount)
+
 
 def checkLocksToAdd(lm, displaypath):
     parentdisplaypath = websupportfuncs.getLevelUpURL(displaypath)
@@ -0,0 +1,125 @@
+"""
+lrucache
+========
+
+:Module: pyfileserver.lrucache
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+A bounded, thread-safe cache dropping the least recently used entries.
+
+Usage::
+
+   from pyfileserver.lrucache import LRUCache
+   cache = LRUCache(1000)          # at most 1000 entries
+   cache = LRUCache(1000, 300)     # entries also expire after 300 seconds
+   cache.set(key, value)
+   value = cache.get(key)          # None if missing or expired
+   cache.remove(key)
+
+Interface
+---------
+
+Classes:
+
++ 'LRUCache': Least recently used cache, optionally with expiry
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import time
+import threading
+
+# fields of the list entries
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = 0, 1, 2, 3, 4
+
+
+class LRUCache(object):
+    def __init__(self, maxsize, ttl=None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = {}
+        # circular doubly linked list of entries, most recently used first
+        self._root = [None, None, None, None, None]
+        self._root[_PREV] = self._root
+        self._root[_NEXT] = self._root
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[_EXPIRES] is not None and entry[_EXPIRES] < time.time():
+                self._unlink(entry)
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._unlink(entry)
+            self._linkFirst(entry)
+            self.hits += 1
+            return entry[_VALUE]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        expires = None
+        if self._ttl is not None:
+            expires = time.time() + self._ttl
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._unlink(entry)
+                entry[_VALUE] = value
+                entry[_EXPIRES] = expires
+            else:
+                if len(self._entries) >= self._maxsize:
+                    oldest = self._root[_PREV]
+                    self._unlink(oldest)
+                    del self._entries[oldest[_KEY]]
+                entry = [None, None, key, value, expires]
+                self._entries[key] = entry
+            self._linkFirst(entry)
+        finally:
+            self._lock.release()
+
+    def remove(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._root[_PREV] = self._root
+            self._root[_NEXT] = self._root
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _unlink(self, entry):
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _linkFirst(self, entry):
+        first = self._root[_NEXT]
+        entry[_PREV] = self._root
+        entry[_NEXT] = first
+        first[_PREV] = entry
+        self._root[_NEXT] = entry
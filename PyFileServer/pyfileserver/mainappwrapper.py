@@ -9,6 +9,21 @@ mainappwrapper
 
 See Running PyFileServer in ext_wsgiutils_server.py
 
+Configuration reload
+--------------------
+
+PyFileApp.reload() reads the configuration file again, on SIGHUP when run 
+by ext_wsgiutils_server.py, or when the file has changed if 
+``configcheckinterval`` is set. The realms, users, abstraction layers and
+administrator information of the new configuration are used by the requests
+starting after the reload; requests being served keep the configuration
+they started with. Abstraction layers configured exactly as before are kept, 
+with their caches. The other options (authentication, storage of locks and
+properties, background jobs, ...) only change with a restart.
+
+If the new configuration cannot be read, the error is printed and the 
+previous configuration stays in use.
+
 """
 
 __docformat__ = 'reStructuredText'
@@ -16,7 +31,9 @@ __docformat__ = 'reStructuredText'
 
 import os
 import sys
+import time
 import atexit
+import threading
 import traceback
 
 from extrequestserver import RequestServer
@@ -24,22 +41,180 @@ from processrequesterrorhandler import ErrorPrinter
 from httpauthentication import HTTPAuthenticator, SimpleDomainController
 from requestresolver import RequestResolver
 from pyfiledomaincontroller import PyFileServerDomainController
+from cachingdomaincontroller import CachingDomainController
+from jobmanager import JobManager, JobStatusServer
+from uploadsessions import UploadSessionManager
+from accesslog import AccessLog
+from metrics import Metrics, CountingInput, COUNTER, GAUGE
+from adminserver import AdminServer, ADMIN_ALLOW
+from requestprofiler import RequestProfiler, PROFILES_KEPT
+from memoryprofiler import MemoryProfiler, MEASURES_KEPT, TOP_TYPES
+from accountingabstractionlayer import AccountingAbstractionLayer, startAccounting, stopAccounting, getTotalCalls, formatAccounting
+from processrequesterrorhandler import HTTPRequestException
+import processrequesterrorhandler
 
 
-from propertylibrary import PropertyManager
-from locklibrary import LockManager
+from propertylibrary import PropertyManager, MultiProcessPropertyManager
+from locklibrary import LockManager, MultiProcessLockManager
 import websupportfuncs
 import httpdatehelper
 from pyfileserver.fileabstractionlayer import FilesystemAbstractionLayer
 
+def sameAbstractionLayer(resourceAL, otherAL):
+    # abstraction layers of the same class with equal configurations (from 
+    # getConfiguration() if they have it, for layers keeping caches, else all 
+    # their attributes) are considered configured alike
+    if type(resourceAL) is not type(otherAL):
+        return False
+    try:
+        if hasattr(resourceAL, 'getConfiguration'):
+            return resourceAL.getConfiguration() == otherAL.getConfiguration()
+        return vars(resourceAL) == vars(otherAL)
+    except (TypeError, ValueError):
+        return False
+
+
 class PyFileApp(object):
 
-    def __init__(self, specifiedconfigfile = None):
+    def __init__(self, specifiedconfigfile = None, multiprocess = None):
 
         if specifiedconfigfile is None:
             specifiedconfigfile = os.path.abspath('PyFileServer.conf')
+        self._configfile = specifiedconfigfile
+        self._reloadlock = threading.Lock()
+
+        (servcfg, self._configmtime) = self.loadConfig()
+
+        # the configuration and the information derived from it, replaced as 
+        # a whole on reload
+        self._snapshot = (servcfg, self.getInfoHeader(servcfg))
+        self._configcheckinterval = servcfg.get('configcheckinterval', 0)
+        self._nextconfigcheck = time.time() + self._configcheckinterval
+        self._verbose = servcfg.get('verbose', 0)
+        self._alaccounting = servcfg.get('alaccounting', False)
+        self._alcallsheader = self._alaccounting and servcfg.get('alcallsheader', False)
+
+        # access log, to standard error when verbose without a log file
+        self._accesslog = None
+        _accesslogfile = servcfg.get('accesslog', None)
+        if _accesslogfile or self._verbose >= 1:
+            self._accesslog = AccessLog(_accesslogfile or None, servcfg.get('accesslogmaxbytes', 0), servcfg.get('accesslogrotateinterval', 0), servcfg.get('accesslogbackups', 5), servcfg.get('accesslogqueuesize', 10000))
+            atexit.register(self._accesslog.close)
+
+        _locksfile = servcfg.get('locksfile', os.path.abspath('PyFileServer.locks'))
+        _propsfile = servcfg.get('propsfile', os.path.abspath('PyFileServer.dat'))
+
+        # several server processes must share the locks and properties storage
+        if multiprocess is None:
+            multiprocess = servcfg.get('multiprocess', False)
+        if multiprocess:
+            _locksmanagerobj = servcfg.get('locksmanager', None) or MultiProcessLockManager(_locksfile)
+            _propsmanagerobj = servcfg.get('propsmanager', None) or MultiProcessPropertyManager(_propsfile)
+        else:
+            _locksmanagerobj = servcfg.get('locksmanager', None) or LockManager(_locksfile)
+            _propsmanagerobj = servcfg.get('propsmanager', None) or PropertyManager(_propsfile)     
+        _domaincontrollerobj = servcfg.get('domaincontroller', None) or PyFileServerDomainController()
+        _authcachetimeout = servcfg.get('authcachetimeout', 0)
+        if _authcachetimeout > 0:
+            _domaincontrollerobj = CachingDomainController(_domaincontrollerobj, _authcachetimeout, servcfg.get('authfailuredelay', 5),
+                                                           maxfailures=servcfg.get('authmaxfailures', 5))
+
+
+        # authentication fields
+        _authacceptbasic = servcfg.get('acceptbasic', False)
+        _authacceptdigest = servcfg.get('acceptdigest', True)
+        _authdefaultdigest = servcfg.get('defaultdigest', True)
+        _authnoncesecret = servcfg.get('noncesecret', None)
+        _authnoncetimeout = servcfg.get('noncetimeout', 300)
+        _authtrackncount = servcfg.get('trackncount', False)
+
+        # resolved paths are only invalidated within this process
+        _pathcachesize = servcfg.get('pathcachesize', 1000)
+        if multiprocess:
+            _pathcachesize = servcfg.get('pathcachesize', 0)
+
+        # background jobs and upload sessions are kept by the process that 
+        # started them, which the next request of the client rarely reaches
+        _asyncjobs = servcfg.get('asyncjobs', False)
+        _uploadsessions = servcfg.get('uploadsessions', False)
+        if multiprocess:
+            for (option, enabled) in (('asyncjobs', _asyncjobs), ('uploadsessions', _uploadsessions)):
+                if enabled:
+                    print >> sys.stderr, '[', httpdatehelper.getstrftime(), ']', option, 'is not supported with several server processes, disabled'
+            _asyncjobs = _uploadsessions = False
+
+        # background job fields
+        _jobmanagerobj = None
+        if _asyncjobs:
+            _jobmanagerobj = JobManager(servcfg.get('asyncjobworkers', 2), servcfg.get('asyncjobpath', '/_jobs'), servcfg.get('asyncjobthreshold', 0))
+
+        # administration pages and metrics
+        _adminpath = servcfg.get('adminpath', None)
+        self._adminserver = None
+        self._metrics = None
+        if servcfg.get('metrics', bool(_adminpath)):
+            self._metrics = Metrics()
+            self._metrics.describe('pyfileserver_cache_hits_total', COUNTER, 'Lookups answered from a cache.')
+            self._metrics.describe('pyfileserver_cache_misses_total', COUNTER, 'Lookups not answered from a cache.')
+            self._metrics.describe('pyfileserver_locks', GAUGE, 'Locks held.')
+            self._metrics.describe('pyfileserver_property_resources', GAUGE, 'Resources with dead properties.')
+            self._metrics.describe('pyfileserver_accesslog_dropped_total', COUNTER, 'Access log entries dropped.')
+            self._metrics.addCollector(self.collectMetrics)
+
+        # request profiling fields
+        _profilesamplerate = servcfg.get('profilesamplerate', 0)
+        _profilemethods = servcfg.get('profilemethods', None)
+        _profilepaths = servcfg.get('profilepaths', None)
+        self._memoryprofiler = None
+        if servcfg.get('memprofilesamplerate', 0) > 0:
+            self._memoryprofiler = MemoryProfiler(servcfg.get('memprofilesamplerate', 0), servcfg.get('memprofilethreshold', 10485760), servcfg.get('memprofilekept', MEASURES_KEPT), servcfg.get('memprofiletop', TOP_TYPES))
+
+        # upload session fields
+        _uploadsessionmanagerobj = None
+        if _uploadsessions:
+            _uploadsessionmanagerobj = UploadSessionManager(servcfg.get('uploadsessiontimeout', 3600), servcfg.get('uploadsessionpartsize', 8388608))
+
+        self._locksmanager = _locksmanagerobj
+        self._propsmanager = _propsmanagerobj
+        self._domaincontroller = _domaincontrollerobj
+        requestserver = RequestServer(_propsmanagerobj, _locksmanagerobj, _jobmanagerobj, _uploadsessionmanagerobj)      
+        application = requestserver
+        self._profiler = None
+        if _profilesamplerate > 0 or _profilemethods or _profilepaths:
+            self._profiler = RequestProfiler(requestserver, _profilesamplerate, _profilemethods or None, _profilepaths, servcfg.get('profilethreshold', 1.0), servcfg.get('profilekept', PROFILES_KEPT))
+            application = self._profiler
+        self._authenticator = HTTPAuthenticator(application, _domaincontrollerobj, _authacceptbasic, _authacceptdigest, _authdefaultdigest, _authnoncesecret, _authnoncetimeout, _authtrackncount)      
+        self._requestresolver = RequestResolver(self._authenticator, servcfg, _pathcachesize)
+        requestserver.addMetadataListener(self._requestresolver.invalidateMetadata)
+        application = self._requestresolver
+        if _jobmanagerobj is not None:
+            application = JobStatusServer(application, _jobmanagerobj)
+        if _adminpath:
+            self._adminserver = AdminServer(application, _adminpath, servcfg.get('adminallow', ADMIN_ALLOW))
+            if self._metrics is not None:
+                self._adminserver.addPage('metrics', 'Request metrics (Prometheus text format)', self.getMetricsPage)
+            if self._profiler is not None:
+                self._adminserver.addPage('profiles', 'Profiles of slow requests', self._profiler.getProfilesPage)
+            if self._memoryprofiler is not None:
+                self._adminserver.addPage('memory', 'Memory taken by sampled requests', self._memoryprofiler.getMemoryPage)
+            application = self._adminserver
+        application = ErrorPrinter(application, server_descriptor=self._snapshot[1]) 
+
+        self._application = application
+
+
+    def loadConfig(self, previouscfg=None):
+        """
+        Reads the configuration file, returns (configuration, modification 
+        time of the file). Abstraction layers configured as in previouscfg 
+        are taken over from it.
+        """
+        specifiedconfigfile = self._configfile
+        try:
+            configmtime = os.stat(specifiedconfigfile).st_mtime
+        except OSError:
+            configmtime = None
 
-        loadconfig = True
         try:      
             from paste import pyconfig
             servcfg = pyconfig.Config()
@@ -61,64 +236,189 @@ class PyFileApp(object):
                 exceptiontext = exceptiontext + einfo + '\n'   
             raise RuntimeError('Failed to read PyFileServer configuration file : ' + specifiedconfigfile + '\nDue to ' + exceptiontext)
 
-
-        self._srvcfg = servcfg
-        
         #add default abstraction layer
-        self._srvcfg['resAL_library']['*'] = FilesystemAbstractionLayer()
-        
-        self._infoHeader = '<a href="mailto:%s">Administrator</a> at %s' % (servcfg.get('Info_AdminEmail',''), servcfg.get('Info_Organization',''))
-        self._verbose = servcfg.get('verbose', 0)
+        servcfg['resAL_library']['*'] = FilesystemAbstractionLayer(syncpolicy=servcfg.get('syncpolicy', 'none'))
 
-        _locksfile = servcfg.get('locksfile', os.path.abspath('PyFileServer.locks'))
-        _propsfile = servcfg.get('propsfile', os.path.abspath('PyFileServer.dat'))
-
-        _locksmanagerobj = servcfg.get('locksmanager', None) or LockManager(_locksfile)
-        _propsmanagerobj = servcfg.get('propsmanager', None) or PropertyManager(_propsfile)     
-        _domaincontrollerobj = servcfg.get('domaincontroller', None) or PyFileServerDomainController()
+        if previouscfg is not None:
+            previouslibrary = previouscfg['resAL_library']
+            for (descriptor, resourceAL) in servcfg['resAL_library'].items():
+                if descriptor in previouslibrary:
+                    previousAL = previouslibrary[descriptor]
+                    if isinstance(previousAL, AccountingAbstractionLayer):
+                        previousAL = previousAL.getWrappedLayer()
+                    if sameAbstractionLayer(previousAL, resourceAL):
+                        servcfg['resAL_library'][descriptor] = previousAL
 
+        if servcfg.get('alaccounting', False):
+            for (descriptor, resourceAL) in servcfg['resAL_library'].items():
+                servcfg['resAL_library'][descriptor] = AccountingAbstractionLayer(resourceAL)
 
-        # authentication fields
-        _authacceptbasic = servcfg.get('acceptbasic', False)
-        _authacceptdigest = servcfg.get('acceptdigest', True)
-        _authdefaultdigest = servcfg.get('defaultdigest', True)
+        return (servcfg, configmtime)
 
-        application = RequestServer(_propsmanagerobj, _locksmanagerobj)      
-        application = HTTPAuthenticator(application, _domaincontrollerobj, _authacceptbasic, _authacceptdigest, _authdefaultdigest)      
-        application = RequestResolver(application)      
-        application = ErrorPrinter(application, server_descriptor=self._infoHeader) 
+    def getInfoHeader(self, servcfg):
+        return '<a href="mailto:%s">Administrator</a> at %s' % (servcfg.get('Info_AdminEmail',''), servcfg.get('Info_Organization',''))
 
-        self._application = application
+    def reload(self):
+        """
+        Reads the configuration file again and replaces the configuration 
+        used by new requests. Returns False if the configuration could not be
+        read, or another reload is in progress.
+        """
+        if not self._reloadlock.acquire(False):
+            return False
+        try:
+            try:
+                (servcfg, self._configmtime) = self.loadConfig(self._snapshot[0])
+            except RuntimeError, e:
+                print >> sys.stderr, '[', httpdatehelper.getstrftime(), '] Configuration not reloaded:', str(e)
+                return False
+            # the requests using the new configuration find its realms compiled
+            self._requestresolver.compileRealms(servcfg)
+            self._snapshot = (servcfg, self.getInfoHeader(servcfg))
+            self._authenticator.clearCaches()
+            if self._verbose >= 1:
+                print >> sys.stderr, '[', httpdatehelper.getstrftime(), '] Configuration reloaded from', self._configfile
+            return True
+        finally:
+            self._reloadlock.release()
 
+    def checkConfigFile(self):
+        """
+        Reloads the configuration if the configuration file was modified.
+        """
+        self._nextconfigcheck = time.time() + self._configcheckinterval
+        try:
+            configmtime = os.stat(self._configfile).st_mtime
+        except OSError:
+            return False
+        if configmtime == self._configmtime:
+            return False
+        # a file that cannot be read is not tried again until modified again
+        self._configmtime = configmtime
+        return self.reload()
 
     def __call__(self, environ, start_response):
-        environ['pyfileserver.config'] = self._srvcfg
-        environ['pyfileserver.trailer'] = self._infoHeader
+        if self._configcheckinterval > 0 and time.time() >= self._nextconfigcheck:
+            self.checkConfigFile()
+
+        (srvcfg, infoheader) = self._snapshot
+        environ['pyfileserver.config'] = srvcfg
+        environ['pyfileserver.trailer'] = infoheader
 
-        if self._verbose == 1:
-            print >> environ['wsgi.errors'], '[',httpdatehelper.getstrftime(),'] from ', environ.get('REMOTE_ADDR','unknown'), ' ', environ.get('REQUEST_METHOD','unknown'), ' ', environ.get('PATH_INFO','unknown'), ' ', environ.get('HTTP_DESTINATION', '')
-        elif self._verbose == 2:      
-            print >> environ['wsgi.errors'], "<======== Request Environ"
+        if self._accesslog is None and self._metrics is None and not self._alaccounting and self._memoryprofiler is None:
+            return self._application(environ, start_response)
+
+        accounting = None
+        if self._alaccounting:
+            accounting = startAccounting()
+
+        if self._verbose == 2:      
+            requestdump = ["<======== Request Environ\n"]
             for envitem in environ.keys():
                 if envitem == envitem.upper():
-                    print >> environ['wsgi.errors'], "\t", envitem, ":\t", repr(environ[envitem]) 
-            print >> environ['wsgi.errors'], "\n"
+                    requestdump.append("\t%s :\t%r\n" % (envitem, environ[envitem]))
+            requestdump.append("\n")
+            self._accesslog.logText(''.join(requestdump))
+
+        response = _MonitoredResponse(self._accesslog, self._metrics, accounting, self._memoryprofiler, environ, self._verbose == 2 and environ['REQUEST_METHOD'] != 'GET')
 
         def _start_response(respcode, headers, excinfo=None):   
+            response.status = respcode
+            if self._alcallsheader:
+                headers = headers + [('X-AL-Calls', formatAccounting(accounting))]
             if self._verbose == 2:
-                print >> environ['wsgi.errors'], "=========> Response"
-                print >> environ['wsgi.errors'], 'Response code:', respcode
-                headersdict = dict(headers)
-                for envitem in headersdict.keys():
-                    print >> environ['wsgi.errors'], "\t", envitem, ":\t", repr(headersdict[envitem]) 
-                print >> environ['wsgi.errors'], "\n"
+                responsedump = ["=========> Response\n", "Response code: %s\n" % respcode]
+                for (headername, headervalue) in headers:
+                    responsedump.append("\t%s :\t%r\n" % (headername, headervalue))
+                responsedump.append("\n")
+                self._accesslog.logText(''.join(responsedump))
             return start_response(respcode, headers, excinfo)
 
-        for v in iter(self._application(environ, _start_response)):
-            if self._verbose == 2 and environ['REQUEST_METHOD'] != 'GET':
-                print >> environ['wsgi.errors'], v
-            yield v 
+        try:
+            response.result = self._application(environ, _start_response)
+        except:
+            response.status = response.status or '500 Internal Server Error'
+            response.close()
+            raise
+        return response
+
+    def getMetricsPage(self, environ, subpath):
+        if subpath:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+        return ('text/plain; version=0.0.4', self._metrics.render())
+
+    def collectMetrics(self):
+        # values read when the metrics are rendered
+        samples = []
+        for (cachename, stats) in [('paths', self._requestresolver.getCacheStats()),
+                                   ('digest_ha1', self._authenticator.getCacheStats()),
+                                   ('credentials', getattr(self._domaincontroller, 'getCacheStats', lambda: None)())]:
+            if stats is not None:
+                samples.append(('pyfileserver_cache_hits_total', (('cache', cachename),), stats['hits']))
+                samples.append(('pyfileserver_cache_misses_total', (('cache', cachename),), stats['misses']))
+        if hasattr(self._locksmanager, 'getLockCount'):
+            samples.append(('pyfileserver_locks', (), self._locksmanager.getLockCount()))
+        if hasattr(self._propsmanager, 'getResourceCount'):
+            samples.append(('pyfileserver_property_resources', (), self._propsmanager.getResourceCount()))
+        if self._accesslog is not None:
+            samples.append(('pyfileserver_accesslog_dropped_total', (), self._accesslog.getStats()['dropped']))
+        return samples
+
+
+class _MonitoredResponse(object):
+    """
+    Response iterable counting the bytes sent, recording the request (and the
+    abstraction layer calls accounted to it) in the access log and metrics 
+    when closed.
+    """
+    def __init__(self, accesslog, metrics, accounting, memoryprofiler, environ, logbody):
+        self._accesslog = accesslog
+        self._metrics = metrics
+        self._accounting = accounting
+        self._memoryprofiler = memoryprofiler
+        self._memorysnapshot = None
+        if memoryprofiler is not None:
+            self._memorysnapshot = memoryprofiler.startRequest()
+        self._environ = environ
+        self._logbody = logbody
+        self._starttime = time.time()
+        self._bytes = 0
+        self._recorded = False
+        self._input = None
+        self.status = None
+        self.result = None
+        if metrics is not None:
+            metrics.requestStarted()
+            if 'wsgi.input' in environ:
+                self._input = CountingInput(environ['wsgi.input'])
+                environ['wsgi.input'] = self._input
+
+    def __iter__(self):
+        for data in self.result:
+            self._bytes += len(data)
+            if self._logbody:
+                self._accesslog.logText(data + '\n')
+            yield data
 
-        return 
-        
-        
\ No newline at end of file
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            if not self._recorded:
+                self._recorded = True
+                endtime = time.time()
+                if self._accounting is not None:
+                    stopAccounting()
+                    self._environ['pyfileserver.alcalls'] = getTotalCalls(self._accounting)
+                    if self._metrics is not None:
+                        self._metrics.abstractionLayerCalls(self._environ, self._accounting)
+                if self._memorysnapshot is not None:
+                    self._memoryprofiler.finishRequest(self._memorysnapshot, self._environ, self.status)
+                if self._accesslog is not None:
+                    self._accesslog.logRequest(self._environ, self.status, self._bytes, self._starttime, endtime)
+                if self._metrics is not None:
+                    bytesin = 0
+                    if self._input is not None:
+                        bytesin = self._input.bytesread
+                    self._metrics.requestFinished(self._environ, self.status, bytesin, self._bytes, endtime - self._starttime)
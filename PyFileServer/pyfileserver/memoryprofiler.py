@@ -0,0 +1,216 @@
+"""
+memoryprofiler
+==============
+
+:Module: pyfileserver.memoryprofiler
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+Measures the memory taken by sampled requests, to find the requests (and the
+kinds of objects) behind memory spikes. Diagnostic only: measuring costs a
+garbage collection and a walk over all objects at the start and at the end of
+each sampled request, and a thread reading the memory size of the process
+every ``sampleinterval`` seconds while it is served.
+
+Usage::
+
+   from pyfileserver.memoryprofiler import MemoryProfiler
+   memoryprofiler = MemoryProfiler(samplerate=0.01, threshold=10485760, sampleinterval=0.01)
+   snapshot = memoryprofiler.startRequest()     # None if not sampled
+   ... request served ...
+   memoryprofiler.finishRequest(snapshot, environ, status)
+
+For each sampled request, the following are measured:
+
++ peak: the largest growth of the memory size of the process (resident set
+  size) over its size at the start, as read by the sampling thread during the
+  request - memory that was needed while serving it. Spikes shorter than
+  ``sampleinterval`` may be missed.
++ retained: the growth of the memory size of the process (resident set size)
+  from the start to the end of the request.
++ objects: the growth of the number (and size, by sys.getsizeof) of the
+  objects tracked by the garbage collector, by type, after collecting garbage
+  - the objects the request left behind. The ``top`` types grown most are
+  reported.
+
+Requests of which the peak or retained growth reach ``threshold`` bytes are
+kept, the latest ``kept`` of them, and listed on the admin page
+``<adminpath>/memory`` (see adminserver.py).
+
+The sizes are those of the whole process: requests served at the same time
+as a sampled request are measured with it. The peak and retained sizes are
+only known where /proc/self/statm is (Linux). Objects not tracked by the garbage collector (strings, numbers) are
+not counted, only the containers holding them.
+
+Interface
+---------
+
+Classes:
+
++ 'MemoryProfiler': Memory measurements of sampled requests
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import sys
+import gc
+import cgi
+import time
+import random
+import threading
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import processrequesterrorhandler
+from processrequesterrorhandler import HTTPRequestException
+
+MEASURES_KEPT = 20
+TOP_TYPES = 10
+SAMPLE_INTERVAL = 0.01
+
+
+def getResidentSize():
+    """
+    returns the resident set size of the process in bytes, None if unknown
+    """
+    try:
+        statm = open('/proc/self/statm')
+        try:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+        finally:
+            statm.close()
+    except (IOError, IndexError, ValueError, AttributeError):
+        return None
+
+class PeakSampler(threading.Thread):
+    """
+    Reads the resident set size of the process every interval seconds until
+    stopped, keeping the largest. ru_maxrss cannot be used instead: it is the
+    largest size over the lifetime of the process, and does not grow again
+    for requests needing less than an earlier one.
+    """
+    def __init__(self, interval):
+        threading.Thread.__init__(self, name='PeakSampler')
+        self.setDaemon(True)
+        self._interval = interval
+        self._stopped = threading.Event()
+        self.peak = getResidentSize()
+
+    def run(self):
+        while not self._stopped.isSet():
+            size = getResidentSize()
+            if size > self.peak:
+                self.peak = size
+            self._stopped.wait(self._interval)
+
+    def stop(self):
+        """
+        stops sampling, returns the largest resident set size read in bytes,
+        None if unknown
+        """
+        self._stopped.set()
+        self.join()
+        size = getResidentSize()
+        if size > self.peak:
+            self.peak = size
+        return self.peak
+
+def getObjectsByType():
+    """
+    returns {type name: [number of objects, size]} of the objects tracked by
+    the garbage collector
+    """
+    gc.collect()
+    objectsbytype = {}
+    for obj in gc.get_objects():
+        typename = type(obj).__name__
+        entry = objectsbytype.get(typename, None)
+        if entry is None:
+            entry = [0, 0]
+            objectsbytype[typename] = entry
+        entry[0] += 1
+        entry[1] += sys.getsizeof(obj, 0)
+    return objectsbytype
+
+
+class MemoryProfiler(object):
+    def __init__(self, samplerate, threshold, kept=MEASURES_KEPT, top=TOP_TYPES, sampleinterval=SAMPLE_INTERVAL):
+        self._samplerate = samplerate
+        self._sampleinterval = sampleinterval
+        self._threshold = threshold
+        self._kept = kept
+        self._top = top
+        self._measureslock = threading.Lock()
+        self._measures = []   # [(start time, method, path, status, duration, peak, retained, [(type name, count, size)])]
+
+    def startRequest(self):
+        if random.random() >= self._samplerate:
+            return None
+        startobjects = getObjectsByType()
+        sampler = None
+        startsize = getResidentSize()
+        if startsize is not None:
+            sampler = PeakSampler(self._sampleinterval)
+            sampler.start()
+        return (time.time(), sampler, startsize, startobjects)
+
+    def finishRequest(self, snapshot, environ, status):
+        (starttime, sampler, startsize, startobjects) = snapshot
+        duration = time.time() - starttime
+        peak = retained = None
+        if sampler is not None:
+            peak = sampler.stop() - startsize
+        endobjects = getObjectsByType()
+        if startsize is not None:
+            retained = getResidentSize() - startsize
+        if max(peak, retained) < self._threshold:
+            return
+
+        grown = []
+        for (typename, (count, size)) in endobjects.items():
+            (startcount, startbytes) = startobjects.get(typename, (0, 0))
+            if count > startcount:
+                grown.append((size - startbytes, count - startcount, typename))
+        grown.sort()
+        grown.reverse()
+        toptypes = [(typename, count, size) for (size, count, typename) in grown[:self._top]]
+
+        if status is not None:
+            status = status.split(' ', 1)[0]
+        self._measureslock.acquire()
+        try:
+            self._measures.append((starttime, environ.get('REQUEST_METHOD'), environ.get('PATH_INFO', ''), status, duration, peak, retained, toptypes))
+            if len(self._measures) > self._kept:
+                del self._measures[0]
+        finally:
+            self._measureslock.release()
+
+    def getMeasures(self):
+        self._measureslock.acquire()
+        try:
+            return list(self._measures)
+        finally:
+            self._measureslock.release()
+
+    def getMemoryPage(self, environ, subpath):
+        if subpath:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+        o_list = []
+        o_list.append('<html><head><title>Request memory</title></head><body><h1>Request memory</h1>')
+        o_list.append('<p>Sampled requests growing the process by %d bytes or more, the latest %d kept.</p><table>' % (self._threshold, self._kept))
+        o_list.append('<tr><th>Started</th><th>Method</th><th>Path</th><th>Status</th><th>Seconds</th><th>Peak growth</th><th>Retained</th><th>Objects retained (type: count, bytes)</th></tr>')
+        measures = self.getMeasures()
+        measures.reverse()
+        for (starttime, method, path, status, duration, peak, retained, toptypes) in measures:
+            typelist = '<br>'.join(['%s: %d, %d' % (cgi.escape(typename), count, size) for (typename, count, size) in toptypes])
+            o_list.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%.3f</td><td>%s</td><td>%s</td><td>%s</td></tr>' % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(starttime)), cgi.escape(str(method)), cgi.escape(path),
+                cgi.escape(str(status)), duration, peak, retained, typelist))
+        o_list.append('</table><hr>%s</body></html>' % environ.get('pyfileserver.trailer', ''))
+        return ('text/html', ''.join(o_list))
@@ -0,0 +1,293 @@
+"""
+metrics
+=======
+
+:Module: pyfileserver.metrics
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+Counters and latency histograms of the requests served, rendered in the
+Prometheus text exposition format (served by ``adminserver.AdminServer``
+under ``<adminpath>/metrics``).
+
+Usage::
+
+   from pyfileserver.metrics import Metrics
+   metrics = Metrics()
+   metrics.inc('pyfileserver_requests_total', (('method', 'GET'),))
+   metrics.observe('pyfileserver_request_duration_seconds', (('method', 'GET'),), 0.012)
+   metrics.addCollector(func)   # func() returns [(name, labels, value)]
+   text = metrics.render()
+
+Each thread records into counters of its own, so recording takes no lock.
+The counters of all threads are added up when the metrics are rendered; the
+counters of threads that have ended are kept in one set of totals, into which
+they are also moved every ``RETIRE_INTERVAL`` new threads.
+
+Values known elsewhere (store sizes, cache statistics, ...) are read when
+rendering, from collector functions.
+
+The metrics recorded for each request (see ``requestStarted()`` and
+``requestFinished()``) are:
+
++ pyfileserver_requests_total{method,realm,status}: requests served
++ pyfileserver_request_duration_seconds{method,realm}: histogram of the time
+  from the start of the request to the end of the response
++ pyfileserver_request_bytes_total{method,realm}: request body bytes read
++ pyfileserver_response_bytes_total{method,realm}: response body bytes sent
++ pyfileserver_requests_in_flight: requests being served
++ pyfileserver_queue_wait_seconds: histogram of the time requests waited for
+  a server thread (ext_wsgiutils_server's ``--workers`` pool)
+
+and, with ``alaccounting`` (see ``abstractionLayerCalls()`` and
+accountingabstractionlayer.py):
+
++ pyfileserver_al_calls_total{method,almethod}: abstraction layer calls made
+  by requests of the method, per abstraction layer method
++ pyfileserver_al_seconds_total{method,almethod}: time taken by these calls
+
+Divided by pyfileserver_requests_total, they give the calls per request.
+
+Interface
+---------
+
+Classes:
+
++ 'Metrics': Counters, histograms and collectors
++ 'CountingInput': wsgi.input wrapper counting the bytes read
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import bisect
+import threading
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# threads registered between two retirements of the ended threads' counters
+RETIRE_INTERVAL = 100
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+_DESCRIPTIONS = {
+    'pyfileserver_requests_total': (COUNTER, 'Requests served.'),
+    'pyfileserver_request_duration_seconds': (HISTOGRAM, 'Time from the start of a request to the end of its response.'),
+    'pyfileserver_request_bytes_total': (COUNTER, 'Request body bytes read.'),
+    'pyfileserver_response_bytes_total': (COUNTER, 'Response body bytes sent.'),
+    'pyfileserver_requests_in_flight': (GAUGE, 'Requests being served.'),
+    'pyfileserver_queue_wait_seconds': (HISTOGRAM, 'Time requests waited for a server thread.'),
+    'pyfileserver_al_calls_total': (COUNTER, 'Abstraction layer calls made by requests.'),
+    'pyfileserver_al_seconds_total': (COUNTER, 'Time taken by abstraction layer calls made by requests.'),
+    }
+
+# internal counters of requestStarted() / requestFinished()
+_STARTED = ('_started', ())
+_FINISHED = ('_finished', ())
+
+
+def _escapeLabelValue(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(['%s="%s"' % (name, _escapeLabelValue(value)) for (name, value) in labels]) + '}'
+
+def _formatValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Metrics(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._descriptions = dict(_DESCRIPTIONS)
+        self._local = threading.local()
+        self._threadslock = threading.Lock()
+        # [(thread, its counters)], and the totals of ended threads
+        self._threads = []
+        self._retired = {}
+        self._registered = 0
+        self._collectors = []
+
+    def describe(self, name, metrictype, helptext):
+        self._descriptions[name] = (metrictype, helptext)
+
+    def addCollector(self, collector):
+        """
+        Registers collector(), returning a list of (name, labels, value) read
+        when rendering. Names should be described with describe().
+        """
+        self._collectors.append(collector)
+
+    def _getCounters(self):
+        try:
+            return self._local.counters
+        except AttributeError:
+            counters = {}
+            self._local.counters = counters
+            self._threadslock.acquire()
+            try:
+                self._threads.append((threading.currentThread(), counters))
+                self._registered += 1
+                if self._registered % RETIRE_INTERVAL == 0:
+                    # servers starting a thread per request would otherwise 
+                    # keep the counters of every thread until rendered
+                    self._retireThreads()
+            finally:
+                self._threadslock.release()
+            return counters
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._getCounters()
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        counters = self._getCounters()
+        key = (name, labels)
+        histogram = counters.get(key, None)
+        if histogram is None:
+            # a count per bucket (the last one unbounded), the sum
+            histogram = [0] * (len(self._buckets) + 1) + [0.0]
+            counters[key] = histogram
+        histogram[bisect.bisect_left(self._buckets, value)] += 1
+        histogram[-1] += value
+
+    def requestStarted(self):
+        self.inc(*_STARTED)
+
+    def requestFinished(self, environ, status, bytesin, bytesout, duration):
+        method = environ.get('REQUEST_METHOD', '')
+        realm = environ.get('pyfileserver.mappedrealm', '')
+        if status is not None:
+            status = status.split(' ', 1)[0]
+        labels = (('method', method), ('realm', realm))
+        counters = self._getCounters()
+        counters[_FINISHED] = counters.get(_FINISHED, 0) + 1
+        self.inc('pyfileserver_requests_total', labels + (('status', status),))
+        self.observe('pyfileserver_request_duration_seconds', labels, duration)
+        if bytesin:
+            self.inc('pyfileserver_request_bytes_total', labels, bytesin)
+        if bytesout:
+            self.inc('pyfileserver_response_bytes_total', labels, bytesout)
+        if 'ext_wsgiutils.queuewait' in environ:
+            self.observe('pyfileserver_queue_wait_seconds', (), environ['ext_wsgiutils.queuewait'])
+
+    def abstractionLayerCalls(self, environ, accounting):
+        method = environ.get('REQUEST_METHOD', '')
+        for (almethod, (calls, seconds)) in accounting.items():
+            labels = (('method', method), ('almethod', almethod))
+            self.inc('pyfileserver_al_calls_total', labels, calls)
+            self.inc('pyfileserver_al_seconds_total', labels, seconds)
+
+    def getTotals(self):
+        """
+        returns the counters of all threads added up,
+        {(name, labels): value or histogram list}
+        """
+        self._threadslock.acquire()
+        try:
+            self._retireThreads()
+            totals = {}
+            self._merge(totals, self._retired)
+            for (thread, counters) in self._threads:
+                # dict() copies in one step, the thread may be recording
+                self._merge(totals, dict(counters))
+            return totals
+        finally:
+            self._threadslock.release()
+
+    def _retireThreads(self):
+        # adds the counters of ended threads to the retired totals, called
+        # with _threadslock held
+        threads = []
+        for (thread, counters) in self._threads:
+            if thread.isAlive():
+                threads.append((thread, counters))
+            else:
+                self._merge(self._retired, counters)
+        self._threads = threads
+
+    def _merge(self, totals, counters):
+        for (key, value) in counters.items():
+            if isinstance(value, list):
+                if key in totals:
+                    total = totals[key]
+                    for index in range(len(value)):
+                        total[index] += value[index]
+                else:
+                    totals[key] = list(value)
+            else:
+                totals[key] = totals.get(key, 0) + value
+
+    def render(self):
+        totals = self.getTotals()
+        inflight = totals.pop(_STARTED, 0) - totals.pop(_FINISHED, 0)
+        samples = {'pyfileserver_requests_in_flight': [((), inflight)]}
+        for ((name, labels), value) in totals.items():
+            samples.setdefault(name, []).append((labels, value))
+        for collector in self._collectors:
+            for (name, labels, value) in collector():
+                samples.setdefault(name, []).append((labels, value))
+
+        lines = []
+        names = samples.keys()
+        names.sort()
+        for name in names:
+            (metrictype, helptext) = self._descriptions.get(name, ('untyped', ''))
+            if helptext:
+                lines.append('# HELP %s %s' % (name, helptext))
+            lines.append('# TYPE %s %s' % (name, metrictype))
+            namesamples = samples[name]
+            namesamples.sort()
+            for (labels, value) in namesamples:
+                if metrictype == HISTOGRAM:
+                    cumulative = 0
+                    for index in range(len(self._buckets)):
+                        cumulative += value[index]
+                        lines.append('%s_bucket%s %d' % (name, _formatLabels(labels + (('le', repr(self._buckets[index])),)), cumulative))
+                    cumulative += value[len(self._buckets)]
+                    lines.append('%s_bucket%s %d' % (name, _formatLabels(labels + (('le', '+Inf'),)), cumulative))
+                    lines.append('%s_sum%s %s' % (name, _formatLabels(labels), _formatValue(value[-1])))
+                    lines.append('%s_count%s %d' % (name, _formatLabels(labels), cumulative))
+                else:
+                    lines.append('%s%s %s' % (name, _formatLabels(labels), _formatValue(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class CountingInput(object):
+    """
+    Wraps a wsgi.input stream, counting the bytes read in ``bytesread``.
+    """
+    def __init__(self, inputstream):
+        self._inputstream = inputstream
+        self.bytesread = 0
+
+    def read(self, *args):
+        data = self._inputstream.read(*args)
+        self.bytesread += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._inputstream.readline(*args)
+        self.bytesread += len(data)
+        return data
+
+    def readlines(self, *args):
+        lines = self._inputstream.readlines(*args)
+        for line in lines:
+            self.bytesread += len(line)
+        return lines
+
+    def __iter__(self):
+        for line in self._inputstream:
+            self.bytesread += len(line)
+            yield line
@@ -0,0 +1,117 @@
+"""
+multiprocessstore
+=================
+
+:Module: pyfileserver.multiprocessstore
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+Support for sharing the shelve storage of the lock and property managers
+between several server processes (see the ``--processes`` option of
+ext_wsgiutils_server.py).
+
+The ``LockManager`` and ``PropertyManager`` keep their shelve open and
+serialize access with threading locks, which only works within one process.
+Their multi-process variants, ``locklibrary.MultiProcessLockManager`` and
+``propertylibrary.MultiProcessPropertyManager``, instead run each operation
+with the shelve opened under an exclusive ``flock`` on a lock file next to it,
+and close the shelve again afterwards, so every operation sees the changes
+made by the other processes.
+
+This costs opening the shelve on every operation; use the multi-process
+managers only when running several processes. ``flock`` is not available on
+Windows.
+
+Interface
+---------
+
+Classes:
+
++ 'InterProcessLock': Lock held by one thread of one process at a time
+
+Functions:
+
++ 'storeOperation(method)': wraps a manager method to run with the shelve
+  opened under the lock
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import shelve
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class InterProcessLock(object):
+    """
+    Reentrant lock shared by the threads of this process (threading.RLock) and
+    by all processes opening the same lock file (fcntl.flock).
+    """
+    def __init__(self, lockfilepath):
+        if fcntl is None:
+            raise RuntimeError('Multi-process storage needs fcntl.flock, which is not available on this platform')
+        self._lockfilepath = lockfilepath
+        self._threadlock = threading.RLock()
+        self._depth = 0
+        self._lockfile = None
+
+    def acquire(self):
+        self._threadlock.acquire()
+        try:
+            if self._depth == 0:
+                self._lockfile = open(self._lockfilepath, 'a')
+                fcntl.flock(self._lockfile.fileno(), fcntl.LOCK_EX)
+            self._depth += 1
+        except:
+            if self._depth == 0 and self._lockfile is not None:
+                self._lockfile.close()
+                self._lockfile = None
+            self._threadlock.release()
+            raise
+        # returns True for the outermost acquire
+        return self._depth == 1
+
+    def release(self):
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                fcntl.flock(self._lockfile.fileno(), fcntl.LOCK_UN)
+                self._lockfile.close()
+                self._lockfile = None
+        finally:
+            self._threadlock.release()
+
+
+def storeOperation(method):
+    """
+    Wraps ``method`` of a shelve-based manager (which keeps the shelve in
+    ``self._dict``) to run with the shelve opened under
+    ``self._processlock``. Operations calling other operations share the
+    opened shelve.
+    """
+    def operation(self, *args, **kwargs):
+        outermost = self._processlock.acquire()
+        try:
+            if outermost:
+                self._dict = shelve.open(self._persiststorepath)
+                self._loaded = True
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if outermost:
+                    self._loaded = False
+                    self._dict.close()
+                    self._dict = None
+        finally:
+            self._processlock.release()
+    operation.__name__ = method.__name__
+    operation.__doc__ = method.__doc__
+    return operation
@@ -204,6 +204,7 @@ ERROR_DESCRIPTIONS[HTTP_MEDIATYPE_NOT_SUPPORTED] = "415 Media Type Not Supported
 ERROR_DESCRIPTIONS[HTTP_LOCKED] = "423 Locked"
 ERROR_DESCRIPTIONS[HTTP_INTERNAL_ERROR] = "500 Internal Server Error"
 ERROR_DESCRIPTIONS[HTTP_NOT_IMPLEMENTED] = "501 Not Implemented"
+ERROR_DESCRIPTIONS[HTTP_SERVICE_UNAVAILABLE] = "503 Service Unavailable"
 
 # if ERROR_RESPONSES exists for an error code, a html output will be sent as response
 # body including the ERROR_RESPONSES value. Otherwise a null response body is sent.
@@ -249,8 +250,14 @@ class ErrorPrinter(object):
     def __call__(self, environ, start_response):      
         try:
             try:
-                for v in iter(self._application(environ, start_response)):
-                    yield v
+                result = self._application(environ, start_response)
+                try:
+                    for v in iter(result):
+                        yield v
+                finally:
+                    # as required of WSGI servers and middleware
+                    if hasattr(result, 'close'):
+                        result.close()
             except HTTPRequestException, e:
                 raise
             except:
@@ -69,6 +69,7 @@ Interface
 Classes::
 
    class PropertyManager(object)
+   class MultiProcessPropertyManager(PropertyManager)
 
 Misc and Interface methods::
 
@@ -113,6 +114,7 @@ import websupportfuncs
 from processrequesterrorhandler import HTTPRequestException
 import processrequesterrorhandler
 import locklibrary
+from multiprocessstore import InterProcessLock, storeOperation
 
 """
 A low performance dead properties library using shelve
@@ -132,9 +134,9 @@ class PropertyManager(object):
         self._init_lock.acquire(True)
         try:
             if self._loaded:       # test again within the critical section
-                self._lock.release()
                 return True
             self._dict = shelve.open(self._persiststorepath)
+            self._loaded = True
         finally:
             self._init_lock.release()         
 
@@ -217,6 +219,15 @@ class PropertyManager(object):
         finally:
             self._write_lock.release()         
 
+    def getResourceCount(self):
+        self._write_lock.acquire(True)
+        try:
+            if not self._loaded:
+                self._performInitialization()
+            return len(self._dict)
+        finally:
+            self._write_lock.release()         
+
     def __repr__(self):
         return repr(self._dict)
 
@@ -224,6 +235,27 @@ class PropertyManager(object):
         if self._loaded:
             self._dict.close()
 
+class MultiProcessPropertyManager(PropertyManager):
+    """
+    PropertyManager whose shelve may be shared by several server processes, 
+    see multiprocessstore.py
+    """
+    def __init__(self, persiststore):
+        PropertyManager.__init__(self, persiststore)
+        self._processlock = InterProcessLock(persiststore + '.lock')
+
+    def __del__(self):
+        pass
+
+    getProperties = storeOperation(PropertyManager.getProperties)
+    getProperty = storeOperation(PropertyManager.getProperty)
+    writeProperty = storeOperation(PropertyManager.writeProperty)
+    removeProperty = storeOperation(PropertyManager.removeProperty)
+    removeProperties = storeOperation(PropertyManager.removeProperties)
+    copyProperties = storeOperation(PropertyManager.copyProperties)
+    getResourceCount = storeOperation(PropertyManager.getResourceCount)
+
+
 def removeProperties(pm, displaypath):
     pm.removeProperties(displaypath)
 
@@ -0,0 +1,225 @@
+"""
+requestprofiler
+===============
+
+:Module: pyfileserver.requestprofiler
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+WSGI Middleware running ``cProfile`` on some of the requests passed to the
+application it wraps (RequestServer), to find out where the time of slow
+requests goes.
+
+Usage::
+
+   from pyfileserver.requestprofiler import RequestProfiler
+   application = RequestProfiler(requestserver, samplerate=0.01,
+                    methods=['PROPFIND'], threshold=1.0, kept=20)
+
+A request is profiled if it is sampled (with probability ``samplerate``), or
+if it matches the filter: its method is one of ``methods`` and its path
+matches the regular expression ``pathpattern`` (the filter is not used if
+neither is given). The profile covers the call to the application and the
+iteration of the response it returns, up to its close.
+
+Profiles of requests taking ``threshold`` seconds or longer are kept, the
+latest ``kept`` of them. The kept profiles are listed on the admin page
+``<adminpath>/profiles`` (see adminserver.py)::
+
+   <adminpath>/profiles              list of the kept profiles
+   <adminpath>/profiles/<id>.prof    profile as a pstats file
+   <adminpath>/profiles/<id>.txt     profile as text, by cumulative time
+
+A downloaded profile is read with::
+
+   import pstats
+   pstats.Stats('12.prof').sort_stats('cumulative').print_stats(30)
+
+Profiling slows the profiled requests down by a factor of two or more.
+
+Interface
+---------
+
+Classes:
+
++ 'RequestProfiler': Middleware profiling requests
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import re
+import cgi
+import time
+import random
+import marshal
+import pstats
+import threading
+import StringIO
+try:
+    import cProfile
+except ImportError:
+    # python 2.4, profiling not available
+    cProfile = None
+
+import processrequesterrorhandler
+from processrequesterrorhandler import HTTPRequestException
+
+PROFILES_KEPT = 20
+
+
+class RequestProfiler(object):
+    def __init__(self, application, samplerate=0.0, methods=None, pathpattern=None, threshold=1.0, kept=PROFILES_KEPT):
+        if cProfile is None:
+            raise RuntimeError('Request profiling requires the cProfile module (python 2.5 or later)')
+        self._application = application
+        self._samplerate = samplerate
+        self._methods = methods
+        self._pathpattern = None
+        if pathpattern:
+            self._pathpattern = re.compile(pathpattern)
+        self._threshold = threshold
+        self._kept = kept
+        self._profileslock = threading.Lock()
+        self._profiles = []   # [(id, start time, method, path, status, duration, profile)]
+        self._nextid = 1
+
+    def isProfiled(self, environ):
+        if self._samplerate > 0 and random.random() < self._samplerate:
+            return True
+        if self._methods is None and self._pathpattern is None:
+            return False
+        if self._methods is not None and environ['REQUEST_METHOD'] not in self._methods:
+            return False
+        if self._pathpattern is not None and not self._pathpattern.match(environ.get('PATH_INFO', '')):
+            return False
+        return True
+
+    def __call__(self, environ, start_response):
+        if not self.isProfiled(environ):
+            return self._application(environ, start_response)
+
+        response = _ProfiledResponse(self, environ)
+
+        def _start_response(respcode, headers, excinfo=None):
+            response.status = respcode
+            return start_response(respcode, headers, excinfo)
+
+        response.profile.enable()
+        try:
+            response.result = self._application(environ, _start_response)
+        except:
+            response.profile.disable()
+            response.close()
+            raise
+        response.profile.disable()
+        return response
+
+    def keepProfile(self, environ, status, starttime, duration, profile):
+        if duration < self._threshold:
+            return
+        if status is not None:
+            status = status.split(' ', 1)[0]
+        self._profileslock.acquire()
+        try:
+            self._profiles.append((self._nextid, starttime, environ['REQUEST_METHOD'], environ.get('PATH_INFO', ''), status, duration, profile))
+            self._nextid += 1
+            if len(self._profiles) > self._kept:
+                del self._profiles[0]
+        finally:
+            self._profileslock.release()
+
+    def getProfiles(self):
+        self._profileslock.acquire()
+        try:
+            return list(self._profiles)
+        finally:
+            self._profileslock.release()
+
+    def getProfilesPage(self, environ, subpath):
+        """
+        admin page listing the kept profiles, or returning one of them
+        """
+        if subpath == '':
+            return ('text/html', self.getProfileListHTML(environ))
+        if '.' not in subpath:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+        (profileid, extension) = subpath.split('.', 1)
+        for entry in self.getProfiles():
+            if str(entry[0]) == profileid:
+                profile = entry[6]
+                break
+        else:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+        if extension == 'prof':
+            # the format of pstats files, as written by Profile.dump_stats()
+            return ('application/octet-stream', marshal.dumps(profile.stats))
+        elif extension == 'txt':
+            stream = StringIO.StringIO()
+            stats = pstats.Stats(profile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(50)
+            return ('text/plain', stream.getvalue())
+        raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+
+    def getProfileListHTML(self, environ):
+        pageurl = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '').rstrip('/')
+        o_list = []
+        o_list.append('<html><head><title>Request profiles</title></head><body><h1>Request profiles</h1>')
+        o_list.append('<p>Requests of %.3f seconds or longer, the latest %d kept.</p><table>' % (self._threshold, self._kept))
+        o_list.append('<tr><th>Started</th><th>Method</th><th>Path</th><th>Status</th><th>Seconds</th><th>Profile</th></tr>')
+        profiles = self.getProfiles()
+        profiles.reverse()
+        for (profileid, starttime, method, path, status, duration, profile) in profiles:
+            o_list.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%.3f</td><td><a href="%s/%d.prof">pstats</a> <a href="%s/%d.txt">text</a></td></tr>' % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(starttime)), cgi.escape(method), cgi.escape(path),
+                cgi.escape(str(status)), duration, pageurl, profileid, pageurl, profileid))
+        o_list.append('</table><hr>%s</body></html>' % environ.get('pyfileserver.trailer', ''))
+        return ''.join(o_list)
+
+
+class _ProfiledResponse(object):
+    """
+    Response iterable profiling the iteration of the application's response.
+    """
+    def __init__(self, profiler, environ):
+        self._profiler = profiler
+        self._environ = environ
+        self._starttime = time.time()
+        self._kept = False
+        self.profile = cProfile.Profile()
+        self.status = None
+        self.result = None
+
+    def __iter__(self):
+        self.profile.enable()
+        try:
+            iterator = iter(self.result)
+        finally:
+            self.profile.disable()
+        while True:
+            self.profile.enable()
+            try:
+                try:
+                    data = iterator.next()
+                except StopIteration:
+                    return
+            finally:
+                self.profile.disable()
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.profile.enable()
+                try:
+                    self.result.close()
+                finally:
+                    self.profile.disable()
+        finally:
+            if not self._kept:
+                self._kept = True
+                self.profile.create_stats()
+                self._profiler.keepProfile(self._environ, self.status, self._starttime, time.time() - self._starttime, self.profile)
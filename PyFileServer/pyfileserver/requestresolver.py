@@ -86,6 +86,21 @@ header, if present, to::
    environ['pyfileserver.destresourceAL'] = fileabstractionlayer.MyOwnFilesystemAbstractionLayer()
    
 
+The realms of the current configuration are compiled into a trie of path
+segments once - when the configuration is given to the constructor or to
+compileRealms() (as PyFileApp.reload() does before requests use a reloaded
+configuration), else on the first request - so finding the realm of a url
+costs one dictionary lookup per path segment, however many realms are
+configured. A request carrying another configuration (one that started
+before a reload) gets the realms compiled for itself, leaving the current
+trie in place.
+
+The mapped path and display path resolved for a url are kept in a cache of
+the ``pathcachesize`` most recently used urls, as resolving them may ask the
+abstraction layer whether the resource is a collection. The cache is emptied
+through invalidateMetadata() when a request creates, removes or replaces 
+resources, see RequestServer.addMetadataListener().
+
 Interface
 ---------
 
@@ -144,17 +159,36 @@ __docformat__ = 'reStructuredText'
 # Python Built-in imports
 import urllib
 import re
+import threading
 
 # PyFileServer Imports
 import processrequesterrorhandler
 from processrequesterrorhandler import HTTPRequestException
 import websupportfuncs
 import httpdatehelper
+from lrucache import LRUCache
+
+# fields of the realm trie nodes
+_CHILDREN, _REALM = 0, 1
+
+PATH_CACHE_SIZE = 1000
+
 
 class RequestResolver(object):
 
-    def __init__(self, application):
+    def __init__(self, application, srvcfg=None, pathcachesize=PATH_CACHE_SIZE):
         self._application = application
+        # (configuration, realm trie compiled from it), replaced as a whole
+        self._compiled = (None, [{}, None])
+        self._pathcache = None
+        if pathcachesize > 0:
+            self._pathcache = LRUCache(pathcachesize)
+        # bumped by every invalidation, so resolutions that started before
+        # an invalidation are not cached after it
+        self._pathcachegeneration = 0
+        self._pathcachelock = threading.Lock()
+        if srvcfg is not None:
+            self.compileRealms(srvcfg)
       
     def __call__(self, environ, start_response):
         self._srvcfg = environ['pyfileserver.config']
@@ -241,43 +275,117 @@ class RequestResolver(object):
         start_response('200 OK', headers)        
         return ['']     
         
-    def resolveRealmURI(self, srvcfg, requestpath):
-
-        mapcfg = srvcfg['config_mapping']
-        resALcfg = srvcfg['resAL_mapping']
-        resALreg = srvcfg['resAL_library']
+    def compileRealms(self, srvcfg):
+        """
+        Compiles the realms of the configuration into a trie and makes it the
+        current one, used by requests with this configuration. Returns the 
+        trie. Call again if the realms of a configuration change.
+        """
+        realmtrie = self.buildRealmTrie(srvcfg)
+        # replaced whole, requests being resolved keep the trie they started with
+        self._compiled = (srvcfg, realmtrie)
+        return realmtrie
 
-        # sorting by reverse length
-        mapcfgkeys = mapcfg.keys()
-        mapcfgkeys.sort(key = len, reverse = True)
+    def buildRealmTrie(self, srvcfg):
+        """
+        returns the realms of the configuration as a trie of upper-cased path
+        segments, each realm node holding (realm name, local path, resource 
+        abstraction layer)
+        """
+        mapcfg = srvcfg.get('config_mapping', {})
+        resALcfg = srvcfg.get('resAL_mapping', {})
+        resALreg = srvcfg.get('resAL_library', {})
 
-        mapdirprefix = ''
+        realmtrie = [{}, None]
+        for mapdirprefix in mapcfg:
+            resourceAL = resALreg.get('*', None) # default set up mainappwrapper.py
+            if mapdirprefix in resALcfg:
+                if resALcfg[mapdirprefix] in resALreg:
+                    resourceAL = resALreg[resALcfg[mapdirprefix]]
 
-        for tmp_mapdirprefix in mapcfgkeys:
             # @@: Case sensitivity should be an option of some sort here; 
             #     os.path.normpath might give the prefered case for a filename.
-            if requestpath.upper() == tmp_mapdirprefix.upper() or requestpath.upper().startswith(tmp_mapdirprefix.upper() + "/"):
-                mapdirprefix = tmp_mapdirprefix   
+            node = realmtrie
+            for segment in mapdirprefix.upper().split('/'):
+                node = node[_CHILDREN].setdefault(segment, [{}, None])
+            if node[_REALM] is None:
+                node[_REALM] = (mapdirprefix, mapcfg[mapdirprefix], resourceAL)
+        return realmtrie
+
+    def invalidateMetadata(self, resourceAL, mappedpath):
+        """
+        Forgets the resolved paths, to be called when resources at or below
+        mappedpath are created, removed or replaced (see 
+        RequestServer.addMetadataListener). 
+        """
+        # the cached paths are keyed by url, one resource may be cached under
+        # several urls - forget them all, writes changing collections are rare.
+        # Cached paths of other configurations are keyed by their own realm 
+        # tuples, and just drop out of the cache
+        if self._pathcache is not None:
+            self._pathcachelock.acquire()
+            try:
+                self._pathcachegeneration += 1
+                self._pathcache.clear()
+            finally:
+                self._pathcachelock.release()
+
+    def getCacheStats(self):
+        if self._pathcache is None:
+            return None
+        return {'hits': self._pathcache.hits, 'misses': self._pathcache.misses, 'size': len(self._pathcache)}
+
+    def findRealm(self, requestpath, realmtrie=None):
+        """
+        returns (realm name, local path, resource abstraction layer) of the 
+        realm with the longest name matching the beginning of requestpath
+        (whole path segments, case-insensitive), or None. Searches the most
+        recently compiled realms if realmtrie is not given.
+        """
+        node = realmtrie
+        if node is None:
+            node = self._compiled[1]
+        realm = None
+        for segment in requestpath.upper().split('/'):
+            node = node[_CHILDREN].get(segment, None)
+            if node is None:
                 break
-        else:
+            if node[_REALM] is not None:
+                realm = node[_REALM]
+        return realm
+
+    def resolveRealmURI(self, srvcfg, requestpath):
+
+        (compiledcfg, realmtrie) = self._compiled
+        if srvcfg is not compiledcfg:
+            if compiledcfg is None:
+                realmtrie = self.compileRealms(srvcfg)
+            else:
+                # not the current configuration (a request started before a
+                # reload): compiled for this request only, a reload running
+                # meanwhile must not lose the trie it just compiled
+                realmtrie = self.buildRealmTrie(srvcfg)
+
+        realm = self.findRealm(requestpath, realmtrie)
+        if realm is None:
             # leaving it to caller function to raise exception - different exception
             # applicable for resolving base or destination urls.
             return (None, None, None, None)
-
-        resourceAL = resALreg['*'] # default set up mainappwrapper.py
-        if mapdirprefix in resALcfg:
-            if resALcfg[mapdirprefix] in resALreg:
-                resourceAL = resALreg[resALcfg[mapdirprefix]]
-
+        (mapdirprefix, localheadpath, resourceAL) = realm
         
         # no security risk here - the relativepath (part of the URL) is canonized using
         # normpath, and then the share directory name is added. So it is not possible to 
         # use ..s to peruse out of the share directory.
         relativepath = requestpath[len(mapdirprefix):]
-        localheadpath = mapcfg[mapdirprefix]
         
         if relativepath.strip("/") == "":
             return (mapdirprefix, localheadpath, mapdirprefix + "/", resourceAL) 
+
+        if self._pathcache is not None:
+            resolved = self._pathcache.get((realm, relativepath))
+            if resolved is not None:
+                return (mapdirprefix, resolved[0], resolved[1], resourceAL)
+            generation = self._pathcachegeneration
          
         mappedpath = resourceAL.resolvePath(localheadpath, relativepath.strip("/").split("/"))  
         displaypathlist = resourceAL.breakPath(localheadpath, mappedpath)
@@ -287,6 +395,14 @@ class RequestResolver(object):
         if resourceAL.isCollection(mappedpath): 
             displaypath = displaypath + "/"
 
+        if self._pathcache is not None:
+            self._pathcachelock.acquire()
+            try:
+                if generation == self._pathcachegeneration:
+                    self._pathcache.set((realm, relativepath), (mappedpath, displaypath))
+            finally:
+                self._pathcachelock.release()
+
         return (mapdirprefix, mappedpath, displaypath, resourceAL)    
 
     
@@ -0,0 +1,233 @@
+"""
+uploadsessions
+==============
+
+:Module: pyfileserver.uploadsessions
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+Upload sessions for uploading very large files as numbered parts over several
+concurrent connections.
+
+A session is opened for a target resource, the parts are PUT in any order and
+concurrently, and the session is committed, which replaces the resource with
+the uploaded data in one step. The parts are written at their offsets into the
+staging file of the resource abstraction layer (see ``supportPartialWrites``
+in the abstraction layer interface), which is preallocated to the full length
+when the session is opened.
+
+Protocol, all on the URL of the target resource::
+
+   POST <url>?uploads
+   X-Upload-Length: <total length in bytes>
+   X-Upload-Part-Size: <part size in bytes, optional>
+      opens a session. Response 201 Created with the headers
+      X-Upload-Session (the session id), X-Upload-Part-Size and
+      X-Upload-Parts (the number of parts)
+
+   PUT <url>?uploadsession=<id>&part=<n>
+      uploads part n (1 to X-Upload-Parts), which is X-Upload-Part-Size bytes
+      long except for the last part. Parts may be sent again.
+
+   POST <url>?uploadsession=<id>&commit
+      replaces the resource with the uploaded data once all parts have been
+      received (409 Conflict otherwise)
+
+   POST <url>?uploadsession=<id>&abort
+      discards the session and its data
+
+Lock and HTTP conditional checks of a PUT apply when the session is opened and
+when it is committed. Only the user that opened a session may use it.
+
+A resource is uploaded by one session or resumable PUT (with Content-Range)
+at a time: opening a session while another upload of the resource is in
+progress is answered with 409 Conflict, so that its data is not discarded.
+
+Sessions that have not seen a request for ``timeout`` seconds are aborted by a
+background sweeper thread. Sessions are kept in memory only, so sessions of a
+server that is restarted are lost; their staging files remain as a partial
+upload of the resource, which may be completed with Content-Range PUTs.
+
+Usage::
+
+   from pyfileserver.uploadsessions import UploadSessionManager
+   uploadsessionmanager = UploadSessionManager(timeout, defaultpartsize)
+   application = RequestServer(propertymanager, lockmanager, jobmanager,
+                               uploadsessionmanager)
+
+Interface
+---------
+
+Classes:
+
++ 'UploadSession': State of a single upload session
+
++ 'UploadSessionManager': Sessions in progress and the sweeper thread
+
+This module is specific to the PyFileServer application.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import os
+import time
+import threading
+import binascii
+
+from processrequesterrorhandler import HTTPRequestException
+import processrequesterrorhandler
+
+DEFAULT_PART_SIZE = 8388608
+MIN_PART_SIZE = 65536
+
+
+class UploadSession(object):
+    def __init__(self, sessionid, resourceAL, mappedpath, displaypath, username, totallength, partsize):
+        self.sessionid = sessionid
+        self.resourceAL = resourceAL
+        self.mappedpath = mappedpath
+        self.displaypath = displaypath
+        self.username = username
+        self.totallength = totallength
+        self.partsize = partsize
+        self.numparts = (totallength + partsize - 1) // partsize
+        self.created = time.time()
+        self.lastactivity = self.created
+        self.activeparts = 0
+
+    def getPartRange(self, partnumber):
+        # returns (rangestart, rangeend) of the 1-based part
+        if partnumber < 1 or partnumber > self.numparts:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+        rangestart = (partnumber - 1) * self.partsize
+        rangeend = min(rangestart + self.partsize, self.totallength) - 1
+        return (rangestart, rangeend)
+
+    def isComplete(self):
+        uploadstatus = self.resourceAL.getUploadStatus(self.mappedpath)
+        return uploadstatus is not None and uploadstatus[1] == [(0, self.totallength - 1)]
+
+
+class UploadSessionManager(object):
+    def __init__(self, timeout=3600, defaultpartsize=DEFAULT_PART_SIZE, sweepinterval=60):
+        self._timeout = timeout
+        self._defaultpartsize = defaultpartsize
+        self._sweepinterval = sweepinterval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def createSession(self, resourceAL, mappedpath, displaypath, username, totallength, partsize=None):
+        if partsize is None:
+            partsize = self._defaultpartsize
+        if totallength <= 0 or partsize < MIN_PART_SIZE:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_BAD_REQUEST)
+
+        if resourceAL.getUploadStatus(mappedpath) is not None:
+            # a resumable PUT (or another session) is using the staging file
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_CONFLICT)
+
+        self._lock.acquire()
+        try:
+            self._startSweeper()
+            for session in self._sessions.values():
+                if session.resourceAL is resourceAL and session.mappedpath == mappedpath:
+                    # the staging file of a resource holds one upload at a time
+                    raise HTTPRequestException(processrequesterrorhandler.HTTP_CONFLICT)
+            session = UploadSession(binascii.hexlify(os.urandom(16)), resourceAL, mappedpath, displaypath, username, totallength, partsize)
+            self._sessions[session.sessionid] = session
+        finally:
+            self._lock.release()
+
+        try:
+            # preallocate the staging file
+            resourceAL.openResourceRangeForWrite(mappedpath, 0, totallength).close()
+        except:
+            self._removeSession(session)
+            raise
+        return session
+
+    def getSession(self, sessionid, mappedpath, username):
+        self._lock.acquire()
+        try:
+            session = self._sessions.get(sessionid, None)
+        finally:
+            self._lock.release()
+        if session is None or session.mappedpath != mappedpath:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+        if session.username != username:
+            raise HTTPRequestException(processrequesterrorhandler.HTTP_FORBIDDEN)
+        session.lastactivity = time.time()
+        return session
+
+    def beginPart(self, session):
+        self._lock.acquire()
+        try:
+            if session.sessionid not in self._sessions:
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+            session.activeparts += 1
+        finally:
+            self._lock.release()
+
+    def endPart(self, session):
+        self._lock.acquire()
+        try:
+            session.activeparts -= 1
+            session.lastactivity = time.time()
+        finally:
+            self._lock.release()
+
+    def commitSession(self, session):
+        self._lock.acquire()
+        try:
+            if session.sessionid not in self._sessions:
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_NOT_FOUND)
+            if session.activeparts > 0 or not session.isComplete():
+                raise HTTPRequestException(processrequesterrorhandler.HTTP_CONFLICT)
+            del self._sessions[session.sessionid]
+        finally:
+            self._lock.release()
+        session.resourceAL.commitUpload(session.mappedpath)
+
+    def abortSession(self, session):
+        if self._removeSession(session):
+            session.resourceAL.abortUpload(session.mappedpath)
+
+    def _removeSession(self, session):
+        self._lock.acquire()
+        try:
+            return self._sessions.pop(session.sessionid, None) is not None
+        finally:
+            self._lock.release()
+
+    def sweep(self):
+        expiretime = time.time() - self._timeout
+        self._lock.acquire()
+        try:
+            expiredsessions = [session for session in self._sessions.values() if session.activeparts == 0 and session.lastactivity < expiretime]
+            for session in expiredsessions:
+                del self._sessions[session.sessionid]
+        finally:
+            self._lock.release()
+        for session in expiredsessions:
+            try:
+                session.resourceAL.abortUpload(session.mappedpath)
+            except Exception:
+                pass # the staging file remains as a partial upload
+        return len(expiredsessions)
+
+    def getSessionCount(self):
+        return len(self._sessions)
+
+    def _startSweeper(self):
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweeperLoop, name='pyfileserver-upload-sweeper')
+            self._sweeper.setDaemon(True)
+            self._sweeper.start()
+
+    def _sweeperLoop(self):
+        while True:
+            time.sleep(self._sweepinterval)
+            self.sweep()
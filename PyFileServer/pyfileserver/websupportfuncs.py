@@ -23,6 +23,7 @@ This module consists of miscellaneous support functions for PyFileServer::
 
    interpret content range header
       obtainContentRanges(rangetext, filesize)
+      obtainContentRange(contentrangetext)
    
    evaluate HTTP If-Match, if-None-Match, If-Modified-Since, If-Unmodified-Since headers   
       evaluateHTTPConditionals(lastmodifiedsecs, entitytag, environ, isnewfile=False)
@@ -176,6 +177,24 @@ def obtainContentRanges(rangetext, filesize):
 
     return (listReturn2, totallength)
 
+reContentRange = re.compile(r"^\s*bytes\s+([0-9]+)\-([0-9]+)/([0-9]+)\s*$")
+
+def obtainContentRange(contentrangetext):
+    """
+   returns tuple (abs position of first byte, abs position of last byte, total length)
+   for a Content-Range request header, or None if it is not a valid byte range
+   within a known total length
+   """
+    mObj = reContentRange.match(contentrangetext)
+    if not mObj:
+        return None
+    firstpos = long(mObj.group(1))
+    lastpos = long(mObj.group(2))
+    totallength = long(mObj.group(3))
+    if firstpos > lastpos or lastpos >= totallength:
+        return None
+    return (firstpos, lastpos, totallength)
+
 #
 #def evaluateHTTPConditionalsWithoutExceptions(lastmodified, entitytag, environ, isnewfile=False):
 #    ## Conditions
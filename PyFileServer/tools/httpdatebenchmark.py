@@ -0,0 +1,99 @@
+"""
+httpdatebenchmark
+=================
+
+:Module: tools.httpdatebenchmark
+:Author: Ho Chun Wei, fuzzybr80(at)gmail.com
+:Project: PyFileServer, http://pyfilesync.berlios.de/
+:Copyright: Lesser GNU Public License, see LICENSE file attached with package
+
+Times the date helpers of ``pyfileserver.httpdatehelper`` against the
+time.strftime / time.strptime versions they replaced, which are kept below
+for the comparison.
+
+Usage::
+
+   python tools/httpdatebenchmark.py [number of calls, default 100000]
+
+For each case the seconds taken by the calls, best of three runs, are
+printed for the old and the new helper, with the speedup. The cases are
+formatting the current time (every response), formatting a few recurring
+times (modification times listed by PROPFIND) and parsing each of the
+three date formats (If-Modified-Since and similar headers).
+
+"""
+__docformat__ = 'reStructuredText'
+
+import os
+import sys
+import time
+import calendar
+import timeit
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pyfileserver import httpdatehelper
+
+REPEAT = 3
+DEFAULT_NUMBER = 100000
+
+
+def oldgetstrftime(secs=None):
+   # rfc 1123 date/time format
+   return time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(secs))
+
+def oldgetsecstime(timeformat):
+   result = oldgetgmtime(timeformat)
+   if result:
+      return calendar.timegm(result)
+   else:
+      return None
+
+def oldgetgmtime(timeformat):
+   for dateformat in ('%a, %d %b %Y %H:%M:%S GMT', '%A %d-%b-%y %H:%M:%S GMT', '%a %b %d %H:%M:%S %Y'):
+      try:
+         return time.strptime(timeformat, dateformat)
+      except:
+         pass
+   return None
+
+
+MODIFIED_TIMES = [784111777 + 86400 * i for i in range(50)]
+DATE_STRINGS = [('parse RFC 1123', 'Sun, 06 Nov 1994 08:49:37 GMT'),
+                ('parse RFC 850', 'Sunday 06-Nov-94 08:49:37 GMT'),
+                ('parse asctime', 'Sun Nov  6 08:49:37 1994')]
+
+
+def getCases(getstrftime, getsecstime):
+   # returns [(case name, function making one call)]
+   modifiedtimes = itertools.cycle(MODIFIED_TIMES)
+   cases = [('format current time', getstrftime),
+            ('format listed times', lambda: getstrftime(modifiedtimes.next()))]
+   for (name, datestring) in DATE_STRINGS:
+      cases.append((name, lambda datestring=datestring: getsecstime(datestring)))
+   return cases
+
+
+def run(number):
+   # the old and new helpers must agree before they are compared
+   for (name, datestring) in DATE_STRINGS:
+      assert oldgetsecstime(datestring) == httpdatehelper.getsecstime(datestring), datestring
+   for secs in MODIFIED_TIMES:
+      assert oldgetstrftime(secs) == httpdatehelper.getstrftime(secs), secs
+
+   print '%d calls, best of %d runs' % (number, REPEAT)
+   print '%-22s %10s %10s %8s' % ('case', 'old (s)', 'new (s)', 'speedup')
+   oldcases = getCases(oldgetstrftime, oldgetsecstime)
+   newcases = getCases(httpdatehelper.getstrftime, httpdatehelper.getsecstime)
+   for ((name, oldcall), (name, newcall)) in zip(oldcases, newcases):
+      old = min(timeit.Timer(oldcall).repeat(REPEAT, number))
+      new = min(timeit.Timer(newcall).repeat(REPEAT, number))
+      print '%-22s %10.3f %10.3f %7.1fx' % (name, old, new, old / new)
+
+
+if __name__ == '__main__':
+   number = DEFAULT_NUMBER
+   if len(sys.argv) > 1:
+      number = int(sys.argv[1])
+   run(number)